@@ -0,0 +1,462 @@
+"""Micro-benchmarks for the valuation, conversion and cost-analysis paths.
+
+Each benchmark generates a synthetic input, then times the target function
+several times and measures its peak traced memory in one extra run (tracing
+slows the code down, so it is never mixed with the timed runs).
+
+Example:
+    python benchmarks/bench_hot_paths.py --scale 1 -o results.json
+    python benchmarks/bench_hot_paths.py --compare results.json
+"""
+import argparse
+import bisect
+import datetime
+import decimal
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.pardir)
+sys.path.append(_REPO_ROOT)
+sys.path.append(os.path.join(_REPO_ROOT, 'cost_analysis'))
+
+import yaml
+
+import ftx
+from models import portfolio_model
+from models import symbol_model
+from models import symbol_registry
+import perp_live
+import rolling_stats
+import spot_from_csv
+
+
+_RANDOM_SEED = 20211001
+
+# Sizes at --scale 1.
+_NUM_PORTFOLIOS = 1000
+_ASSETS_PER_PORTFOLIO = 100
+_NUM_CSV_ROWS = 2_000_000
+_NUM_FILLS = 200_000
+_NUM_REGISTRY_SYMBOLS = 50_000
+_NUM_SYMBOL_LOOKUPS = 200_000
+_NUM_REGISTRY_OPENS = 1000
+
+_CSV_ASSETS = ('BTC', 'ETH', 'SOL', 'FTT', 'RAY', 'SRM')
+_CSV_MARKETS = tuple(f'{base}/{quote}'
+                     for base in _CSV_ASSETS + ('DOGE',)
+                     for quote in ('USD', 'USDT', 'BTC'))
+_CSV_HEADER = ('"id","time","market","side","order type","size","price",'
+               '"total","fee","feeCurrency"\n')
+
+_FILLS_START_TIMESTAMP = 1577836800
+
+
+class Benchmark:
+    """A named benchmark: `setup()` builds the input, `run(input)` is timed.
+
+    `run` returns the number of items processed, used for throughput.
+    """
+
+    def __init__(self,
+                 name: str,
+                 setup: Callable[[], Any],
+                 run: Callable[[Any], int],
+                 teardown: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.teardown = teardown
+
+
+def _time_benchmark(benchmark: Benchmark, repeat: int) -> Dict[str, Any]:
+    data = benchmark.setup()
+    try:
+        timings = []
+        num_items = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            num_items = benchmark.run(data)
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        benchmark.run(data)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        if benchmark.teardown is not None:
+            benchmark.teardown(data)
+
+    best = min(timings)
+    return {
+        'items': num_items,
+        'repeat': repeat,
+        'seconds_best': best,
+        'seconds_median': statistics.median(timings),
+        'items_per_second': num_items / best if best else None,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Portfolio valuation.
+# ---------------------------------------------------------------------------
+
+def _synthetic_rates() -> portfolio_model.RATES_TYPE_ALIAS:
+    rng = random.Random(_RANDOM_SEED)
+    rates = {}
+    for symbol in symbol_model.all_symbols():
+        target = symbol_model.SYMBOL_TYPES_DEFAULT_QUOTE_SYMBOL[
+            symbol.symbol_type]
+        rate = (decimal.Decimal('1') if symbol == target
+                else decimal.Decimal(f'{rng.uniform(0.001, 60000):.6f}'))
+        rates[(symbol, target)] = rate
+    return rates
+
+
+def _write_portfolio_yaml(scale: float) -> str:
+    rng = random.Random(_RANDOM_SEED)
+    symbols = [symbol.full_name for symbol in symbol_model.all_symbols()]
+    portfolios = []
+    for i in range(max(1, int(_NUM_PORTFOLIOS * scale))):
+        portfolios.append({
+            'name': f'Portfolio {i}',
+            'assets': [
+                {'symbol': rng.choice(symbols),
+                 'quantity': f'{rng.uniform(0, 1000):.8f}'}
+                for _ in range(_ASSETS_PER_PORTFOLIO)],
+        })
+    fd, path = tempfile.mkstemp(suffix='.yaml', prefix='bench_portfolios_')
+    with os.fdopen(fd, 'w') as f:
+        yaml.safe_dump({'Portfolios': portfolios}, f)
+    return path
+
+
+def _load_portfolios(path: str) -> List[portfolio_model.Portfolio]:
+    with open(path, 'r') as f:
+        data = yaml.safe_load(f)
+    return [portfolio_model.Portfolio.from_dict(portfolio_data)
+            for portfolio_data in data['Portfolios']]
+
+
+def _portfolio_benchmarks(scale: float) -> List[Benchmark]:
+
+    def setup_yaml():
+        return _write_portfolio_yaml(scale)
+
+    def run_load(path):
+        portfolios = _load_portfolios(path)
+        return sum(len(p.assets) for p in portfolios)
+
+    def setup_portfolios():
+        path = _write_portfolio_yaml(scale)
+        try:
+            return _load_portfolios(path), _synthetic_rates()
+        finally:
+            os.remove(path)
+
+    def run_convert(data):
+        portfolios, rates = data
+        return sum(len(p.convert(rates)) for p in portfolios)
+
+    def run_calculate_totals(data):
+        portfolios, rates = data
+        for portfolio in portfolios:
+            portfolio.calculate_totals(rates)
+        return sum(len(p.assets) for p in portfolios)
+
+    return [
+        Benchmark('portfolio_yaml_load', setup_yaml, run_load, os.remove),
+        Benchmark('portfolio_convert', setup_portfolios, run_convert),
+        Benchmark('portfolio_calculate_totals', setup_portfolios,
+                  run_calculate_totals),
+    ]
+
+
+# ---------------------------------------------------------------------------
+# FTX CSV parsing.
+# ---------------------------------------------------------------------------
+
+def _iso_time(timestamp: float) -> str:
+    dt = datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+    return dt.isoformat(timespec='microseconds')
+
+
+def _write_ftx_csv(scale: float) -> Tuple[str, int]:
+    rng = random.Random(_RANDOM_SEED)
+    fd, path = tempfile.mkstemp(suffix='.csv', prefix='bench_ftx_')
+    with os.fdopen(fd, 'w') as f:
+        f.write(_CSV_HEADER)
+        timestamp = float(_FILLS_START_TIMESTAMP)
+        num_rows = max(1, int(_NUM_CSV_ROWS * scale))
+        for i in range(num_rows):
+            timestamp += rng.uniform(0, 30)
+            market = rng.choice(_CSV_MARKETS)
+            side = rng.choice(('buy', 'sell'))
+            size = rng.uniform(0.001, 100)
+            price = rng.uniform(0.01, 60000)
+            f.write(f'"{i}","{_iso_time(timestamp)}","{market}","{side}",'
+                    f'"limit","{size:.6f}","{price:.4f}",'
+                    f'"{size * price:.4f}","0.0","USD"\n')
+    return path, num_rows
+
+
+def _csv_benchmarks(scale: float) -> List[Benchmark]:
+
+    def setup():
+        return _write_ftx_csv(scale)
+
+    def run(data):
+        path, num_rows = data
+        decimal.getcontext().prec = 8
+        spot_from_csv.get_multiple_spot_stats(path, list(_CSV_ASSETS))
+        return num_rows
+
+    def run_rolling(data):
+        path, num_rows = data
+        decimal.getcontext().prec = 8
+        stats = rolling_stats.RollingStats()
+        stats.add_all(spot_from_csv.iter_csv_fills(path, _CSV_ASSETS))
+        return num_rows
+
+    def teardown(data):
+        os.remove(data[0])
+
+    return [Benchmark('spot_from_csv_get_multiple_spot_stats',
+                      setup, run, teardown),
+            Benchmark('rolling_stats_from_csv', setup, run_rolling,
+                      teardown)]
+
+
+# ---------------------------------------------------------------------------
+# FTX fills pagination and stats aggregation.
+# ---------------------------------------------------------------------------
+
+def _synthetic_fills(scale: float) -> List[Dict[str, Any]]:
+    """Returns fills sorted newest first, like the FTX `/fills` endpoint."""
+    rng = random.Random(_RANDOM_SEED)
+    fills = []
+    timestamp = float(_FILLS_START_TIMESTAMP)
+    for i in range(max(1, int(_NUM_FILLS * scale))):
+        timestamp += rng.uniform(0.001, 30)
+        time_str = _iso_time(timestamp)
+        fills.append({
+            'id': i,
+            'market': 'BTC-PERP',
+            'side': rng.choice(('buy', 'sell')),
+            'size': round(rng.uniform(0.0001, 5), 4),
+            'price': round(rng.uniform(10000, 60000), 1),
+            'time': time_str,
+            '_ts': ftx.iso_8601_to_timestamp(time_str),
+        })
+    fills.reverse()
+    return fills
+
+
+class _FakeFillsResponse:
+
+    def __init__(self, fills: List[Dict[str, Any]]):
+        self._data = {'success': True, 'result': fills}
+
+    def json(self) -> Dict[str, Any]:
+        return self._data
+
+
+class _PagedFtxClient(ftx.FtxClient):
+    """FtxClient serving `/fills` pages from memory instead of the network."""
+
+    def __init__(self, fills: List[Dict[str, Any]]):
+        super().__init__()
+        self._fills = fills
+        # Ascending negated timestamps, so that bisect works on the
+        # newest-first list. `end_time` is treated as exclusive.
+        self._neg_timestamps = [-fill['_ts'] for fill in fills]
+        self.num_requests = 0
+
+    def _request_wrapper(self, *, method, endpoint, params=None, **kwargs):
+        self.num_requests += 1
+        end_time = (params or {}).get('end_time')
+        start = (0 if end_time is None
+                 else bisect.bisect_right(self._neg_timestamps, -end_time))
+        page = self._fills[start:start + self._USER_FILLS_RESPONSE_PAGE_SIZE]
+        return _FakeFillsResponse(page)
+
+
+class _StaticFillsFtxClient:
+
+    def __init__(self, fills: List[Dict[str, Any]]):
+        self._fills = fills
+
+    def get_user_trades(self, **kwargs) -> List[Dict[str, Any]]:
+        return self._fills
+
+
+def _fills_benchmarks(scale: float) -> List[Benchmark]:
+
+    def setup():
+        return _synthetic_fills(scale)
+
+    def run_pagination(fills):
+        client = _PagedFtxClient(fills)
+        return len(client.get_user_trades(market_name='BTC-PERP'))
+
+    def run_aggregation(fills):
+        decimal.getcontext().prec = 8
+        client = _StaticFillsFtxClient(fills)
+        stats = perp_live.get_perp_stats('BTC', client, 0, 0)
+        return stats.num_transactions
+
+    return [
+        Benchmark('ftx_get_user_trades_pagination', setup, run_pagination),
+        Benchmark('cost_and_earn_stats_aggregation', setup, run_aggregation),
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Symbol registry.
+# ---------------------------------------------------------------------------
+
+def _write_symbols_file(scale: float) -> Tuple[str, List[str]]:
+    """Writes a symbols file of `_NUM_REGISTRY_SYMBOLS` stocks, compiled."""
+    rng = random.Random(_RANDOM_SEED)
+    full_names = set()
+    while len(full_names) < max(1, int(_NUM_REGISTRY_SYMBOLS * scale)):
+        name = ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+                       for _ in range(rng.randint(2, 6)))
+        full_names.add(f'US_STOCK.{name}')
+    fd, path = tempfile.mkstemp(suffix='.txt', prefix='bench_symbols_')
+    with os.fdopen(fd, 'w') as f:
+        f.writelines(f'{full_name}\n' for full_name in full_names)
+    # Compiles the index once, like the first run after an update.
+    symbol_registry.SymbolRegistry(path).get(next(iter(full_names)))
+    return path, sorted(full_names)
+
+
+def _symbol_registry_benchmarks(scale: float) -> List[Benchmark]:
+
+    def setup():
+        return _write_symbols_file(scale)
+
+    def run_lookups(data):
+        path, full_names = data
+        rng = random.Random(_RANDOM_SEED)
+        registry = symbol_registry.SymbolRegistry(path)
+        num_lookups = max(1, int(_NUM_SYMBOL_LOOKUPS * scale))
+        for _ in range(num_lookups):
+            registry.get(rng.choice(full_names))
+        return num_lookups
+
+    def run_opens(data):
+        path, full_names = data
+        for _ in range(_NUM_REGISTRY_OPENS):
+            symbol_registry.SymbolRegistry(path).get(full_names[0])
+        return _NUM_REGISTRY_OPENS
+
+    def teardown(data):
+        os.remove(data[0])
+        os.remove(data[0] + '.idx')
+
+    return [
+        Benchmark('symbol_registry_lookup', setup, run_lookups, teardown),
+        Benchmark('symbol_registry_open', setup, run_opens, teardown),
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Entry point.
+# ---------------------------------------------------------------------------
+
+def _all_benchmarks(scale: float) -> List[Benchmark]:
+    return (_portfolio_benchmarks(scale) +
+            _csv_benchmarks(scale) +
+            _fills_benchmarks(scale) +
+            _symbol_registry_benchmarks(scale))
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=_REPO_ROOT, capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_comparison(results: Dict[str, Dict[str, Any]],
+                      baseline: Dict[str, Dict[str, Any]]) -> None:
+    print(f'\n{"benchmark":42} {"time":>9} {"memory":>9}')
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        time_ratio = result['seconds_best'] / baseline[name]['seconds_best']
+        memory_ratio = (result['peak_memory_bytes'] /
+                        max(1, baseline[name]['peak_memory_bytes']))
+        print(f'{name:42} {time_ratio:>8.2f}x {memory_ratio:>8.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--scale',
+                        type=float,
+                        default=1.0,
+                        help='Multiplier applied to every input size.')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=3,
+                        help='Number of timed runs per benchmark.')
+    parser.add_argument('--only',
+                        nargs='+',
+                        default=None,
+                        help='Only run benchmarks whose name contains one of '
+                             'these substrings.')
+    parser.add_argument('-o',
+                        '--output',
+                        default=None,
+                        help='Path to write the JSON results to.')
+    parser.add_argument('--compare',
+                        default=None,
+                        help='A previous JSON results file to compare with.')
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for benchmark in _all_benchmarks(args.scale):
+        if args.only and not any(s in benchmark.name for s in args.only):
+            continue
+        result = _time_benchmark(benchmark, args.repeat)
+        results[benchmark.name] = result
+        print(f'{benchmark.name:42} '
+              f'{result["seconds_best"]:9.3f}s '
+              f'{result["items_per_second"] or 0:14,.0f} items/s '
+              f'{result["peak_memory_bytes"] / 2**20:9.1f} MiB peak')
+
+    report = {
+        'metadata': {
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': args.scale,
+            'timestamp': int(time.time()),
+        },
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            _print_comparison(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
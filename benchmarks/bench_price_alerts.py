@@ -0,0 +1,192 @@
+"""Replay benchmark of the price-tick alert engine.
+
+Generates synthetic portfolios, alerts around their starting totals and a
+random walk of price ticks, records the ticks to a CSV file, then replays
+the file through `price_alerts.AlertEngine` and reports ticks/sec. The first
+`--verify` ticks are also replayed naively, recomputing every total with
+`Portfolio.calculate_totals` and checking every alert, and both must fire
+the same alerts.
+
+Example:
+    python benchmarks/bench_price_alerts.py --alerts 10000 --ticks 20000
+"""
+import argparse
+import decimal
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+_REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.pardir)
+sys.path.append(_REPO_ROOT)
+
+from models import asset_model
+from models import portfolio_model
+from models import symbol_model
+import price_alerts
+
+
+_RANDOM_SEED = 20211001
+_ASSETS_PER_PORTFOLIO = 20
+# A tick moves a price by up to this ratio.
+_MAX_TICK_MOVE = 0.002
+
+
+def _crypto_symbols() -> List[symbol_model.Symbol]:
+    return [symbol for symbol in symbol_model.all_symbols()
+            if symbol.symbol_type == symbol_model.SymbolType.CRYPTO]
+
+
+def _synthetic_portfolios(
+        rng: random.Random, count: int,
+        symbols: List[symbol_model.Symbol]) -> List[portfolio_model.Portfolio]:
+    return [
+        portfolio_model.Portfolio(
+            name=f'Portfolio {i}',
+            assets=[asset_model.Asset(
+                symbol=rng.choice(symbols),
+                quantity=decimal.Decimal(f'{rng.uniform(0, 100):.4f}'))
+                for _ in range(_ASSETS_PER_PORTFOLIO)])
+        for i in range(count)]
+
+
+def _synthetic_alerts(
+        rng: random.Random, count: int,
+        portfolios: List[portfolio_model.Portfolio],
+        rates: portfolio_model.RATES_TYPE_ALIAS) -> List[price_alerts.Alert]:
+    usd = symbol_model.get_symbol_from_full_name('FIAT.USD')
+    totals = {portfolio.name: portfolio.calculate_totals(rates)[0].quantity
+              for portfolio in portfolios}
+    alerts = []
+    for _ in range(count):
+        name = rng.choice(portfolios).name
+        level = totals[name] * decimal.Decimal(f'{rng.uniform(0.9, 1.1):.4f}')
+        alerts.append(price_alerts.Alert(
+            portfolio=name, symbol=usd,
+            direction=(price_alerts.ABOVE if level > totals[name]
+                       else price_alerts.BELOW),
+            level=level.quantize(decimal.Decimal('0.01'))))
+    return alerts
+
+
+def _record_ticks(rng: random.Random, count: int,
+                  prices: Dict[symbol_model.Symbol, float]) -> str:
+    fd, path = tempfile.mkstemp(suffix='.csv', prefix='bench_ticks_')
+    symbols = list(prices)
+    with os.fdopen(fd, 'w') as f:
+        f.write('time,symbol,price\n')
+        for i in range(count):
+            symbol = rng.choice(symbols)
+            prices[symbol] *= 1 + rng.uniform(-_MAX_TICK_MOVE, _MAX_TICK_MOVE)
+            f.write(f'{i},{symbol.full_name},{prices[symbol]:.6f}\n')
+    return path
+
+
+def _naive_replay(portfolios: List[portfolio_model.Portfolio],
+                  alerts: List[price_alerts.Alert],
+                  rates: portfolio_model.RATES_TYPE_ALIAS,
+                  ticks: List[Tuple[str, symbol_model.Symbol,
+                                    decimal.Decimal]]) -> List[Tuple]:
+    """Recomputes all totals and checks all alerts on every tick."""
+    usd = symbol_model.get_symbol_from_full_name('FIAT.USD')
+    rates = dict(rates)
+    by_name = {portfolio.name: portfolio for portfolio in portfolios}
+    totals = {name: portfolio.calculate_totals(rates)[0].quantity
+              for name, portfolio in by_name.items()}
+    fired = []
+    for time_text, symbol, price in ticks:
+        rates[(symbol, usd)] = price
+        new_totals = {name: portfolio.calculate_totals(rates)[0].quantity
+                      for name, portfolio in by_name.items()}
+        for alert in alerts:
+            old, new = totals[alert.portfolio], new_totals[alert.portfolio]
+            if (alert.direction == price_alerts.ABOVE and
+                    old < alert.level <= new) or (
+                    alert.direction == price_alerts.BELOW and
+                    new <= alert.level < old):
+                fired.append((time_text, alert))
+        totals = new_totals
+    return fired
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--portfolios', type=int, default=1000,
+                        help='Number of portfolios.')
+    parser.add_argument('--alerts', type=int, default=10000,
+                        help='Number of alerts.')
+    parser.add_argument('--ticks', type=int, default=20000,
+                        help='Number of recorded ticks to replay.')
+    parser.add_argument('--verify', type=int, default=50,
+                        help='Number of ticks also replayed naively.')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Path to write the JSON result to.')
+    args = parser.parse_args()
+
+    rng = random.Random(_RANDOM_SEED)
+    symbols = _crypto_symbols()
+    usd = symbol_model.get_symbol_from_full_name('FIAT.USD')
+    start_prices = {symbol: rng.uniform(0.01, 60000) for symbol in symbols}
+    rates = {(symbol, usd): decimal.Decimal(f'{price:.6f}')
+             for symbol, price in start_prices.items()}
+    portfolios = _synthetic_portfolios(rng, args.portfolios, symbols)
+    alerts = _synthetic_alerts(rng, args.alerts, portfolios, rates)
+    ticks_path = _record_ticks(rng, args.ticks, dict(start_prices))
+
+    try:
+        engine = price_alerts.AlertEngine(portfolios)
+        for alert in alerts:
+            engine.add_alert(alert)
+        engine.prime(rates)
+
+        fired = []
+        start = time.perf_counter()
+        with open(ticks_path, newline='') as f:
+            for time_text, symbol, price in price_alerts.read_ticks(f):
+                for trigger in engine.on_tick(symbol, price):
+                    fired.append((time_text, trigger.alert))
+        elapsed = time.perf_counter() - start
+
+        if args.verify:
+            with open(ticks_path, newline='') as f:
+                ticks = list(price_alerts.read_ticks(f))[:args.verify]
+            verify_start = time.perf_counter()
+            expected = _naive_replay(portfolios, alerts, rates, ticks)
+            naive_seconds_per_tick = ((time.perf_counter() - verify_start) /
+                                      max(1, len(ticks)))
+            last_time = ticks[-1][0] if ticks else None
+            actual = [(t, alert) for t, alert in fired
+                      if int(t) <= int(last_time)] if ticks else []
+            assert sorted(actual, key=repr) == sorted(expected, key=repr), (
+                len(actual), len(expected))
+    finally:
+        os.remove(ticks_path)
+
+    result = {
+        'portfolios': args.portfolios,
+        'alerts': args.alerts,
+        'ticks': args.ticks,
+        'triggers': len(fired),
+        'seconds': elapsed,
+        'ticks_per_second': args.ticks / elapsed,
+    }
+    print(f'{args.ticks} ticks, {args.portfolios} portfolios, {args.alerts} '
+          f'alerts: {len(fired)} triggers in {elapsed:.3f}s, '
+          f'{result["ticks_per_second"]:,.0f} ticks/s')
+    if args.verify:
+        result['naive_ticks_per_second'] = 1 / naive_seconds_per_tick
+        print(f'Naive replay of {args.verify} ticks agrees: '
+              f'{result["naive_ticks_per_second"]:,.0f} ticks/s')
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
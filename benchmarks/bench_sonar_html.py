@@ -0,0 +1,135 @@
+"""Throughput benchmark of the browserless Sonar dashboard parser.
+
+Generates synthetic rendered dashboards shaped like the real page (a large
+head with inline scripts, then sections with data tables), checks that the
+parser gets them right, and reports pages/sec and MB/s. With --workers, the
+pages are parsed by a process pool, like `grab_yield_farming.py --html`.
+
+Example:
+    python benchmarks/bench_sonar_html.py --pages 2000 --rows 20 --workers 0
+"""
+import argparse
+import html
+import json
+import random
+import os
+import sys
+import time
+from typing import List, Tuple
+
+_REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.pardir)
+sys.path.append(os.path.join(_REPO_ROOT, 'sonar_dashboard'))
+
+import sonar_dashboard
+
+
+_RANDOM_SEED = 20211001
+_SECTION_TITLES = ('Wallet tokens', 'Yield farming', 'Lending', 'History')
+_HEADERS = ('Asset', 'Platform', 'Balance', 'Value', 'APR')
+_HEAD_SCRIPT_BYTES = 50_000
+
+
+def _cell(rng: random.Random, header: str) -> str:
+    if header == 'Asset':
+        return rng.choice(('SOL', 'RAY', 'SRM', 'USDC')) + '-' + rng.choice(
+            ('USDC', 'USDT', 'SOL'))
+    if header == 'Platform':
+        return rng.choice(('Raydium', 'Orca', 'Saber', 'Tulip'))
+    return f'{rng.uniform(0, 10000):,.2f}'
+
+
+def _synthetic_page(rng: random.Random,
+                    rows_per_table: int) -> Tuple[str, List[List[str]]]:
+    """Returns (page HTML, expected "Yield farming" rows)."""
+    parts = ['<!DOCTYPE html><html><head><script>',
+             'x' * _HEAD_SCRIPT_BYTES,
+             '</script><style>.mt-6{margin-top:24px}</style></head>'
+             '<body><div id="app"><main class="v-main">']
+    expected: List[List[str]] = []
+    for title in _SECTION_TITLES:
+        parts.append('<div class="mt-6"><div class="d-flex">'
+                     f'<span class="text-h6 font-weight-bold">{title}</span>'
+                     '</div><div class="v-data-table theme--dark">'
+                     '<div class="v-data-table__wrapper"><table><thead><tr>')
+        for header in _HEADERS:
+            parts.append(f'<th role="columnheader"><span>{header}</span>'
+                         '<span class="v-data-table-header__icon">'
+                         '<i class="mdi mdi-arrow-up"></i></span></th>')
+        parts.append('</tr></thead><tbody>')
+        for _ in range(rows_per_table):
+            row = [_cell(rng, header) for header in _HEADERS]
+            if title == 'Yield farming':
+                expected.append(row)
+            parts.append('<tr>')
+            for value in row:
+                parts.append(f'<td class="text-start"><div>'
+                             f'{html.escape(value)}</div></td>')
+            parts.append('</tr>')
+        parts.append('</tbody></table></div></div></div>')
+    parts.append('</main></div><script>window.__NUXT__={}</script>'
+                 '</body></html>')
+    return ''.join(parts), expected
+
+
+def _yield_farming_rows(page: str) -> List[List[str]]:
+    sections = sonar_dashboard.get_sonar_dashboard_sections_from_html(
+        page, section_titles=('Yield farming',))
+    assert len(sections) == 1, sections
+    return [[row[header] for header in _HEADERS]
+            for row in sections[0].data_table.data_rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=500,
+                        help='Number of distinct synthetic pages.')
+    parser.add_argument('--rows', type=int, default=20,
+                        help='Rows per table.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of parsing processes; 0 for one per '
+                             'CPU.')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Path to write the JSON result to.')
+    args = parser.parse_args()
+
+    rng = random.Random(_RANDOM_SEED)
+    pages = [_synthetic_page(rng, args.rows) for _ in range(args.pages)]
+    total_bytes = sum(len(page.encode()) for page, _ in pages)
+
+    workers = args.workers or os.cpu_count()
+    start = time.perf_counter()
+    if workers > 1:
+        import concurrent.futures
+
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers) as executor:
+            all_rows = list(executor.map(
+                _yield_farming_rows, [page for page, _ in pages],
+                chunksize=max(1, len(pages) // (workers * 4))))
+    else:
+        all_rows = [_yield_farming_rows(page) for page, _ in pages]
+    elapsed = time.perf_counter() - start
+    for rows, (_, expected) in zip(all_rows, pages):
+        assert rows == expected, rows
+
+    result = {
+        'pages': args.pages,
+        'rows_per_table': args.rows,
+        'workers': workers,
+        'seconds': elapsed,
+        'pages_per_second': args.pages / elapsed,
+        'mb_per_second': total_bytes / 2**20 / elapsed,
+    }
+    print(f'{args.pages} pages ({total_bytes / 2**20:.1f} MiB) in '
+          f'{elapsed:.3f}s: {result["pages_per_second"]:.0f} pages/s, '
+          f'{result["mb_per_second"]:.1f} MiB/s')
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
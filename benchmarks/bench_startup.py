@@ -0,0 +1,162 @@
+"""Cold start benchmark of the entry points, with import-time budgets.
+
+Each entry point is run with `--help` in a fresh interpreter, so it imports
+what it imports at the top and exits. For each one this reports:
+
+- import_ms: the time spent importing the script's own imports, from
+  `python -X importtime`; the interpreter start-up (`site` and what comes
+  before it) is left out.
+- wall_ms: the wall time of the whole process.
+- Which of the heavy dependencies (requests, NumPy, PyYAML, telegram,
+  selenium, immutabledict, APScheduler) were imported.
+
+Both times are medians over --runs runs. With --check, the exit status is 1
+if an entry point goes over its import budget, or imports a heavy dependency
+it should only import when used.
+
+Example:
+    python benchmarks/bench_startup.py --runs 5 --check -o startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, NamedTuple, Set, Tuple
+
+_REPO_ROOT = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+_HEAVY_MODULES = frozenset(
+    ('requests', 'numpy', 'yaml', 'telegram', 'selenium', 'immutabledict',
+     'apscheduler'))
+
+
+class _EntryPoint(NamedTuple):
+    path: str
+    # Budget of import_ms. Generous, as machines differ; the heavy module
+    # check is the precise one.
+    budget_ms: float
+    # Heavy modules every run needs anyway, e.g. to read the portfolios.
+    allowed: Tuple[str, ...] = ()
+
+
+_ENTRY_POINTS = (
+    _EntryPoint('main.py', 150, ('yaml',)),
+    _EntryPoint('price_alerts.py', 150, ('yaml',)),
+    _EntryPoint('valuation_server.py', 150, ('yaml',)),
+    _EntryPoint('scenario.py', 300, ('numpy', 'yaml')),
+    _EntryPoint('price_history.py', 300, ('numpy', 'yaml')),
+    _EntryPoint('models/symbol_registry.py', 120),
+    _EntryPoint('cost_analysis/spot_from_csv.py', 120),
+    _EntryPoint('cost_analysis/spot_live.py', 120),
+    _EntryPoint('cost_analysis/perp_live.py', 120),
+    _EntryPoint('cost_analysis/rolling_stats.py', 120),
+    _EntryPoint('cost_analysis/reconcile.py', 120),
+    _EntryPoint('sonar_dashboard/grab_yield_farming.py', 120),
+    _EntryPoint('sonar_dashboard/yield_farming_telegram_notification.py',
+                120),
+    _EntryPoint('sonar_dashboard/yield_farming_scheduler.py', 120),
+    _EntryPoint('sonar_dashboard/yield_farming_store.py', 120),
+)
+
+
+def _parse_importtime(stderr: str) -> Tuple[float, Set[str]]:
+    """Returns the script's import time (ms) and the modules it imported."""
+    total_us = 0
+    modules = set()
+    after_site = False
+    for line in stderr.splitlines():
+        # "import time: <self us> | <cumulative us> | <indent><module>"
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # The header line.
+        name = fields[2][1:]
+        if not after_site:
+            after_site = name == 'site'
+            continue
+        modules.add(name.strip())
+        if not name.startswith(' '):
+            total_us += int(fields[1])
+    return total_us / 1000, modules
+
+
+def _run_once(entry_point: _EntryPoint) -> Tuple[float, float, Set[str]]:
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime',
+         os.path.join(_REPO_ROOT, entry_point.path), '--help'],
+        cwd=_REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if process.returncode != 0:
+        raise RuntimeError(f'{entry_point.path} --help failed:\n'
+                           f'{process.stderr[-2000:]}')
+    import_ms, modules = _parse_importtime(process.stderr)
+    return import_ms, wall_ms, modules
+
+
+def _measure(entry_point: _EntryPoint, runs: int) -> Dict[str, Any]:
+    import_times: List[float] = []
+    wall_times: List[float] = []
+    heavy: Set[str] = set()
+    for _ in range(runs):
+        import_ms, wall_ms, modules = _run_once(entry_point)
+        import_times.append(import_ms)
+        wall_times.append(wall_ms)
+        heavy |= _HEAVY_MODULES & modules
+    import_ms = statistics.median(import_times)
+    unexpected = sorted(heavy - set(entry_point.allowed))
+    return {
+        'import_ms': import_ms,
+        'wall_ms': statistics.median(wall_times),
+        'budget_ms': entry_point.budget_ms,
+        'heavy_modules': sorted(heavy),
+        'unexpected_modules': unexpected,
+        'ok': import_ms <= entry_point.budget_ms and not unexpected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Runs per entry point.')
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='Only run entry points whose path contains one '
+                             'of these substrings.')
+    parser.add_argument('--check', action='store_true',
+                        help='Exit with status 1 if a budget is exceeded.')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Path to write the JSON results to.')
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for entry_point in _ENTRY_POINTS:
+        if args.only and not any(s in entry_point.path for s in args.only):
+            continue
+        result = _measure(entry_point, args.runs)
+        results[entry_point.path] = result
+        problems = [f'{name} imported eagerly'
+                    for name in result['unexpected_modules']]
+        if result['import_ms'] > entry_point.budget_ms:
+            problems.append(f'over the {entry_point.budget_ms:.0f}ms budget')
+        print(f'{entry_point.path:56} '
+              f'{result["import_ms"]:7.1f}ms import '
+              f'{result["wall_ms"]:7.1f}ms wall '
+              f'{"OK" if result["ok"] else "FAIL: " + ", ".join(problems)}')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.check and not all(result['ok'] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
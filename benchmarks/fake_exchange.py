@@ -0,0 +1,496 @@
+"""A local fake exchange speaking the FTX, Binance and Huobi endpoints we use.
+
+One HTTP server serves all three exchanges under different path prefixes,
+and the batched quotes API of quote_providers.py for stocks and FIAT:
+
+    FTX_API_BASE_URL=http://127.0.0.1:<port>/ftx/api
+    BINANCE_API_BASE_URL=http://127.0.0.1:<port>/binance
+    HUOBI_API_BASE_URL=http://127.0.0.1:<port>/huobi
+    QUOTES_API_BASE_URL=http://127.0.0.1:<port>
+
+Faults are injected per request, in this order: rate limiting (HTTP 429),
+timeouts (the response is held back for `timeout_secs`), server errors
+(HTTP 500), then the sampled latency is applied to normal responses.
+Request counters are served as JSON from `/__stats`.
+
+Run standalone with:
+    python benchmarks/fake_exchange.py --port 8765 --error_rate 0.1
+"""
+import argparse
+import collections
+import dataclasses
+import datetime
+import hashlib
+import http
+import http.server
+import json
+import math
+import random
+import threading
+import time
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+import urllib.parse
+
+
+_FILLS_PAGE_SIZE = 20
+_FTX_MAX_CANDLES = 1501
+_BINANCE_MAX_KLINES = 1000
+_BINANCE_INTERVALS = {
+    '1m': 60, '5m': 300, '15m': 900, '1h': 3600, '4h': 14400, '1d': 86400}
+_FILLS_START_TIMESTAMP = 1609459200
+
+
+@dataclasses.dataclass
+class FakeExchangeConfig:
+    """Behaviour of the fake exchange."""
+
+    # "fixed:<secs>", "uniform:<low>,<high>", "exponential:<mean>" or
+    # "lognormal:<mu>,<sigma>" (the latter in log-seconds).
+    latency: str = 'fixed:0'
+    error_rate: float = 0.0
+    timeout_rate: float = 0.0
+    # How long a "timed out" request is held before answering. Should be
+    # longer than the client timeouts (3s in converter.py, 5s in ftx.py).
+    timeout_secs: float = 6.0
+    # Maximum requests per second across all endpoints. 0 disables limiting.
+    rate_limit_per_sec: float = 0.0
+    # Markets that are not listed anywhere, as "BASE/QUOTE" (e.g. "SBR/USD").
+    # Binance and Huobi use USDT for USD, so both spellings are unlisted.
+    unlisted_pairs: FrozenSet[str] = frozenset()
+    # Number of fills per FTX market served by `/fills`.
+    fills_per_market: int = 200
+    # FTX treats `end_time` as inclusive, so the last fill of a page comes
+    # back again as the first fill of the next page.
+    fills_end_time_inclusive: bool = True
+    seed: int = 0
+
+
+def _sample_latency(spec: str, rng: random.Random) -> float:
+    kind, _, raw_params = spec.partition(':')
+    params = [float(p) for p in raw_params.split(',') if p]
+    if kind == 'fixed':
+        return params[0] if params else 0.0
+    if kind == 'uniform':
+        return rng.uniform(params[0], params[1])
+    if kind == 'exponential':
+        return rng.expovariate(1.0 / params[0]) if params[0] > 0 else 0.0
+    if kind == 'lognormal':
+        return rng.lognormvariate(params[0], params[1])
+    raise ValueError(f'Unknown latency distribution: {spec}')
+
+
+def _price_for(base: str) -> float:
+    """A stable pseudo price for a base asset."""
+    digest = hashlib.sha256(base.encode()).digest()
+    return round(int.from_bytes(digest[:4], 'big') / 2**32 * 1000 + 0.01, 4)
+
+
+def _historical_price_for(base: str, timestamp: float) -> float:
+    """A stable pseudo price, oscillating around `_price_for` over days."""
+    phase = int.from_bytes(hashlib.sha256(base.encode()).digest()[4:6], 'big')
+    return round(_price_for(base) *
+                 (1 + 0.2 * math.sin(timestamp / 86400 / 7 + phase)), 4)
+
+
+def _iso_time(timestamp: float) -> str:
+    dt = datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+    return dt.isoformat(timespec='microseconds')
+
+
+class _TokenBucket:
+
+    def __init__(self, rate_per_sec: float):
+        self._rate = rate_per_sec
+        self._tokens = rate_per_sec
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._rate,
+                               self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class FakeExchange:
+    """Owns the HTTP server, the fault injection and the request counters."""
+
+    def __init__(self,
+                 config: FakeExchangeConfig,
+                 host: str = '127.0.0.1',
+                 port: int = 0):
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._rng_lock = threading.Lock()
+        self._bucket = (_TokenBucket(config.rate_limit_per_sec)
+                        if config.rate_limit_per_sec > 0 else None)
+        self._stats_lock = threading.Lock()
+        self._counts: Dict[Tuple[str, int], int] = collections.Counter()
+        self._fills_cache: Dict[str, List[Dict[str, Any]]] = {}
+        self._server = http.server.ThreadingHTTPServer(
+            (host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def client_env(self) -> Dict[str, str]:
+        """Environment variables that point our clients at this server."""
+        return {
+            'FTX_API_BASE_URL': f'{self.base_url}/ftx/api',
+            'BINANCE_API_BASE_URL': f'{self.base_url}/binance',
+            'HUOBI_API_BASE_URL': f'{self.base_url}/huobi',
+            'QUOTES_API_BASE_URL': self.base_url,
+        }
+
+    def start(self) -> 'FakeExchange':
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Returns request counts as {endpoint: {status: count}}."""
+        ret: Dict[str, Dict[str, int]] = collections.defaultdict(dict)
+        with self._stats_lock:
+            for (endpoint, status), count in sorted(self._counts.items()):
+                ret[endpoint][str(status)] = count
+        return dict(ret)
+
+    def reset_stats(self) -> None:
+        with self._stats_lock:
+            self._counts.clear()
+
+    def _record(self, endpoint: str, status: int) -> None:
+        with self._stats_lock:
+            self._counts[(endpoint, status)] += 1
+
+    def _random(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    def _latency(self) -> float:
+        with self._rng_lock:
+            return _sample_latency(self.config.latency, self._rng)
+
+    def _is_listed(self, base: str, quote: str) -> bool:
+        unlisted = self.config.unlisted_pairs
+        if quote == 'USDT' and f'{base}/USD' in unlisted:
+            return False
+        return f'{base}/{quote}' not in unlisted
+
+    def handle(self, path: str,
+               query: Dict[str, str]) -> Tuple[str, int, Dict[str, Any]]:
+        """Returns (endpoint name, HTTP status, JSON body) for a request.
+
+        Also sleeps for the injected latency or timeout.
+        """
+        endpoint, handler = self._route(path)
+        if endpoint is None:
+            return 'unknown', http.HTTPStatus.NOT_FOUND, {'error': 'Not found'}
+
+        if self._bucket is not None and not self._bucket.take():
+            return (endpoint, http.HTTPStatus.TOO_MANY_REQUESTS,
+                    _error_body(endpoint, 'Rate limit exceeded'))
+        if self._random() < self.config.timeout_rate:
+            time.sleep(self.config.timeout_secs)
+            return (endpoint, http.HTTPStatus.GATEWAY_TIMEOUT,
+                    _error_body(endpoint, 'Timed out'))
+        if self._random() < self.config.error_rate:
+            return (endpoint, http.HTTPStatus.INTERNAL_SERVER_ERROR,
+                    _error_body(endpoint, 'Internal error'))
+
+        latency = self._latency()
+        if latency > 0:
+            time.sleep(latency)
+        status, body = handler(path, query)
+        return endpoint, status, body
+
+    def _route(self, path: str):
+        if path.startswith('/ftx/api/markets/') and path.endswith('/candles'):
+            return 'ftx.candles', self._ftx_candles
+        if path.startswith('/ftx/api/markets/'):
+            return 'ftx.markets', self._ftx_market
+        if path == '/ftx/api/fills':
+            return 'ftx.fills', self._ftx_fills
+        if path == '/binance/api/v3/ticker/price':
+            return 'binance.ticker_price', self._binance_ticker_price
+        if path == '/binance/api/v3/klines':
+            return 'binance.klines', self._binance_klines
+        if path == '/huobi/market/detail/merged':
+            return 'huobi.detail_merged', self._huobi_detail_merged
+        if path == '/quotes':
+            return 'quotes', self._quotes
+        return None, None
+
+    def _ftx_market(self, path, query):
+        market_name = urllib.parse.unquote(path[len('/ftx/api/markets/'):])
+        base, _, quote = market_name.partition('/')
+        if not quote or not self._is_listed(base, quote):
+            return http.HTTPStatus.NOT_FOUND, {
+                'success': False,
+                'error': f'No such market: {market_name}'}
+        return http.HTTPStatus.OK, {
+            'success': True,
+            'result': {'name': market_name, 'last': _price_for(base)}}
+
+    def _ftx_candles(self, path, query):
+        market_name = urllib.parse.unquote(
+            path[len('/ftx/api/markets/'):-len('/candles')])
+        base, _, quote = market_name.partition('/')
+        if not quote or not self._is_listed(base, quote):
+            return http.HTTPStatus.NOT_FOUND, {
+                'success': False,
+                'error': f'No such market: {market_name}'}
+        resolution = int(query.get('resolution', 3600))
+        start_time = int(float(query.get('start_time', 0)))
+        end_time = int(float(query.get('end_time', time.time())))
+        # Both ends are inclusive, and only the latest candles are returned.
+        first = -(-start_time // resolution) * resolution
+        first = max(first, (end_time // resolution -
+                            _FTX_MAX_CANDLES + 1) * resolution)
+        candles = []
+        for open_time in range(first, end_time + 1, resolution):
+            close = _historical_price_for(base, open_time + resolution)
+            candles.append({'startTime': _iso_time(open_time),
+                            'time': open_time * 1000.0,
+                            'open': close, 'high': close, 'low': close,
+                            'close': close, 'volume': 0.0})
+        return http.HTTPStatus.OK, {'success': True, 'result': candles}
+
+    def _ftx_fills(self, path, query):
+        market_name = query.get('market', 'BTC/USD')
+        fills = self._fills_for_market(market_name)
+        start_time = float(query.get('start_time', 0))
+        end_time = float(query.get('end_time', float('inf')))
+        page = []
+        for fill in fills:  # Newest first.
+            ts = fill['_ts']
+            if ts > end_time or (ts == end_time and
+                                 not self.config.fills_end_time_inclusive):
+                continue
+            if ts < start_time:
+                break
+            page.append({k: v for k, v in fill.items() if k != '_ts'})
+            if len(page) == _FILLS_PAGE_SIZE:
+                break
+        return http.HTTPStatus.OK, {'success': True, 'result': page}
+
+    def _fills_for_market(self, market_name: str) -> List[Dict[str, Any]]:
+        with self._stats_lock:
+            if market_name not in self._fills_cache:
+                rng = random.Random(f'{self.config.seed}:{market_name}')
+                base = market_name.replace('-', '/').split('/')[0]
+                price = _price_for(base)
+                fills = []
+                ts = float(_FILLS_START_TIMESTAMP)
+                for _ in range(self.config.fills_per_market):
+                    ts += round(rng.uniform(1, 3600), 6)
+                    fills.append({
+                        'id': rng.getrandbits(40),
+                        'market': market_name,
+                        'side': rng.choice(('buy', 'sell')),
+                        'size': round(rng.uniform(0.01, 10), 4),
+                        'price': round(price * rng.uniform(0.8, 1.2), 4),
+                        'time': _iso_time(ts),
+                        '_ts': datetime.datetime.fromisoformat(
+                            _iso_time(ts)).timestamp(),
+                    })
+                fills.reverse()
+                self._fills_cache[market_name] = fills
+            return self._fills_cache[market_name]
+
+    def _binance_ticker_price(self, path, query):
+        symbol = query.get('symbol', '')
+        for quote in ('USDT', 'USDC', 'BTC', 'ETH'):
+            if symbol.endswith(quote) and len(symbol) > len(quote):
+                base = symbol[:-len(quote)]
+                if self._is_listed(base, quote):
+                    return http.HTTPStatus.OK, {
+                        'symbol': symbol, 'price': f'{_price_for(base):.8f}'}
+        return http.HTTPStatus.BAD_REQUEST, {'code': -1121,
+                                             'msg': 'Invalid symbol.'}
+
+    def _binance_klines(self, path, query):
+        symbol = query.get('symbol', '')
+        resolution = _BINANCE_INTERVALS.get(query.get('interval', ''))
+        for quote in ('USDT', 'USDC', 'BTC', 'ETH'):
+            if (resolution is not None and symbol.endswith(quote) and
+                    len(symbol) > len(quote)):
+                base = symbol[:-len(quote)]
+                if self._is_listed(base, quote):
+                    break
+        else:
+            return http.HTTPStatus.BAD_REQUEST, {'code': -1121,
+                                                 'msg': 'Invalid symbol.'}
+        start_ms = int(query.get('startTime', 0))
+        end_ms = int(query.get('endTime', time.time() * 1000))
+        limit = min(int(query.get('limit', 500)), _BINANCE_MAX_KLINES)
+        first = -(-start_ms // 1000 // resolution) * resolution
+        klines = []
+        for open_time in range(first, end_ms // 1000 + 1, resolution):
+            if len(klines) == limit:
+                break
+            close = f'{_historical_price_for(base, open_time + resolution):.8f}'
+            klines.append([open_time * 1000, close, close, close, close, '0',
+                           (open_time + resolution) * 1000 - 1])
+        return http.HTTPStatus.OK, klines
+
+    def _huobi_detail_merged(self, path, query):
+        symbol = query.get('symbol', '')
+        for quote in ('usdt', 'usdc', 'btc', 'eth'):
+            if symbol.endswith(quote) and len(symbol) > len(quote):
+                base = symbol[:-len(quote)].upper()
+                if self._is_listed(base, quote.upper()):
+                    return http.HTTPStatus.OK, {
+                        'status': 'ok',
+                        'tick': {'close': _price_for(base)}}
+        # Huobi reports errors with HTTP 200 and an error status.
+        return http.HTTPStatus.OK, {'status': 'error',
+                                    'err-code': 'invalid-parameter',
+                                    'err-msg': 'invalid symbol'}
+
+    def _quotes(self, path, query):
+        quotes = {}
+        for pair in query.get('pairs', '').split(','):
+            from_name, _, to_name = pair.partition('/')
+            base = from_name.partition('.')[2]
+            quote = to_name.partition('.')[2]
+            if base and quote and self._is_listed(base, quote):
+                quotes[pair] = f'{_price_for(pair):.4f}'
+        return http.HTTPStatus.OK, {'quotes': quotes}
+
+
+def _error_body(endpoint: str, message: str) -> Dict[str, Any]:
+    if endpoint.startswith('ftx.'):
+        return {'success': False, 'error': message}
+    if endpoint.startswith('binance.'):
+        return {'code': -1000, 'msg': message}
+    if endpoint == 'quotes':
+        return {'error': message}
+    return {'status': 'error', 'err-msg': message}
+
+
+def _make_handler(exchange: FakeExchange):
+
+    class _Handler(http.server.BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            parsed = urllib.parse.urlsplit(self.path)
+            if parsed.path == '/__stats':
+                self._send(http.HTTPStatus.OK, exchange.stats())
+                return
+            query = dict(urllib.parse.parse_qsl(parsed.query))
+            endpoint, status, body = exchange.handle(parsed.path, query)
+            exchange._record(endpoint, int(status))
+            self._send(status, body)
+
+        def do_POST(self):
+            if urllib.parse.urlsplit(self.path).path == '/__reset':
+                exchange.reset_stats()
+                self._send(http.HTTPStatus.OK, {'success': True})
+            else:
+                self._send(http.HTTPStatus.NOT_FOUND, {'error': 'Not found'})
+
+        def _send(self, status: int, body: Dict[str, Any]):
+            payload = json.dumps(body).encode()
+            try:
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up, e.g. after its own timeout.
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    return _Handler
+
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds flags for every FakeExchangeConfig field."""
+    defaults = FakeExchangeConfig()
+    parser.add_argument('--latency', default=defaults.latency,
+                        help='Latency distribution, e.g. "fixed:0.05", '
+                             '"uniform:0.01,0.2", "exponential:0.05" or '
+                             '"lognormal:-3,0.5".')
+    parser.add_argument('--error_rate', type=float,
+                        default=defaults.error_rate,
+                        help='Fraction of requests answered with HTTP 500.')
+    parser.add_argument('--timeout_rate', type=float,
+                        default=defaults.timeout_rate,
+                        help='Fraction of requests held past the client '
+                             'timeout.')
+    parser.add_argument('--timeout_secs', type=float,
+                        default=defaults.timeout_secs,
+                        help='How long timed out requests are held.')
+    parser.add_argument('--rate_limit_per_sec', type=float,
+                        default=defaults.rate_limit_per_sec,
+                        help='Global request rate limit; 0 disables it.')
+    parser.add_argument('--unlisted_pairs', nargs='*', default=[],
+                        help='Pairs that no exchange lists, e.g. SBR/USD.')
+    parser.add_argument('--fills_per_market', type=int,
+                        default=defaults.fills_per_market,
+                        help='Number of fills per FTX market.')
+    parser.add_argument('--fills_end_time_exclusive', action='store_true',
+                        help='Serve /fills with an exclusive end_time.')
+    parser.add_argument('--seed', type=int, default=defaults.seed,
+                        help='Seed for fault injection and fills.')
+
+
+def config_from_args(args: argparse.Namespace) -> FakeExchangeConfig:
+    _sample_latency(args.latency, random.Random())  # Validates the spec.
+    return FakeExchangeConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        timeout_secs=args.timeout_secs,
+        rate_limit_per_sec=args.rate_limit_per_sec,
+        unlisted_pairs=frozenset(args.unlisted_pairs),
+        fills_per_market=args.fills_per_market,
+        fills_end_time_inclusive=not args.fills_end_time_exclusive,
+        seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    exchange = FakeExchange(config_from_args(args),
+                            host=args.host,
+                            port=args.port)
+    for name, value in exchange.client_env().items():
+        print(f'export {name}={value}')
+    try:
+        exchange.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""End-to-end load and fault-injection harness.
+
+Starts the fake exchange from `fake_exchange.py`, then runs `main.py`,
+`cost_analysis/spot_live.py` and `cost_analysis/perp_live.py` against it as
+real subprocesses, and reports p50/p99 wall time, exit codes and the requests
+each target sent per endpoint.
+
+Example:
+    python benchmarks/load_harness.py --runs 20 --concurrency 4 \\
+        --latency lognormal:-3,0.7 --error_rate 0.05 --unlisted_pairs SBR/USD
+"""
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import yaml
+
+import fake_exchange
+
+
+_REPO_ROOT = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+_DEFAULT_PORTFOLIO_ASSETS = ('BTC', 'ETH', 'SOL', 'FTT', 'RAY', 'SRM', 'SBR')
+_DEFAULT_COST_ASSETS = ('BTC', 'ETH', 'SOL')
+
+# Generous upper bound so a stuck run is reported instead of hanging.
+_RUN_TIMEOUT_SECS = 600
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _write_portfolio_yaml(assets: List[str], num_portfolios: int) -> str:
+    portfolios = [{
+        'name': f'Harness portfolio {i}',
+        'assets': [{'symbol': f'CRYPTO.{asset}', 'quantity': '1.5'}
+                   for asset in assets],
+    } for i in range(num_portfolios)]
+    fd, path = tempfile.mkstemp(suffix='.yaml', prefix='harness_')
+    with os.fdopen(fd, 'w') as f:
+        yaml.safe_dump({'Portfolios': portfolios}, f)
+    return path
+
+
+def _targets(portfolio_yaml: str,
+             cost_assets: List[str]) -> Dict[str, List[str]]:
+    """Returns {target name: command line}."""
+    credentials = ['--api_key', 'harness', '--api_secret', 'harness']
+    return {
+        'main': [sys.executable, os.path.join(_REPO_ROOT, 'main.py'),
+                 '-p', portfolio_yaml],
+        'spot_live': [sys.executable,
+                      os.path.join(_REPO_ROOT, 'cost_analysis',
+                                   'spot_live.py'),
+                      '-a', *cost_assets, *credentials],
+        'perp_live': [sys.executable,
+                      os.path.join(_REPO_ROOT, 'cost_analysis',
+                                   'perp_live.py'),
+                      '-a', *cost_assets, *credentials],
+    }
+
+
+def _run_once(command: List[str], env: Dict[str, str]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        completed = subprocess.run(
+            command,
+            env=env,
+            # main.py asks for manual input when every provider fails; an
+            # empty stdin turns that into a failed run instead of a hang.
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=_RUN_TIMEOUT_SECS)
+        returncode = completed.returncode
+        stderr = completed.stderr.decode(errors='replace')
+    except subprocess.TimeoutExpired:
+        returncode = None
+        stderr = 'Timed out.'
+    elapsed = time.perf_counter() - start
+    last_error_line = stderr.strip().splitlines()[-1:] if stderr else []
+    return {'seconds': elapsed,
+            'returncode': returncode,
+            'error': last_error_line[0] if last_error_line else None}
+
+
+def _run_target(exchange: fake_exchange.FakeExchange,
+                command: List[str],
+                runs: int,
+                concurrency: int) -> Dict[str, Any]:
+    env = dict(os.environ)
+    env.update(exchange.client_env())
+    exchange.reset_stats()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda _: _run_once(command, env),
+                                    range(runs)))
+    seconds = [r['seconds'] for r in results]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if r['returncode'] != 0:
+            errors[r['error'] or 'unknown'] = (
+                errors.get(r['error'] or 'unknown', 0) + 1)
+    requests_by_endpoint = exchange.stats()
+    total_requests = sum(sum(counts.values())
+                         for counts in requests_by_endpoint.values())
+    return {
+        'runs': runs,
+        'succeeded': sum(1 for r in results if r['returncode'] == 0),
+        'p50_seconds': _percentile(seconds, 50),
+        'p99_seconds': _percentile(seconds, 99),
+        'max_seconds': max(seconds),
+        'requests_per_run': total_requests / runs,
+        'requests': requests_by_endpoint,
+        'errors': errors,
+    }
+
+
+def _print_report(report: Dict[str, Dict[str, Any]]) -> None:
+    for name, result in report.items():
+        print(f'===== {name}: {result["succeeded"]}/{result["runs"]} '
+              f'runs succeeded =====')
+        print(f'p50 {result["p50_seconds"]:.3f}s, '
+              f'p99 {result["p99_seconds"]:.3f}s, '
+              f'max {result["max_seconds"]:.3f}s, '
+              f'{result["requests_per_run"]:.1f} requests/run')
+        for endpoint, counts in result['requests'].items():
+            statuses = ', '.join(f'{status}: {count}'
+                                 for status, count in counts.items())
+            print(f'\t{endpoint}: {statuses}')
+        for error, count in result['errors'].items():
+            print(f'\t[{count}x] {error}')
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Number of runs per target.')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Number of concurrent runs per target.')
+    parser.add_argument('--targets', nargs='+',
+                        default=['main', 'spot_live', 'perp_live'],
+                        choices=['main', 'spot_live', 'perp_live'],
+                        help='Entry points to drive.')
+    parser.add_argument('--portfolio_assets', nargs='+',
+                        default=list(_DEFAULT_PORTFOLIO_ASSETS),
+                        help='Crypto assets in the generated portfolios.')
+    parser.add_argument('--num_portfolios', type=int, default=5,
+                        help='Number of generated portfolios.')
+    parser.add_argument('--cost_assets', nargs='+',
+                        default=list(_DEFAULT_COST_ASSETS),
+                        help='Assets passed to the cost scripts.')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Path to write the JSON report to.')
+    fake_exchange.add_config_arguments(parser)
+    args = parser.parse_args()
+
+    exchange = fake_exchange.FakeExchange(
+        fake_exchange.config_from_args(args)).start()
+    portfolio_yaml = _write_portfolio_yaml(args.portfolio_assets,
+                                           args.num_portfolios)
+    try:
+        commands = _targets(portfolio_yaml, args.cost_assets)
+        report = {
+            name: _run_target(exchange, commands[name], args.runs,
+                              args.concurrency)
+            for name in args.targets}
+    finally:
+        exchange.stop()
+        os.remove(portfolio_yaml)
+
+    _print_report(report)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
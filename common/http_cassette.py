@@ -0,0 +1,261 @@
+"""Record/replay transport for the exchange HTTP APIs.
+
+Every HTTP call made through `requests` (the module-level helpers as well as
+sessions) ends up in `requests.adapters.HTTPAdapter.send`. This module patches
+that single method while a cassette is in use:
+
+- In "record" mode, requests go to the network as usual and each response
+  (or timeout) is appended to the cassette.
+- In "replay" mode, no network access happens at all. Responses are served
+  from the cassette in the recorded order, optionally delayed by the recorded
+  latency.
+
+Cassettes are gzipped compact JSON files. The gzip header carries no
+timestamp, so recording the same responses twice yields the same bytes.
+"""
+import argparse
+import base64
+import collections
+import contextlib
+import datetime
+import gzip
+import json
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional, Tuple, TYPE_CHECKING
+import urllib.parse
+
+if TYPE_CHECKING:
+    import requests
+
+
+RECORD = 'record'
+REPLAY = 'replay'
+MODES = (RECORD, REPLAY)
+
+_CASSETTE_FORMAT_VERSION = 1
+
+# These headers describe the wire encoding of the original response. The
+# cassette stores the decoded body, so they would be wrong on replay.
+_DROPPED_RESPONSE_HEADERS = frozenset(
+    ('content-encoding', 'content-length', 'transfer-encoding'))
+
+_ERROR_TIMEOUT = 'timeout'
+_ERROR_CONNECTION = 'connection'
+
+
+# `requests` is only imported once a cassette is used, so that importing this
+# module for its flags stays cheap.
+_cassette_miss: Optional[type] = None
+
+
+def _cassette_miss_class() -> type:
+    global _cassette_miss
+    if _cassette_miss is None:
+        import requests
+
+        class CassetteMiss(requests.exceptions.ConnectionError):
+            """Raised in replay mode when no recorded interaction matches."""
+
+        _cassette_miss = CassetteMiss
+    return _cassette_miss
+
+
+def __getattr__(name: str) -> Any:
+    if name == 'CassetteMiss':
+        return _cassette_miss_class()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def _request_key(method: str, url: str) -> Tuple[str, str]:
+    return method.upper(), url
+
+
+def _path_key(method: str, url: str) -> Tuple[str, str]:
+    parsed = urllib.parse.urlsplit(url)
+    return method.upper(), f'{parsed.scheme}://{parsed.netloc}{parsed.path}'
+
+
+def _encode_body(body: bytes) -> Dict[str, str]:
+    try:
+        return {'body': body.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'body_b64': base64.b64encode(body).decode('ascii')}
+
+
+def _decode_body(data: Dict[str, Any]) -> bytes:
+    if 'body_b64' in data:
+        return base64.b64decode(data['body_b64'])
+    return data.get('body', '').encode('utf-8')
+
+
+class Cassette:
+    """An ordered list of recorded HTTP interactions."""
+
+    def __init__(self, path: str, interactions: List[Dict[str, Any]] = None):
+        self.path = path
+        self.interactions = interactions if interactions is not None else []
+        self._lock = threading.Lock()
+        self._played = [False] * len(self.interactions)
+        self._by_request: Dict[Tuple[str, str], Deque[int]] = (
+            collections.defaultdict(collections.deque))
+        self._by_path: Dict[Tuple[str, str], Deque[int]] = (
+            collections.defaultdict(collections.deque))
+        for index, interaction in enumerate(self.interactions):
+            method = interaction['method']
+            url = interaction['url']
+            self._by_request[_request_key(method, url)].append(index)
+            self._by_path[_path_key(method, url)].append(index)
+
+    @classmethod
+    def load(cls, path: str) -> 'Cassette':
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != _CASSETTE_FORMAT_VERSION:
+            raise ValueError(f'Unsupported cassette version in {path}.')
+        return cls(path=path, interactions=data['interactions'])
+
+    def save(self) -> None:
+        payload = json.dumps(
+            {'version': _CASSETTE_FORMAT_VERSION,
+             'interactions': self.interactions},
+            separators=(',', ':'),
+            ensure_ascii=False).encode('utf-8')
+        with open(self.path, 'wb') as raw:
+            with gzip.GzipFile(filename='', mode='wb', fileobj=raw,
+                               mtime=0) as f:
+                f.write(payload)
+
+    def append(self, interaction: Dict[str, Any]) -> None:
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def next_interaction(self, method: str, url: str) -> Dict[str, Any]:
+        """Pops the next unplayed interaction for the request.
+
+        An exact method+URL match is preferred. Otherwise, we fall back to the
+        next unplayed interaction on the same path, which keeps paginated
+        calls (e.g. FTX `/fills` with a moving `end_time`, or a default end
+        timestamp taken from the clock) replayable in the recorded order.
+        """
+        with self._lock:
+            for candidates in (self._by_request[_request_key(method, url)],
+                               self._by_path[_path_key(method, url)]):
+                while candidates:
+                    index = candidates.popleft()
+                    if not self._played[index]:
+                        self._played[index] = True
+                        return self.interactions[index]
+        cassette_miss = _cassette_miss_class()
+        raise cassette_miss(f'No recorded interaction for {method} {url} '
+                            f'in cassette {self.path}.')
+
+
+def _build_response(interaction: Dict[str, Any],
+                    request: 'requests.PreparedRequest') -> 'requests.Response':
+    import requests
+
+    response = requests.Response()
+    response.status_code = interaction['status']
+    response.reason = interaction.get('reason', '')
+    response.headers = requests.structures.CaseInsensitiveDict(
+        interaction.get('headers', {}))
+    response._content = _decode_body(interaction)
+    response.encoding = requests.utils.get_encoding_from_headers(
+        response.headers)
+    response.url = request.url
+    response.request = request
+    response.elapsed = datetime.timedelta(
+        seconds=interaction.get('elapsed', 0.0))
+    return response
+
+
+@contextlib.contextmanager
+def use_cassette(path: str, mode: str, latency_scale: float = 0.0):
+    """Routes all `requests` traffic through a cassette file.
+
+    Args:
+        path: The cassette file path.
+        mode: Either "record" or "replay".
+        latency_scale: Replay only. Each response is delayed by its recorded
+            latency multiplied by this factor. 0 replays as fast as possible.
+    """
+    import requests
+
+    if mode not in MODES:
+        raise ValueError(f'Unknown cassette mode: {mode}')
+    cassette = Cassette.load(path) if mode == REPLAY else Cassette(path)
+    original_send = requests.adapters.HTTPAdapter.send
+
+    def recording_send(adapter, request, *args, **kwargs):
+        start = time.perf_counter()
+        interaction = {'method': request.method, 'url': request.url}
+        try:
+            response = original_send(adapter, request, *args, **kwargs)
+        except requests.exceptions.Timeout:
+            interaction['error'] = _ERROR_TIMEOUT
+            interaction['elapsed'] = round(time.perf_counter() - start, 6)
+            cassette.append(interaction)
+            raise
+        except requests.exceptions.ConnectionError:
+            interaction['error'] = _ERROR_CONNECTION
+            interaction['elapsed'] = round(time.perf_counter() - start, 6)
+            cassette.append(interaction)
+            raise
+        body = response.content  # Reads the whole body.
+        interaction.update({
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {
+                k: v for k, v in response.headers.items()
+                if k.lower() not in _DROPPED_RESPONSE_HEADERS},
+            'elapsed': round(time.perf_counter() - start, 6),
+        })
+        interaction.update(_encode_body(body))
+        cassette.append(interaction)
+        return response
+
+    def replaying_send(adapter, request, *args, **kwargs):
+        interaction = cassette.next_interaction(request.method, request.url)
+        if latency_scale > 0:
+            time.sleep(interaction.get('elapsed', 0.0) * latency_scale)
+        error = interaction.get('error')
+        if error == _ERROR_TIMEOUT:
+            raise requests.exceptions.Timeout(request=request)
+        if error == _ERROR_CONNECTION:
+            raise requests.exceptions.ConnectionError(request=request)
+        return _build_response(interaction, request)
+
+    requests.adapters.HTTPAdapter.send = (
+        recording_send if mode == RECORD else replaying_send)
+    try:
+        yield cassette
+    finally:
+        requests.adapters.HTTPAdapter.send = original_send
+        if mode == RECORD:
+            cassette.save()
+
+
+def add_cassette_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the command-line flags used by `cassette_from_args`."""
+    parser.add_argument('--cassette',
+                        help='Cassette file to record to or replay from.',
+                        default=None)
+    parser.add_argument('--cassette_mode',
+                        help='Whether to record or replay the cassette.',
+                        choices=MODES,
+                        default=REPLAY)
+    parser.add_argument('--replay_latency_scale',
+                        help=('Multiplier applied to the recorded latency '
+                              'when replaying. 0 disables the delay.'),
+                        type=float,
+                        default=0.0)
+
+
+def cassette_from_args(args: argparse.Namespace):
+    """Returns the cassette context for the parsed flags (no-op if unset)."""
+    if args.cassette is None:
+        return contextlib.nullcontext()
+    return use_cassette(args.cassette,
+                        mode=args.cassette_mode,
+                        latency_scale=args.replay_latency_scale)
@@ -0,0 +1,280 @@
+"""Lightweight runtime metrics (counters and histograms).
+
+Metrics are disabled by default. While disabled, every recording call returns
+after a single flag check, so instrumented code pays next to nothing.
+
+Enable them from the command line with `--metrics_output PATH`. The report
+is written when the process exits, as JSON if PATH ends with ".json" and in
+the Prometheus text exposition format otherwise.
+"""
+import argparse
+import atexit
+import bisect
+import contextlib
+import json
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = False
+_lock = threading.Lock()
+_REGISTRY: Dict[str, '_Metric'] = {}
+
+_LabelsKey = Tuple[Tuple[str, str], ...]
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _labels_key(labels: Dict[str, Any]) -> _LabelsKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: _LabelsKey, extra: Tuple[str, str] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"'
+                          for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class _Metric:
+
+    metric_type = ''
+
+    def __init__(self, name: str, documentation: str):
+        if name in _REGISTRY:
+            raise ValueError(f'Duplicated metric name: {name}')
+        self.name = name
+        self.documentation = documentation
+        _REGISTRY[name] = self
+
+    def reset(self) -> None:
+        raise NotImplementedError()
+
+    def prometheus_lines(self) -> List[str]:
+        raise NotImplementedError()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, per label set."""
+
+    metric_type = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: Dict[_LabelsKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not _enabled:
+            return
+        key = _labels_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(_labels_key(labels), 0)
+
+    def reset(self) -> None:
+        self._values.clear()
+
+    def prometheus_lines(self) -> List[str]:
+        return [f'{self.name}{_format_labels(key)} {_format_value(value)}'
+                for key, value in sorted(self._values.items())]
+
+    def summary(self) -> List[Dict[str, Any]]:
+        return [{'labels': dict(key), 'value': value}
+                for key, value in sorted(self._values.items())]
+
+
+class _HistogramValues:
+
+    __slots__ = ('bucket_counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, num_buckets: int):
+        self.bucket_counts = [0] * (num_buckets + 1)  # The last one is +Inf.
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets, per label set."""
+
+    metric_type = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[_LabelsKey, _HistogramValues] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        if not _enabled:
+            return
+        key = _labels_key(labels)
+        with _lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = _HistogramValues(
+                    len(self.buckets))
+            values.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            values.count += 1
+            values.sum += value
+            values.min = min(values.min, value)
+            values.max = max(values.max, value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observes the duration of the block in seconds.
+
+        The yielded dict can be updated to add labels known only at the end,
+        e.g. the outcome. The duration is recorded even if the block raises.
+        """
+        if not _enabled:
+            yield labels
+            return
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def reset(self) -> None:
+        self._values.clear()
+
+    def prometheus_lines(self) -> List[str]:
+        lines = []
+        for key, values in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,),
+                                    values.bucket_counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket'
+                    f'{_format_labels(key, ("le", _format_value(bound)))} '
+                    f'{cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} '
+                         f'{_format_value(values.sum)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} '
+                         f'{values.count}')
+        return lines
+
+    def summary(self) -> List[Dict[str, Any]]:
+        return [{
+            'labels': dict(key),
+            'count': values.count,
+            'sum': values.sum,
+            'mean': values.sum / values.count if values.count else None,
+            'min': values.min if values.count else None,
+            'max': values.max if values.count else None,
+            'buckets': {
+                _format_value(bound): count
+                for bound, count in zip(self.buckets + (math.inf,),
+                                        values.bucket_counts)},
+        } for key, values in sorted(self._values.items())]
+
+
+DEDUP_LOOKUPS = Counter(
+    'asset_tracker_dedup_lookups_total',
+    'Items checked against the ones already seen, by set and result '
+    '(duplicate or new).')
+
+
+def record_dedup_lookup(name: str, duplicate: bool) -> None:
+    DEDUP_LOOKUPS.inc(set=name, result='duplicate' if duplicate else 'new')
+
+
+def _duplicate_ratios() -> Dict[str, Optional[float]]:
+    per_set: Dict[str, Dict[str, float]] = {}
+    for key, value in DEDUP_LOOKUPS._values.items():
+        labels = dict(key)
+        per_set.setdefault(labels['set'], {})[labels['result']] = value
+    ratios = {}
+    for name, results in sorted(per_set.items()):
+        total = results.get('duplicate', 0) + results.get('new', 0)
+        ratios[name] = results.get('duplicate', 0) / total if total else None
+    return ratios
+
+
+def reset() -> None:
+    for metric in _REGISTRY.values():
+        metric.reset()
+
+
+def to_prometheus_text() -> str:
+    lines = []
+    for name, metric in sorted(_REGISTRY.items()):
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.metric_type}')
+        lines.extend(metric.prometheus_lines())
+    return '\n'.join(lines) + '\n'
+
+
+def to_json_summary() -> Dict[str, Any]:
+    return {
+        'metrics': {
+            name: {'type': metric.metric_type,
+                   'help': metric.documentation,
+                   'values': metric.summary()}
+            for name, metric in sorted(_REGISTRY.items())},
+        'duplicate_ratios': _duplicate_ratios(),
+    }
+
+
+def write_report(path: str) -> None:
+    """Writes all metrics, as JSON if `path` ends with ".json"."""
+    with _lock:
+        if path.endswith('.json'):
+            content = json.dumps(to_json_summary(), indent=2) + '\n'
+        else:
+            content = to_prometheus_text()
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def add_metrics_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the command-line flag used by `metrics_from_args`."""
+    parser.add_argument('--metrics_output',
+                        help=('Enables runtime metrics and writes them to '
+                              'this path at exit (JSON if it ends with '
+                              '".json", Prometheus text otherwise).'),
+                        default=None)
+
+
+def metrics_from_args(args: argparse.Namespace) -> None:
+    """Enables metrics and schedules the report if the flag is set."""
+    if args.metrics_output is None:
+        return
+    enable()
+    atexit.register(write_report, args.metrics_output)
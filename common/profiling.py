@@ -0,0 +1,204 @@
+"""`--profile` support shared by all entry points.
+
+With `--profile DIR`, the run is wrapped in cProfile and tracemalloc, and a
+sampler thread records the main thread's call stacks. At the end, DIR gets:
+
+- profile.pstats: the raw cProfile dump (load it with `pstats.Stats`).
+- profile.txt: the same stats as text, sorted by cumulative time.
+- profile.collapsed: sampled stacks in the collapsed format understood by
+  flamegraph.pl and speedscope, rooted at the current phase.
+- allocations.txt: the top allocation sites still alive at the end, and the
+  peak traced memory.
+- phases.txt: wall time, CPU time and peak memory of each named phase.
+
+Code marks phases with `with profiling.phase('fetch'): ...`. Phases can be
+nested; they are no-ops unless profiling is active.
+"""
+import argparse
+import collections
+import contextlib
+import dataclasses
+import io
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+
+_SAMPLE_INTERVAL_SECS = 0.001
+_TRACEMALLOC_FRAMES = 10
+_TOP_FUNCTIONS = 60
+_TOP_ALLOCATIONS = 30
+
+_active_profile: Optional['_Profile'] = None
+
+
+@dataclasses.dataclass
+class _PhaseRecord:
+    path: str
+    wall_secs: float = 0.0
+    cpu_secs: float = 0.0
+    memory_delta_bytes: int = 0
+    peak_memory_bytes: int = 0
+
+
+class _Profile:
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.phase_stack: List[_PhaseRecord] = []
+        self.phases: List[_PhaseRecord] = []
+        # Imported here, as most runs are not profiled.
+        import cProfile
+
+        self._profiler = cProfile.Profile()
+        self._samples: Dict[str, int] = collections.Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop,
+                                         name='profiling-sampler',
+                                         daemon=True)
+
+    def start(self) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        tracemalloc.start(_TRACEMALLOC_FRAMES)
+        self._sampler.start()
+        self._profiler.enable()
+
+    def stop(self) -> None:
+        self._profiler.disable()
+        self._stop.set()
+        self._sampler.join()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self._write_pstats()
+        self._write_collapsed()
+        self._write_allocations(snapshot, peak)
+        self._write_phases()
+
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(_SAMPLE_INTERVAL_SECS):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:'
+                             f'{code.co_name}')
+                frame = frame.f_back
+            stack.reverse()
+            phase_stack = list(self.phase_stack)
+            root = ['phase:' + (phase_stack[-1].path if phase_stack
+                                else '(none)')]
+            self._samples[';'.join(root + stack)] += 1
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.output_dir, name)
+
+    def _write_pstats(self) -> None:
+        import pstats
+
+        self._profiler.dump_stats(self._path('profile.pstats'))
+        text = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=text)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(
+            _TOP_FUNCTIONS)
+        with open(self._path('profile.txt'), 'w') as f:
+            f.write(text.getvalue())
+
+    def _write_collapsed(self) -> None:
+        with open(self._path('profile.collapsed'), 'w') as f:
+            for stack, count in sorted(self._samples.items()):
+                f.write(f'{stack} {count}\n')
+
+    def _write_allocations(self, snapshot: tracemalloc.Snapshot,
+                           peak: int) -> None:
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        with open(self._path('allocations.txt'), 'w') as f:
+            f.write(f'Peak traced memory: {peak / 2**20:.2f} MiB\n\n')
+            f.write(f'Top {_TOP_ALLOCATIONS} allocation sites at exit:\n')
+            for stat in snapshot.statistics('lineno')[:_TOP_ALLOCATIONS]:
+                f.write(f'{stat}\n')
+
+    def _write_phases(self) -> None:
+        with open(self._path('phases.txt'), 'w') as f:
+            f.write(f'{"phase":32} {"wall":>10} {"cpu":>10} '
+                    f'{"mem delta":>12} {"peak":>12}\n')
+            for record in self.phases:
+                f.write(f'{record.path:32} '
+                        f'{record.wall_secs:9.3f}s '
+                        f'{record.cpu_secs:9.3f}s '
+                        f'{record.memory_delta_bytes / 2**20:9.2f}MiB '
+                        f'{record.peak_memory_bytes / 2**20:9.2f}MiB\n')
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    """Marks a named phase of the run (load, fetch, aggregate, render...)."""
+    profile = _active_profile
+    if profile is None or threading.get_ident() != profile._thread_id:
+        yield
+        return
+
+    parent = profile.phase_stack[-1] if profile.phase_stack else None
+    if parent is not None:
+        parent.peak_memory_bytes = max(parent.peak_memory_bytes,
+                                       tracemalloc.get_traced_memory()[1])
+    record = _PhaseRecord(path=f'{parent.path}/{name}' if parent else name)
+    start_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    profile.phase_stack.append(record)
+    try:
+        yield
+    finally:
+        profile.phase_stack.pop()
+        record.wall_secs = time.perf_counter() - start_wall
+        record.cpu_secs = time.process_time() - start_cpu
+        current, peak = tracemalloc.get_traced_memory()
+        record.memory_delta_bytes = current - start_memory
+        record.peak_memory_bytes = max(record.peak_memory_bytes, peak)
+        if parent is not None:
+            parent.peak_memory_bytes = max(parent.peak_memory_bytes,
+                                           record.peak_memory_bytes)
+        profile.phases.append(record)
+
+
+@contextlib.contextmanager
+def profile_run(output_dir: str):
+    """Profiles the block and writes the reports into `output_dir`."""
+    global _active_profile
+    if _active_profile is not None:
+        raise RuntimeError('Profiling is already active.')
+    profile = _Profile(output_dir)
+    _active_profile = profile
+    profile.start()
+    try:
+        yield
+    finally:
+        profile.stop()
+        _active_profile = None
+        print(f'Profile written to {output_dir}', file=sys.stderr)
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the command-line flag used by `profile_from_args`."""
+    parser.add_argument('--profile',
+                        help=('Profile the run with cProfile and tracemalloc '
+                              'and write the reports into this directory.'),
+                        default=None)
+
+
+def profile_from_args(args: argparse.Namespace):
+    """Returns the profiling context for the parsed flags (no-op if unset)."""
+    if args.profile is None:
+        return contextlib.nullcontext()
+    return profile_run(args.profile)
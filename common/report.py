@@ -0,0 +1,223 @@
+"""Report output shared by the entry points, as text or structured data.
+
+A report is a sequence of records (dicts) of named tables, e.g. "totals",
+interleaved with text-only lines such as headings. Everything goes through
+one buffered writer, in one of these formats:
+
+- text: the human-readable layout; each record is rendered by the text given
+  with it, and text-only lines are kept. ANSI colors are only used when the
+  output is a terminal.
+- json: one document mapping each table to the list of its records.
+- csv: the records of a single table, one schema: a header row of the
+  fields of its first record, then one row per record. The table is the
+  one selected, or else the first one of the report; the others are left
+  out, so standard CSV readers can load the output.
+- ndjson: one JSON object per record, with a "table" key.
+
+A table can be selected (`--table`) to only write its records, in any
+format but text. Decimals are written as strings in JSON, to keep every
+digit.
+
+Entries can also be collected into a `Block` away from the writer, e.g. in a
+worker process, and written later in one go.
+"""
+import argparse
+import contextlib
+import csv
+import decimal
+import enum
+import io
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+
+TEXT = 'text'
+JSON = 'json'
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = (TEXT, JSON, CSV, NDJSON)
+
+_BUFFER_SIZE = 1 << 16
+_DECIMAL_ZERO = decimal.Decimal('0')
+
+# (table, record, text); text-only lines have no table nor record.
+_Entry = Tuple[Optional[str], Optional[Dict[str, Any]], Optional[str]]
+
+
+class AnsiColorSequence(enum.Enum):
+    """ANSI escape code for colors."""
+    RED = '\033[31m'
+    GREEN = '\033[32m'
+    YELLOW = '\033[33m'
+    BLUE = '\033[34m'
+    CYAN = '\033[36m'
+    GRAY = '\033[90m'
+    BRIGHT_YELLOW = '\033[93m'
+    END = '\033[0m'
+
+
+class Block:
+    """Report entries collected for a later `ReportWriter.write_block`."""
+
+    def __init__(self):
+        self.entries: List[_Entry] = []
+
+    def text(self, line: str = '') -> None:
+        self.entries.append((None, None, line))
+
+    def record(self, table: str, record: Dict[str, Any],
+               text: Optional[str] = None) -> None:
+        self.entries.append((table, record, text))
+
+
+def _json_default(value: Any) -> Any:
+    # Decimals and symbols, among others.
+    return str(value)
+
+
+class ReportWriter:
+    """Writes report entries to a stream through one buffer.
+
+    Args:
+        output_format: One of FORMATS.
+        stream: Where to write, default stdout.
+        color: Whether text may be colored; default only for terminals, unless
+            the NO_COLOR environment variable is set.
+        table: If given, only the records of this table are written, except
+            in the text format.
+    """
+
+    def __init__(self,
+                 output_format: str = TEXT,
+                 stream: Optional[TextIO] = None,
+                 color: Optional[bool] = None,
+                 table: Optional[str] = None):
+        if output_format not in FORMATS:
+            raise ValueError(f'Unknown output format: {output_format}')
+        self.output_format = output_format
+        self._stream = sys.stdout if stream is None else stream
+        if color is None:
+            color = (output_format == TEXT and
+                     'NO_COLOR' not in os.environ and
+                     self._stream.isatty())
+        self.color = color
+        self._parts: List[str] = []
+        self._size = 0
+        self.table = table
+        self._csv_fields: Optional[List[str]] = None
+        self._csv_line = io.StringIO()
+        self._csv_writer = csv.writer(self._csv_line, lineterminator='\n')
+        self._json_tables: Dict[str, List[Dict[str, Any]]] = {}
+
+    def __enter__(self) -> 'ReportWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _write(self, text: str) -> None:
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= _BUFFER_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._parts:
+            self._stream.write(''.join(self._parts))
+            self._parts = []
+            self._size = 0
+        self._stream.flush()
+
+    def close(self) -> None:
+        """Writes what the format keeps until the end, and flushes."""
+        if self.output_format == JSON:
+            self._write(json.dumps(self._json_tables, indent=2,
+                                   default=_json_default))
+            self._write('\n')
+            self._json_tables = {}
+        self.flush()
+
+    def text(self, line: str = '') -> None:
+        """Writes a line in the text format only."""
+        if self.output_format == TEXT:
+            self._write(line + '\n')
+
+    def record(self, table: str, record: Dict[str, Any],
+               text: Optional[str] = None) -> None:
+        """Writes a record, rendered as `text` in the text format."""
+        output_format = self.output_format
+        if output_format == TEXT:
+            if text is not None:
+                self._write(text + '\n')
+        elif self.table is not None and table != self.table:
+            return
+        elif output_format == NDJSON:
+            self._write(json.dumps({'table': table, **record},
+                                   default=_json_default) + '\n')
+        elif output_format == CSV:
+            if self._csv_fields is None:
+                # One table per output: the first one, unless selected.
+                self.table = table
+                self._csv_fields = list(record)
+                self._write_csv_row(self._csv_fields)
+            self._write_csv_row([record.get(field)
+                                 for field in self._csv_fields])
+        else:
+            self._json_tables.setdefault(table, []).append(record)
+
+    def _write_csv_row(self, row: List[Any]) -> None:
+        self._csv_writer.writerow(row)
+        self._write(self._csv_line.getvalue())
+        self._csv_line.seek(0)
+        self._csv_line.truncate()
+
+    def write_block(self, block: Block) -> None:
+        for table, record, text in block.entries:
+            if table is None:
+                self.text(text)
+            else:
+                self.record(table, record, text)
+
+    def colored(self, text: str, color: AnsiColorSequence) -> str:
+        if not self.color:
+            return text
+        return f'{color.value}{text}{AnsiColorSequence.END.value}'
+
+    def colored_pnl(self, pnl_value: decimal.Decimal) -> str:
+        """Signed PnL, green if positive and red if negative."""
+        if pnl_value == _DECIMAL_ZERO:
+            return str(pnl_value)
+        if pnl_value > 0:
+            return self.colored(f'+{pnl_value}', AnsiColorSequence.GREEN)
+        return self.colored(str(pnl_value), AnsiColorSequence.RED)
+
+
+def add_output_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the command-line flags used by `writer_from_args`."""
+    parser.add_argument('--output_format',
+                        help='Format of the report.',
+                        choices=FORMATS,
+                        default=TEXT)
+    parser.add_argument('--output',
+                        help='File to write the report to, default stdout.',
+                        default=None)
+    parser.add_argument('--table',
+                        help=('Only write the records of this table, e.g. '
+                              'totals. The csv format holds one table: this '
+                              'one, default the first of the report.'),
+                        default=None)
+
+
+@contextlib.contextmanager
+def writer_from_args(args: argparse.Namespace):
+    """Yields the report writer for the parsed flags, closed at the end."""
+    if args.output is None:
+        with ReportWriter(args.output_format, table=args.table) as writer:
+            yield writer
+        return
+    with open(args.output, 'w') as f, \
+            ReportWriter(args.output_format, stream=f,
+                         table=args.table) as writer:
+        yield writer
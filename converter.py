@@ -1,16 +1,47 @@
+from collections import defaultdict
 import decimal
 import http
-from typing import Any
-
-import requests
+import os
+from typing import (Any, Callable, Dict, Iterable, List, Optional, Sequence,
+                    Tuple)
 
+from common import metrics
 from models import symbol_model
 
 
+# `requests` is imported by the functions using it, so that entry points
+# which get every rate elsewhere (e.g. from a rates file) start faster.
+
+# The base URLs can be overridden, e.g. to point at a local fake exchange.
+_FTX_API_BASE_URL = os.environ.get('FTX_API_BASE_URL', 'https://ftx.com/api')
+_BINANCE_API_BASE_URL = os.environ.get('BINANCE_API_BASE_URL',
+                                       'https://api.binance.com')
+_HUOBI_API_BASE_URL = os.environ.get('HUOBI_API_BASE_URL',
+                                     'https://api.huobi.pro')
+
 _FTX_API_TIMEOUT_SECONDS = 3.0
 _BINANCE_API_TIMEOUT_SECONDS = 3.0
 _HUOBI_API_TIMEOUT_SECONDS = 3.0
 
+_GET_RATE_SECONDS = metrics.Histogram(
+    'asset_tracker_get_rate_seconds',
+    'Latency of Conversion.get_rate, by symbol type and outcome.')
+_PROVIDER_SECONDS = metrics.Histogram(
+    'asset_tracker_rate_provider_seconds',
+    'Latency of each conversion rate provider, by provider and outcome.')
+_PROVIDER_FAILURES = metrics.Counter(
+    'asset_tracker_rate_provider_failures_total',
+    'Conversion rate provider failures, by provider.')
+
+# FTX returns at most 1501 candles and Binance at most 1000 per request.
+_FTX_MAX_CANDLES = 1500
+_BINANCE_MAX_CANDLES = 1000
+_BINANCE_INTERVALS = {
+    60: '1m', 300: '5m', 900: '15m', 3600: '1h', 14400: '4h', 86400: '1d'}
+
+# (close time in unix seconds, close price), oldest first.
+CANDLES_TYPE_ALIAS = List[Tuple[int, decimal.Decimal]]
+
 
 class Conversion:
 
@@ -35,35 +66,133 @@ class Conversion:
         return hash(repr(self))
 
     def get_rate(self) -> decimal.Decimal:
+        with _GET_RATE_SECONDS.time(
+            symbol_type=self.from_symbol.symbol_type.name,
+            outcome='error') as labels:
+            rate = self._get_rate()
+            labels['outcome'] = 'ok'
+        return rate
+
+    def _get_rate(self) -> decimal.Decimal:
         if self.from_symbol == self.to_symbol:
             return decimal.Decimal("1")
         if self.from_symbol.symbol_type is symbol_model.SymbolType.CRYPTO:
             return _resolve_crypto_conversion_rate(from_symbol=self.from_symbol,
                                             to_symbol=self.to_symbol)
-        raise NotImplementedError()
+        raise LookupError(
+            f'No rate for {self.from_symbol} -> {self.to_symbol}: '
+            f'{self.from_symbol.symbol_type.name} rates only come from quote '
+            'providers, see --quotes_url and --quotes_file.')
+
+    def get_candles(self, start: int, end: int,
+                    resolution: int) -> CANDLES_TYPE_ALIAS:
+        """Gets historical close prices between `start` and `end` (seconds).
+
+        Each price is stamped with the close time of its candle, so it is
+        the last known price at that time. Only crypto pairs have candles.
+
+        Raises:
+            LookupError: If the pair is not a crypto one.
+        """
+        if self.from_symbol.symbol_type is symbol_model.SymbolType.CRYPTO:
+            return _resolve_crypto_candles(from_symbol=self.from_symbol,
+                                           to_symbol=self.to_symbol,
+                                           start=start,
+                                           end=end,
+                                           resolution=resolution)
+        raise LookupError(
+            f'No candles for {self.from_symbol} -> {self.to_symbol}: only '
+            'crypto price history is supported, not '
+            f'{self.from_symbol.symbol_type.name}.')
+
+
+def get_rates(
+    conversions: Iterable[Conversion],
+    fallback: Optional[Callable[[Conversion], decimal.Decimal]] = None,
+    quote_providers: Sequence[Any] = (),
+) -> Dict[Tuple[symbol_model.Symbol, symbol_model.Symbol], decimal.Decimal]:
+    """Gets the rates of the conversions, keyed by (from, to) symbols.
+
+    Args:
+        conversions: The conversions to get rates for.
+        fallback: Called with a conversion whose rate cannot be fetched, e.g.
+            to ask for it. If None, the error is raised.
+        quote_providers: `quote_providers.QuoteProvider`s to get the rates of
+            non-crypto conversions from, in batches of one asset class, each
+            asked in turn for what the previous ones did not have.
+    """
+    rates = {}
+    pending = []
+    batches = defaultdict(list)
+    for cv in conversions:
+        if (quote_providers and cv.from_symbol != cv.to_symbol and
+                cv.from_symbol.symbol_type
+                is not symbol_model.SymbolType.CRYPTO):
+            batches[cv.from_symbol.symbol_type].append(cv)
+        else:
+            pending.append(cv)
+    for batch in batches.values():
+        rates.update(_resolve_batched_rates(batch, quote_providers))
+        pending.extend(cv for cv in batch
+                       if (cv.from_symbol, cv.to_symbol) not in rates)
+
+    for cv in pending:
+        try:
+            rates[(cv.from_symbol, cv.to_symbol)] = cv.get_rate()
+        except:
+            if fallback is None:
+                raise
+            rates[(cv.from_symbol, cv.to_symbol)] = fallback(cv)
+    return rates
+
+
+def _resolve_batched_rates(
+    conversions: List[Conversion],
+    quote_providers: Sequence[Any],
+) -> Dict[Tuple[symbol_model.Symbol, symbol_model.Symbol], decimal.Decimal]:
+    rates = {}
+    for provider in quote_providers:
+        missing = [cv for cv in conversions
+                   if (cv.from_symbol, cv.to_symbol) not in rates]
+        if not missing:
+            break
+        try:
+            with _PROVIDER_SECONDS.time(provider=provider.name,
+                                        outcome='error') as labels:
+                rates.update(provider.get_rates(missing))
+                labels['outcome'] = 'ok'
+        except:
+            _PROVIDER_FAILURES.inc(provider=provider.name)
+    return rates
 
 
 def _resolve_crypto_conversion_rate(
     from_symbol: symbol_model.Symbol,
     to_symbol: symbol_model.Symbol) -> decimal.Decimal:
     resolve_funcs = (
-        _get_ftx_conversion_rate,
-        _get_binance_conversion_rate,
-        _get_huobiglobal_conversion_rate)
-    for func in resolve_funcs:
+        ('ftx', _get_ftx_conversion_rate),
+        ('binance', _get_binance_conversion_rate),
+        ('huobiglobal', _get_huobiglobal_conversion_rate))
+    for provider, func in resolve_funcs:
         try:
-            return func(from_symbol=from_symbol, to_symbol=to_symbol)
+            with _PROVIDER_SECONDS.time(provider=provider,
+                                        outcome='error') as labels:
+                rate = func(from_symbol=from_symbol, to_symbol=to_symbol)
+                labels['outcome'] = 'ok'
+            return rate
         except:
-            pass
+            _PROVIDER_FAILURES.inc(provider=provider)
     raise RuntimeError('Resolving crypto conversion rate failed.')
 
 
 def _get_ftx_conversion_rate(
     from_symbol: symbol_model.Symbol,
     to_symbol: symbol_model.Symbol) -> decimal.Decimal:
+    import requests
+
     # We get the last traded price as conversion rate.
     market_name = '%s/%s' % (from_symbol.name, to_symbol.name)
-    endpoint = f'https://ftx.com/api/markets/{market_name}'
+    endpoint = f'{_FTX_API_BASE_URL}/markets/{market_name}'
     try:
         response = requests.get(endpoint, timeout=_FTX_API_TIMEOUT_SECONDS)
     except requests.exceptions.Timeout:
@@ -77,12 +206,14 @@ def _get_ftx_conversion_rate(
 def _get_binance_conversion_rate(
     from_symbol: symbol_model.Symbol,
     to_symbol: symbol_model.Symbol) -> decimal.Decimal:
+    import requests
+
     if to_symbol.name == 'USD':
         to_symbol_name = 'USDT'
     else:
         to_symbol_name = to_symbol.name
 
-    endpoint = ('https://api.binance.com/api/v3/ticker/price'
+    endpoint = (f'{_BINANCE_API_BASE_URL}/api/v3/ticker/price'
                 f'?symbol={from_symbol.name}{to_symbol_name}')
     try:
         response = requests.get(endpoint, timeout=_BINANCE_API_TIMEOUT_SECONDS)
@@ -96,6 +227,7 @@ def _get_binance_conversion_rate(
 def _get_huobiglobal_conversion_rate(
     from_symbol: symbol_model.Symbol,
     to_symbol: symbol_model.Symbol) -> decimal.Decimal:
+    import requests
 
     if to_symbol.name == 'USD':
         to_symbol_name = 'USDT'
@@ -103,7 +235,7 @@ def _get_huobiglobal_conversion_rate(
         to_symbol_name = to_symbol.name
 
     huobi_symbol = (from_symbol.name + to_symbol_name).lower()
-    endpoint = ('https://api.huobi.pro/market/detail/merged'
+    endpoint = (f'{_HUOBI_API_BASE_URL}/market/detail/merged'
                 f'?symbol={huobi_symbol}')
     try:
         response = requests.get(endpoint, timeout=_HUOBI_API_TIMEOUT_SECONDS)
@@ -113,3 +245,101 @@ def _get_huobiglobal_conversion_rate(
         raise RuntimeError(f'API failed, status = {response.status_code}')
     last_price = response.json()['tick']['close']
     return decimal.Decimal(last_price)
+
+
+def _resolve_crypto_candles(
+    from_symbol: symbol_model.Symbol,
+    to_symbol: symbol_model.Symbol,
+    start: int,
+    end: int,
+    resolution: int) -> CANDLES_TYPE_ALIAS:
+    resolve_funcs = (
+        ('ftx', _get_ftx_candles),
+        ('binance', _get_binance_candles))
+    for provider, func in resolve_funcs:
+        try:
+            with _PROVIDER_SECONDS.time(provider=f'{provider}.candles',
+                                        outcome='error') as labels:
+                candles = func(from_symbol=from_symbol, to_symbol=to_symbol,
+                               start=start, end=end, resolution=resolution)
+                labels['outcome'] = 'ok'
+            return candles
+        except:
+            _PROVIDER_FAILURES.inc(provider=f'{provider}.candles')
+    raise RuntimeError('Resolving crypto candles failed.')
+
+
+def _get_ftx_candles(
+    from_symbol: symbol_model.Symbol,
+    to_symbol: symbol_model.Symbol,
+    start: int,
+    end: int,
+    resolution: int) -> CANDLES_TYPE_ALIAS:
+    import requests
+
+    market_name = '%s/%s' % (from_symbol.name, to_symbol.name)
+    endpoint = f'{_FTX_API_BASE_URL}/markets/{market_name}/candles'
+    candles: CANDLES_TYPE_ALIAS = []
+    window_start = start
+    while window_start < end:
+        window_end = min(end, window_start + _FTX_MAX_CANDLES * resolution)
+        params = {'resolution': resolution,
+                  'start_time': window_start,
+                  'end_time': window_end}
+        try:
+            response = requests.get(endpoint, params=params,
+                                    timeout=_FTX_API_TIMEOUT_SECONDS)
+        except requests.exceptions.Timeout:
+            raise RuntimeError('FTX API timed out.')
+        if response.status_code != http.HTTPStatus.OK:
+            raise RuntimeError(f'API failed, status = {response.status_code}')
+        for candle in response.json()['result']:
+            open_time = int(candle['time'] // 1000)
+            # The end time is inclusive; the next window has that candle.
+            if window_start <= open_time < window_end:
+                candles.append((open_time + resolution,
+                                decimal.Decimal(str(candle['close']))))
+        window_start = window_end
+    return candles
+
+
+def _get_binance_candles(
+    from_symbol: symbol_model.Symbol,
+    to_symbol: symbol_model.Symbol,
+    start: int,
+    end: int,
+    resolution: int) -> CANDLES_TYPE_ALIAS:
+    import requests
+
+    if resolution not in _BINANCE_INTERVALS:
+        raise ValueError(f'Unsupported Binance resolution: {resolution}')
+    if to_symbol.name == 'USD':
+        to_symbol_name = 'USDT'
+    else:
+        to_symbol_name = to_symbol.name
+
+    endpoint = f'{_BINANCE_API_BASE_URL}/api/v3/klines'
+    candles: CANDLES_TYPE_ALIAS = []
+    window_start = start
+    while window_start < end:
+        params = {'symbol': f'{from_symbol.name}{to_symbol_name}',
+                  'interval': _BINANCE_INTERVALS[resolution],
+                  'startTime': window_start * 1000,
+                  'endTime': end * 1000 - 1,
+                  'limit': _BINANCE_MAX_CANDLES}
+        try:
+            response = requests.get(endpoint, params=params,
+                                    timeout=_BINANCE_API_TIMEOUT_SECONDS)
+        except requests.exceptions.Timeout:
+            raise RuntimeError('Binance API timed out.')
+        if response.status_code != http.HTTPStatus.OK:
+            raise RuntimeError(f'API failed, status = {response.status_code}')
+        klines = response.json()
+        for kline in klines:
+            # [open time, open, high, low, close, volume, close time, ...]
+            candles.append((int(kline[0] // 1000) + resolution,
+                            decimal.Decimal(kline[4])))
+        if len(klines) < _BINANCE_MAX_CANDLES:
+            break
+        window_start = int(klines[-1][0] // 1000) + resolution
+    return candles
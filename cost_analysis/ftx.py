@@ -2,11 +2,36 @@
 import datetime
 import decimal
 import hmac
+import os
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, TYPE_CHECKING
 import urllib
 
-import requests
+if TYPE_CHECKING:
+    import requests
+
+from common import metrics
+
+
+_REQUEST_SECONDS = metrics.Histogram(
+    'asset_tracker_ftx_request_seconds',
+    'Latency of each FTX API attempt, by endpoint and outcome.')
+_REQUEST_RETRIES = metrics.Counter(
+    'asset_tracker_ftx_retries_total',
+    'FTX API attempts after the first one, by endpoint.')
+_REQUEST_FAILURES = metrics.Counter(
+    'asset_tracker_ftx_request_failures_total',
+    'FTX API calls that failed after all attempts, by endpoint.')
+_FILLS_PAGES = metrics.Counter(
+    'asset_tracker_ftx_fills_pages_total',
+    'Pages fetched from the FTX /fills endpoint.')
+_FILLS_PER_PAGE = metrics.Histogram(
+    'asset_tracker_ftx_fills_per_page',
+    'Number of new (not yet seen) fills per /fills page.',
+    buckets=(0, 1, 5, 10, 15, 19, 20, 50, 100))
+_DUPLICATE_FILLS = metrics.Counter(
+    'asset_tracker_ftx_duplicate_fills_total',
+    'Fills returned again by a later /fills page and dropped.')
 
 
 def iso_8601_to_timestamp(date_time_in_iso_8601: str) -> float:
@@ -17,7 +42,8 @@ def iso_8601_to_timestamp(date_time_in_iso_8601: str) -> float:
 
 class FtxClient:
 
-    _BASE_URL = 'https://ftx.com/api'
+    # Can be overridden, e.g. to point at a local fake exchange.
+    _BASE_URL = os.environ.get('FTX_API_BASE_URL', 'https://ftx.com/api')
     _DEFAULT_API_TIMEOUT_SECS = 5.0
     _DEFAULT_API_ATTEMPTS = 3
     _DEFAULT_API_RETRY_COOLDOWN_SECS = 0.1
@@ -28,6 +54,10 @@ class FtxClient:
                  api_key: Optional[str] = None,
                  api_secret: Optional[str] = None,
                  subaccount_name: Optional[str] = None):
+        # Imported here, since scripts like spot_from_csv.py only use this
+        # module when asked to fetch prices.
+        import requests
+
         self._session = requests.Session()
         self._api_key = api_key
         self._api_secret = api_secret
@@ -45,6 +75,16 @@ class FtxClient:
         start_time: Optional[int] = None,
         end_time: Optional[int] = None,
         market_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        return list(self.iter_user_trades(start_time=start_time,
+                                          end_time=end_time,
+                                          market_name=market_name))
+
+    def iter_user_trades(
+        self,
+        start_time: Optional[int] = None,
+        end_time: Optional[int] = None,
+        market_name: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Yields the user fills page by page, newest first."""
         endpoint = f'{self._BASE_URL}/fills'
         params = {}
         if start_time is not None:
@@ -54,7 +94,6 @@ class FtxClient:
         if market_name is not None:
             params['market'] = market_name
 
-        all_fills = []
         id_seen = set()
         while True:
             response = self._request_wrapper(method='GET',
@@ -63,16 +102,19 @@ class FtxClient:
                                              params=params)
             if response is None:
                 break
+            page = response.json()['result']
             fills = [fill
-                     for fill in response.json()['result']
+                     for fill in page
                      if fill['id'] not in id_seen]
+            _FILLS_PAGES.inc()
+            _FILLS_PER_PAGE.observe(len(fills))
+            _DUPLICATE_FILLS.inc(len(page) - len(fills))
             id_seen |= {fill['id'] for fill in fills}
-            all_fills.extend(fills)
+            yield from fills
             if len(fills) < self._USER_FILLS_RESPONSE_PAGE_SIZE:
                 break
             params['end_time'] = min(
                 iso_8601_to_timestamp(fill['time']) for fill in fills)
-        return all_fills
 
     def _request_wrapper(self,
                          *,
@@ -81,23 +123,42 @@ class FtxClient:
                          timeout: Optional[float] = None,
                          sign: bool = False,
                          attemps: int = _DEFAULT_API_ATTEMPTS,
-                         **kwargs) -> Optional[requests.Response]:
+                         **kwargs) -> Optional['requests.Response']:
+        import requests
+
         if timeout is None:
             timeout = self._DEFAULT_API_TIMEOUT_SECS
         request = requests.Request(method=method, url=endpoint, **kwargs)
         if sign:
             request = self._sign_request(request)
-        for _ in range(attemps):
-            try:
-                response = self._session.send(request.prepare(), timeout=timeout)
-                if response.json()['success']:
-                    return response
-            except requests.exceptions.Timeout:
-                continue
+        endpoint_label = self._endpoint_label(endpoint)
+        for attempt in range(attemps):
+            if attempt:
+                _REQUEST_RETRIES.inc(endpoint=endpoint_label)
+            with _REQUEST_SECONDS.time(endpoint=endpoint_label,
+                                       outcome='error') as labels:
+                try:
+                    response = self._session.send(request.prepare(),
+                                                  timeout=timeout)
+                    if response.json()['success']:
+                        labels['outcome'] = 'ok'
+                        return response
+                except requests.exceptions.Timeout:
+                    labels['outcome'] = 'timeout'
+                    continue
             time.sleep(self._DEFAULT_API_RETRY_COOLDOWN_SECS)
+        _REQUEST_FAILURES.inc(endpoint=endpoint_label)
         return None
 
-    def _sign_request(self, request: requests.Request) -> requests.Request:
+    def _endpoint_label(self, endpoint: str) -> str:
+        """Returns the endpoint path without market names, for metrics."""
+        path = endpoint[len(self._BASE_URL):]
+        if path.startswith('/markets/'):
+            return '/markets/{market_name}'
+        return path
+
+    def _sign_request(self,
+                      request: 'requests.Request') -> 'requests.Request':
         ts_millis = int(time.time() * 1000)
         prepared = request.prepare()
         signature_payload = (
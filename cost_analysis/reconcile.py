@@ -0,0 +1,426 @@
+"""Reconciles the FTX CSV export with the fills of the FTX API.
+
+Both sources are streamed at the same time into a symmetric hash join: each
+fill probes the unmatched fills of the other source, by fill id or, when a
+fill has no id, by a composite key of time, market, side, size and price.
+Matched pairs are compared field by field and dropped. Both streams are read
+newest first, like the API pages: the CSV export is read backwards if it is
+oldest first, and the fills of several markets are merged by time. The two
+copies of a fill then arrive at about the same point of both streams, so
+only the fills in between wait in memory. Once one source is exhausted, the
+unmatched fills of the other can no longer match and are reported right
+away.
+
+Reports fills missing from either source, fills listed twice by one source,
+fills whose fields differ, and the per-asset stat deltas (CSV minus API):
+    python reconcile.py -f trades.csv --api_key KEY --api_secret SECRET \\
+        -a BTC ETH -s 1633046400
+"""
+import argparse
+import dataclasses
+import datetime
+import decimal
+import heapq
+import itertools
+import os
+import sys
+import time
+from typing import (Any, Dict, Iterable, Iterator, List, Optional, Set,
+                    Tuple)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+
+from common import http_cassette
+from common import metrics
+from common import profiling
+from common import report
+import ftx
+import spot_from_csv
+import stats_model
+
+
+CSV = 'csv'
+API = 'api'
+_SOURCES = (CSV, API)
+_DEFAULT_MAX_LISTED = 20
+# Keys keep every digit, whatever the precision of the current context.
+_KEY_CONTEXT = decimal.Context(prec=28)
+_COMPARED_FIELDS = ('time', 'market', 'side', 'size', 'price')
+
+_RECONCILED_FILLS = metrics.Counter(
+    'asset_tracker_reconcile_fills_total',
+    'Fills read by reconcile, by source and outcome.')
+
+# (time in milliseconds, market, side, size, price)
+CompositeKey = Tuple[int, str, str, decimal.Decimal, decimal.Decimal]
+
+
+@dataclasses.dataclass
+class _Fill:
+    source: str
+    fill_id: Optional[str]
+    time: float
+    market: str
+    side: str
+    size: decimal.Decimal
+    price: decimal.Decimal
+
+    @property
+    def composite_key(self) -> CompositeKey:
+        return (round(self.time * 1000), self.market, self.side, self.size,
+                self.price)
+
+    @property
+    def time_text(self) -> str:
+        return datetime.datetime.fromtimestamp(
+            self.time, datetime.timezone.utc).isoformat()
+
+    def describe(self) -> str:
+        return (f'{self.fill_id or "-"} {self.time_text} {self.market} '
+                f'{self.side} {self.size} @ {self.price}')
+
+    def to_record(self) -> Dict[str, Any]:
+        return {'source': self.source, 'id': self.fill_id,
+                'time': self.time_text, 'market': self.market,
+                'side': self.side, 'size': self.size, 'price': self.price}
+
+
+def _normalize(source: str, trade: Dict[str, Any]) -> _Fill:
+    fill_id = trade.get('id')
+    return _Fill(
+        source=source,
+        fill_id=str(fill_id) if fill_id not in (None, '') else None,
+        time=datetime.datetime.fromisoformat(trade['time']).timestamp(),
+        market=trade['market'],
+        side=trade['side'],
+        # normalize() makes "0.10" and "0.1" equal keys.
+        size=decimal.Decimal(str(trade['size'])).normalize(_KEY_CONTEXT),
+        price=decimal.Decimal(str(trade['price'])).normalize(_KEY_CONTEXT))
+
+
+class _UnmatchedFills:
+    """The fills of one source waiting for a match, indexed both ways."""
+
+    def __init__(self):
+        self.by_id: Dict[str, _Fill] = {}
+        self.by_composite_key: Dict[CompositeKey, List[_Fill]] = {}
+
+    def add(self, fill: _Fill) -> None:
+        if fill.fill_id is not None:
+            self.by_id[fill.fill_id] = fill
+        self.by_composite_key.setdefault(fill.composite_key, []).append(fill)
+
+    def pop_match(self, fill: _Fill) -> Optional[_Fill]:
+        """Removes and returns the fill matching `fill`, if any."""
+        match = None
+        if fill.fill_id is not None:
+            match = self.by_id.get(fill.fill_id)
+        if match is None:
+            # Fills with different ids are different fills, even if they
+            # have the same fields.
+            for candidate in self.by_composite_key.get(fill.composite_key,
+                                                       ()):
+                if candidate.fill_id is None or fill.fill_id is None:
+                    match = candidate
+                    break
+        if match is not None:
+            self._remove(match)
+        return match
+
+    def _remove(self, fill: _Fill) -> None:
+        if fill.fill_id is not None:
+            del self.by_id[fill.fill_id]
+        candidates = self.by_composite_key[fill.composite_key]
+        candidates.remove(fill)
+        if not candidates:
+            del self.by_composite_key[fill.composite_key]
+
+    def __iter__(self) -> Iterator[_Fill]:
+        for fills in self.by_composite_key.values():
+            yield from fills
+
+
+@dataclasses.dataclass
+class Mismatch:
+    csv_fill: _Fill
+    api_fill: _Fill
+    fields: List[str]
+
+
+@dataclasses.dataclass
+class Report:
+    num_fills: Dict[str, int] = dataclasses.field(
+        default_factory=lambda: dict.fromkeys(_SOURCES, 0))
+    num_matched: int = 0
+    # Fills of one source missing from the other, keyed by the source.
+    missing: Dict[str, List[_Fill]] = dataclasses.field(
+        default_factory=lambda: {source: [] for source in _SOURCES})
+    duplicates: List[_Fill] = dataclasses.field(default_factory=list)
+    mismatches: List[Mismatch] = dataclasses.field(default_factory=list)
+    # Per asset and source.
+    stats: Dict[str, Dict[str, stats_model.CostAndEarnStats]] = (
+        dataclasses.field(default_factory=dict))
+
+    def add_to_stats(self, fill: _Fill) -> None:
+        base, _, quote = fill.market.partition('/')
+        # SPOT markets in USD and USDT are one asset, like in the cost
+        # scripts; other markets are reported by name.
+        asset = base if quote in ('USD', 'USDT') else fill.market
+        per_source = self.stats.get(asset)
+        if per_source is None:
+            per_source = self.stats[asset] = {
+                source: stats_model.CostAndEarnStats(
+                    base_asset_name=asset, quote_asset_name='USD')
+                for source in _SOURCES}
+        stats = per_source[fill.source]
+        stats.num_transactions += 1
+        if fill.side == 'buy':
+            stats.bought += fill.size
+            stats.spent += fill.size * fill.price
+        else:
+            stats.sold += fill.size
+            stats.received += fill.size * fill.price
+
+
+def reconcile(csv_trades: Iterable[Dict[str, Any]],
+              api_trades: Iterable[Dict[str, Any]],
+              time_tolerance: float = 0.001) -> Report:
+    """Joins the trades of both sources, reading them alternately.
+
+    Memory stays low only if both sources are in the same time order;
+    any order gives the same result.
+
+    Args:
+        csv_trades: Trades of the CSV export, like
+            `spot_from_csv.iter_csv_trades`.
+        api_trades: Trades of the API, like `FtxClient.iter_user_trades`.
+        time_tolerance: Largest time difference, in seconds, between the
+            two copies of a fill matched by id.
+    """
+    result = Report()
+    streams = {CSV: iter(csv_trades), API: iter(api_trades)}
+    unmatched = {source: _UnmatchedFills() for source in _SOURCES}
+    # Ids of matched fills, to tell duplicates from missing fills.
+    matched_ids: Set[str] = set()
+    exhausted: Set[str] = set()
+
+    def process(fill: _Fill) -> None:
+        result.num_fills[fill.source] += 1
+        result.add_to_stats(fill)
+        other = API if fill.source == CSV else CSV
+        own = unmatched[fill.source]
+        if fill.fill_id is not None and (fill.fill_id in matched_ids or
+                                         fill.fill_id in own.by_id):
+            result.duplicates.append(fill)
+            _RECONCILED_FILLS.inc(source=fill.source, outcome='duplicate')
+            return
+        match = unmatched[other].pop_match(fill)
+        if match is None:
+            if other in exhausted:
+                result.missing[fill.source].append(fill)
+                _RECONCILED_FILLS.inc(source=fill.source, outcome='missing')
+            else:
+                own.add(fill)
+            return
+        result.num_matched += 1
+        _RECONCILED_FILLS.inc(source=fill.source, outcome='matched')
+        if fill.fill_id is not None:
+            matched_ids.add(fill.fill_id)
+        csv_fill, api_fill = ((fill, match) if fill.source == CSV
+                              else (match, fill))
+        fields = [name for name in _COMPARED_FIELDS
+                  if getattr(csv_fill, name) != getattr(api_fill, name)]
+        if 'time' in fields and (abs(csv_fill.time - api_fill.time) <=
+                                 time_tolerance):
+            fields.remove('time')
+        if fields:
+            result.mismatches.append(Mismatch(csv_fill, api_fill, fields))
+
+    for source in itertools.cycle(_SOURCES):
+        if len(exhausted) == len(_SOURCES):
+            break
+        if source in exhausted:
+            continue
+        trade = next(streams[source], None)
+        if trade is None:
+            exhausted.add(source)
+            # Nothing can match the other source's waiting fills anymore.
+            other = API if source == CSV else CSV
+            for fill in unmatched[other]:
+                result.missing[other].append(fill)
+            unmatched[other] = _UnmatchedFills()
+            continue
+        process(_normalize(source, trade))
+
+    for source in _SOURCES:
+        result.missing[source].extend(unmatched[source])
+    return result
+
+
+def _in_scope(trades: Iterable[Dict[str, Any]],
+              asset_names: Optional[Set[str]],
+              start_time: Optional[float],
+              end_time: Optional[float]) -> Iterator[Dict[str, Any]]:
+    """Keeps the USD(T) SPOT trades of the assets within the time range."""
+    for trade in trades:
+        if asset_names is not None:
+            base, _, quote = trade['market'].partition('/')
+            if base not in asset_names or quote not in ('USD', 'USDT'):
+                continue
+        if start_time is not None or end_time is not None:
+            timestamp = datetime.datetime.fromisoformat(
+                trade['time']).timestamp()
+            if ((start_time is not None and timestamp < start_time) or
+                    (end_time is not None and timestamp > end_time)):
+                continue
+        yield trade
+
+
+def _api_trades(ftx_client: ftx.FtxClient,
+                asset_names: Optional[Set[str]],
+                start_time: Optional[int],
+                end_time: Optional[int]) -> Iterator[Dict[str, Any]]:
+    """Yields the trades of the API newest first, across markets too."""
+    if asset_names is None:
+        yield from ftx_client.iter_user_trades(start_time=start_time,
+                                               end_time=end_time)
+        return
+    # Each market is newest first; merged lazily, one page each at a time.
+    yield from heapq.merge(
+        *(ftx_client.iter_user_trades(start_time=start_time,
+                                      end_time=end_time,
+                                      market_name=f'{asset_name}/{quote}')
+          for asset_name in sorted(asset_names)
+          for quote in ('USD', 'USDT')),
+        key=lambda trade: ftx.iso_8601_to_timestamp(trade['time']),
+        reverse=True)
+
+
+def _write_fills(writer: report.ReportWriter, title: str, table: str,
+                 records: List[Tuple[Dict[str, Any], str]],
+                 max_listed: int) -> None:
+    """Writes every record; the text lists the first `max_listed` only."""
+    writer.text(f'{title}: {len(records)}')
+    for i, (record, text) in enumerate(records):
+        writer.record(table, record,
+                      text=f'  {text}' if i < max_listed else None)
+    if len(records) > max_listed:
+        writer.text(f'  ... and {len(records) - max_listed} more.')
+
+
+def _write_report(writer: report.ReportWriter, result: Report,
+                  max_listed: int) -> None:
+    writer.record(
+        'summary',
+        {'csv_fills': result.num_fills[CSV],
+         'api_fills': result.num_fills[API],
+         'matched': result.num_matched},
+        text=(f'CSV fills: {result.num_fills[CSV]}, API fills: '
+              f'{result.num_fills[API]}, matched: {result.num_matched}.'))
+    _write_fills(writer, 'Missing from the API', 'missing',
+                 [(fill.to_record(), fill.describe())
+                  for fill in result.missing[CSV]], max_listed)
+    _write_fills(writer, 'Missing from the CSV', 'missing',
+                 [(fill.to_record(), fill.describe())
+                  for fill in result.missing[API]], max_listed)
+    _write_fills(writer, 'Duplicates', 'duplicates',
+                 [(fill.to_record(), f'{fill.source}: {fill.describe()}')
+                  for fill in result.duplicates], max_listed)
+    _write_fills(writer, 'Mismatches', 'mismatches',
+                 [({'fields': ' '.join(mismatch.fields),
+                    **{f'csv_{name}': value for name, value
+                       in mismatch.csv_fill.to_record().items()
+                       if name != 'source'},
+                    **{f'api_{name}': value for name, value
+                       in mismatch.api_fill.to_record().items()
+                       if name != 'source'}},
+                   f'{", ".join(mismatch.fields)}: CSV '
+                   f'{mismatch.csv_fill.describe()} / API '
+                   f'{mismatch.api_fill.describe()}')
+                  for mismatch in result.mismatches], max_listed)
+
+    writer.text()
+    writer.text('Stat deltas (CSV - API):')
+    for asset, per_source in sorted(result.stats.items()):
+        csv_stats, api_stats = per_source[CSV], per_source[API]
+        deltas = {
+            name: getattr(csv_stats, name) - getattr(api_stats, name)
+            for name in ('num_transactions', 'bought', 'spent', 'sold',
+                         'received')}
+        status = 'OK' if not any(deltas.values()) else 'DIFF'
+        writer.record(
+            'deltas', {'asset': asset, 'status': status, **deltas},
+            text=f'  {asset}: {status} ' + ', '.join(
+                f'{name} {value:+}' for name, value in deltas.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-f',
+                        '--file',
+                        help='The trades CSV file downloaded from FTX.',
+                        required=True)
+    parser.add_argument('-a',
+                        '--assets',
+                        nargs='+',
+                        help='Only reconcile the USD(T) SPOT fills of these '
+                             'assets (default all fills).',
+                        default=None)
+    parser.add_argument('-s',
+                        '--start_timestamp',
+                        type=int,
+                        help='Start timestamp in seconds.',
+                        default=None)
+    parser.add_argument('-e',
+                        '--end_timestamp',
+                        type=int,
+                        help='End timestamp in seconds.',
+                        default=int(time.time()))
+    parser.add_argument('--api_key',
+                        help='FTX API key.',
+                        required=True)
+    parser.add_argument('--api_secret',
+                        help='FTX API secret.',
+                        required=True)
+    parser.add_argument('--subaccount_name',
+                        help='FTX subaccount.',
+                        default=None)
+    parser.add_argument('--max_listed',
+                        type=int,
+                        help='Fills listed per category.',
+                        default=_DEFAULT_MAX_LISTED)
+    http_cassette.add_cassette_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    profiling.add_profile_arguments(parser)
+    report.add_output_arguments(parser)
+    args = parser.parse_args()
+    metrics.metrics_from_args(args)
+
+    with profiling.profile_from_args(args), \
+         http_cassette.cassette_from_args(args):
+        _run(args)
+
+
+def _run(args: argparse.Namespace):
+    decimal.getcontext().prec = 8
+
+    asset_names = set(args.assets) if args.assets is not None else None
+    ftx_client = ftx.FtxClient(api_key=args.api_key,
+                               api_secret=args.api_secret,
+                               subaccount_name=args.subaccount_name)
+    with profiling.phase('reconcile'):
+        result = reconcile(
+            _in_scope(spot_from_csv.iter_csv_trades(args.file,
+                                                    newest_first=True),
+                      asset_names, args.start_timestamp, args.end_timestamp),
+            _api_trades(ftx_client, asset_names, args.start_timestamp,
+                        args.end_timestamp))
+    with profiling.phase('render'), report.writer_from_args(args) as writer:
+        _write_report(writer, result, args.max_listed)
+
+
+if __name__ == '__main__':
+    main()
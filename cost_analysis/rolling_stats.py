@@ -0,0 +1,354 @@
+"""Rolling-window SPOT trade analytics, updated as fills arrive.
+
+For each asset and window (24h, 7d and 30d by default), keeps the trade
+count, volume, VWAP and realized PnL of the fills in (now - window, now].
+
+Each window is a queue of fills held as two stacks, the older one storing
+running sums from its top, so adding a fill and evicting the oldest one are
+O(1) amortized and the window sums are never computed by subtraction (which
+would drift at the low decimal precision of the cost scripts).
+
+Realized PnL is attributed to the fill that realizes it, against the running
+average cost of the position since the first fill.
+
+Fills come from the FTX CSV export, oldest or newest first, or from the FTX
+API:
+    python rolling_stats.py -f trades.csv -a BTC ETH
+    python rolling_stats.py --api_key KEY --api_secret SECRET -a BTC \\
+        -s 1633046400
+"""
+import argparse
+import dataclasses
+import decimal
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+
+from common import http_cassette
+from common import metrics
+from common import profiling
+from common import report
+import ftx
+import spot_from_csv
+import stats_model
+
+
+DEFAULT_WINDOWS = (('24h', 86400), ('7d', 7 * 86400), ('30d', 30 * 86400))
+_DECIMAL_ZERO = decimal.Decimal('0')
+
+_FILLS = metrics.Counter(
+    'asset_tracker_rolling_stats_fills_total',
+    'Fills added to the rolling-window stats.')
+
+
+@dataclasses.dataclass
+class WindowStats:
+    """The sums of one asset's fills over one window."""
+
+    window: str
+    num_trades: int
+    volume: decimal.Decimal  # Base asset bought and sold.
+    notional: decimal.Decimal  # USD(T) spent and received.
+    realized_pnl: decimal.Decimal
+
+    @property
+    def vwap(self) -> decimal.Decimal:
+        return self.notional / self.volume if self.volume else _DECIMAL_ZERO
+
+
+class _WindowSums:
+    """Sums over a sliding window of fills, as a two-stack queue.
+
+    New fills are pushed on the back stack, whose sums are kept as running
+    totals. The front stack holds the older fills, oldest at the end, each
+    entry with the sums of itself and all newer front entries; when it runs
+    out, the back stack is moved over in one pass.
+    """
+
+    def __init__(self, length: float):
+        self.length = length
+        self._back_times: List[float] = []
+        self._back_entries: List[Tuple[decimal.Decimal, decimal.Decimal,
+                                       decimal.Decimal]] = []
+        self._back_volume = _DECIMAL_ZERO
+        self._back_notional = _DECIMAL_ZERO
+        self._back_pnl = _DECIMAL_ZERO
+        # (time, volume sum, notional sum, pnl sum), oldest at the end.
+        self._front: List[Tuple[float, decimal.Decimal, decimal.Decimal,
+                                decimal.Decimal]] = []
+
+    def push(self, fill_time: float, volume: decimal.Decimal,
+             notional: decimal.Decimal, pnl: decimal.Decimal) -> None:
+        self._back_times.append(fill_time)
+        self._back_entries.append((volume, notional, pnl))
+        self._back_volume += volume
+        self._back_notional += notional
+        self._back_pnl += pnl
+
+    def evict(self, now: float) -> None:
+        """Drops the fills at or before now - length."""
+        cutoff = now - self.length
+        while True:
+            if not self._front:
+                if not self._back_times or self._back_times[0] > cutoff:
+                    return
+                self._flip()
+            if self._front[-1][0] > cutoff:
+                return
+            self._front.pop()
+
+    def _flip(self) -> None:
+        volume = notional = pnl = _DECIMAL_ZERO
+        front = self._front
+        for fill_time, (fill_volume, fill_notional, fill_pnl) in zip(
+                reversed(self._back_times), reversed(self._back_entries)):
+            volume += fill_volume
+            notional += fill_notional
+            pnl += fill_pnl
+            front.append((fill_time, volume, notional, pnl))
+        self._back_times = []
+        self._back_entries = []
+        self._back_volume = self._back_notional = self._back_pnl = (
+            _DECIMAL_ZERO)
+
+    def stats(self, window: str) -> WindowStats:
+        if self._front:
+            _, volume, notional, pnl = self._front[-1]
+        else:
+            volume = notional = pnl = _DECIMAL_ZERO
+        return WindowStats(
+            window=window,
+            num_trades=len(self._front) + len(self._back_times),
+            volume=volume + self._back_volume,
+            notional=notional + self._back_notional,
+            realized_pnl=pnl + self._back_pnl)
+
+
+class _AverageCost:
+    """The position of an asset and its average cost, long or short."""
+
+    def __init__(self):
+        self.position = _DECIMAL_ZERO
+        self.average_price = _DECIMAL_ZERO
+
+    def apply(self, fill: stats_model.Fill) -> decimal.Decimal:
+        """Applies the fill; returns the PnL it realizes."""
+        signed_size = fill.size if fill.side == 'buy' else -fill.size
+        if not self.position or (self.position > 0) == (signed_size > 0):
+            # Opening or adding to the position.
+            new_position = self.position + signed_size
+            self.average_price = (
+                (abs(self.position) * self.average_price +
+                 fill.size * fill.price) / abs(new_position))
+            self.position = new_position
+            return _DECIMAL_ZERO
+
+        closed = min(fill.size, abs(self.position))
+        direction = 1 if self.position > 0 else -1
+        realized = closed * (fill.price - self.average_price) * direction
+        self.position += signed_size
+        if not self.position:
+            self.average_price = _DECIMAL_ZERO
+        elif (self.position > 0) != (direction > 0):
+            # Reversed: the rest of the fill opens a new position.
+            self.average_price = fill.price
+        return realized
+
+
+class RollingStats:
+    """Rolling-window stats of every asset, fed with fills in time order."""
+
+    def __init__(self, windows: Iterable[Tuple[str, float]] = DEFAULT_WINDOWS):
+        self._windows = tuple(windows)
+        self._sums: Dict[str, List[_WindowSums]] = {}
+        self._costs: Dict[str, _AverageCost] = {}
+        self.last_time: Optional[float] = None
+
+    def add(self, fill: stats_model.Fill) -> None:
+        if self.last_time is not None and fill.time < self.last_time:
+            raise ValueError(f'Fill at {fill.time} is older than the last one '
+                             f'at {self.last_time}; fills must be in time '
+                             'order.')
+        self.last_time = fill.time
+        sums = self._sums.get(fill.asset_name)
+        if sums is None:
+            sums = self._sums[fill.asset_name] = [
+                _WindowSums(length) for _, length in self._windows]
+            self._costs[fill.asset_name] = _AverageCost()
+        pnl = self._costs[fill.asset_name].apply(fill)
+        notional = fill.size * fill.price
+        for window_sums in sums:
+            window_sums.push(fill.time, fill.size, notional, pnl)
+            window_sums.evict(fill.time)
+        _FILLS.inc()
+
+    def add_all(self, fills: Iterable[stats_model.Fill]) -> int:
+        """Adds the fills; returns how many were added."""
+        count = 0
+        for fill in fills:
+            self.add(fill)
+            count += 1
+        return count
+
+    def asset_names(self) -> List[str]:
+        return sorted(self._sums)
+
+    def stats(self, asset_name: str,
+              now: Optional[float] = None) -> List[WindowStats]:
+        """The stats of every window ending at now (default the last fill).
+
+        Raises:
+            ValueError: If now is before the last fill, which the windows
+                already hold.
+        """
+        if now is None:
+            now = self.last_time
+        elif self.last_time is not None and now < self.last_time:
+            raise ValueError(f'now ({now}) is before the last fill at '
+                             f'{self.last_time}.')
+        sums = self._sums.get(asset_name)
+        if sums is None:
+            return [WindowStats(name, 0, _DECIMAL_ZERO, _DECIMAL_ZERO,
+                                _DECIMAL_ZERO) for name, _ in self._windows]
+        result = []
+        for (name, _), window_sums in zip(self._windows, sums):
+            if now is not None:
+                window_sums.evict(now)
+            result.append(window_sums.stats(name))
+        return result
+
+
+def fills_from_trades(
+        trades: Iterable[Dict[str, Any]],
+        asset_names: Optional[Iterable[str]] = None
+) -> Iterator[stats_model.Fill]:
+    """Converts `FtxClient.get_user_trades` output to fills in time order.
+
+    The API returns fills newest first, so they are sorted here.
+    """
+    asset_names = set(asset_names) if asset_names is not None else None
+    fills = []
+    for trade in trades:
+        base, _, quote = trade['market'].partition('/')
+        if quote not in ('USD', 'USDT') or (
+                asset_names is not None and base not in asset_names):
+            continue
+        fills.append(stats_model.Fill(
+            time=ftx.iso_8601_to_timestamp(trade['time']),
+            asset_name=base,
+            side=trade['side'],
+            size=decimal.Decimal(str(trade['size'])),
+            price=decimal.Decimal(str(trade['price']))))
+    fills.sort(key=lambda fill: fill.time)
+    return iter(fills)
+
+
+def _parse_window(text: str) -> Tuple[str, float]:
+    units = {'m': 60, 'h': 3600, 'd': 86400}
+    return text, float(text[:-1]) * units[text[-1]]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-a',
+                        '--assets',
+                        nargs='+',
+                        help='The target assets to analyze (default all).',
+                        default=None)
+    parser.add_argument('-f',
+                        '--file',
+                        help='The trades CSV file downloaded from FTX, '
+                             'oldest or newest first.',
+                        default=None)
+    parser.add_argument('-w',
+                        '--windows',
+                        nargs='+',
+                        type=_parse_window,
+                        help='Window lengths, like 24h, 7d or 90m.',
+                        default=DEFAULT_WINDOWS)
+    parser.add_argument('--now',
+                        type=float,
+                        help='End of the windows in seconds, not before the '
+                             'last fill (default the last fill).',
+                        default=None)
+    parser.add_argument('-s',
+                        '--start_timestamp',
+                        type=int,
+                        help='Start timestamp in seconds, for the FTX API.',
+                        default=None)
+    parser.add_argument('--api_key',
+                        help='FTX API key, to fetch fills instead of --file.',
+                        default=None)
+    parser.add_argument('--api_secret',
+                        help='FTX API secret.',
+                        default=None)
+    parser.add_argument('--subaccount_name',
+                        help='FTX subaccount.',
+                        default=None)
+    http_cassette.add_cassette_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    profiling.add_profile_arguments(parser)
+    report.add_output_arguments(parser)
+    args = parser.parse_args()
+    if (args.file is None) == (args.api_key is None):
+        parser.error('Exactly one of --file and --api_key is required.')
+    metrics.metrics_from_args(args)
+
+    with profiling.profile_from_args(args), \
+         http_cassette.cassette_from_args(args):
+        _run(args)
+
+
+def _run(args: argparse.Namespace):
+    decimal.getcontext().prec = 8
+
+    rolling_stats = RollingStats(args.windows)
+    with profiling.phase('load'):
+        if args.file is not None:
+            # The order of the file is detected, and read oldest first.
+            fills = spot_from_csv.iter_csv_fills(args.file, args.assets,
+                                                 newest_first=False)
+        else:
+            ftx_client = ftx.FtxClient(api_key=args.api_key,
+                                       api_secret=args.api_secret,
+                                       subaccount_name=args.subaccount_name)
+            fills = fills_from_trades(
+                ftx_client.get_user_trades(start_time=args.start_timestamp,
+                                           end_time=int(time.time())),
+                args.assets)
+        num_fills = rolling_stats.add_all(fills)
+
+    if (args.now is not None and rolling_stats.last_time is not None and
+            args.now < rolling_stats.last_time):
+        sys.exit(f'--now {args.now} is before the last fill at '
+                 f'{rolling_stats.last_time}.')
+
+    with profiling.phase('render'), report.writer_from_args(args) as writer:
+        writer.text(f'{num_fills} fills.')
+        for asset_name in rolling_stats.asset_names():
+            writer.text(f'===== {asset_name} =====')
+            for window_stats in rolling_stats.stats(asset_name, args.now):
+                writer.record(
+                    'windows',
+                    {'asset': asset_name,
+                     'window': window_stats.window,
+                     'num_trades': window_stats.num_trades,
+                     'volume': window_stats.volume,
+                     'vwap': window_stats.vwap,
+                     'realized_pnl': window_stats.realized_pnl},
+                    text=(f'{window_stats.window:>5}: '
+                          f'{window_stats.num_trades} trades, '
+                          f'volume {window_stats.volume}, '
+                          f'VWAP {window_stats.vwap}U, '
+                          f'realized PnL {window_stats.realized_pnl}U'))
+            writer.text()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,25 @@
 """Script to analyze SPOT cost by parsing the CSV file from FTX."""
 import argparse
 from dataclasses import dataclass
+import datetime
 import decimal
-import enum
-from typing import Dict, List
+import os
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+
+from common import metrics
+from common import profiling
+from common import report
 import ftx
+import stats_model
 
 
 _DECIMAL_ZERO = decimal.Decimal('0')
 
 
-class AnsiColorSequence(enum.Enum):
-    """ANSI escpae code for colors."""
-    RED = '\033[31m'
-    GREEN = '\033[32m'
-    END = '\033[0m'
-
-
 @dataclass
 class SpotStats:
     """Data class to store cost and earns of a target SPOT asset."""
@@ -40,16 +42,6 @@ class SpotStats:
         return self.received / self.sold if self.sold else _DECIMAL_ZERO
 
 
-def _colored_pnl(pnl_value: decimal.Decimal) -> str:
-    if pnl_value >= 0:
-        color = AnsiColorSequence.GREEN.value
-        pnl_str = f'+{pnl_value}'
-    else:
-        color = AnsiColorSequence.RED.value
-        pnl_str = str(pnl_value)
-    return f'{color}{pnl_str}{AnsiColorSequence.END.value}'
-
-
 def get_multiple_spot_stats(file_path: str,
                             asset_names: List[str]) -> Dict[str, SpotStats]:
     """Parses CSV file to get SpotStats for each asset."""
@@ -80,6 +72,118 @@ def get_multiple_spot_stats(file_path: str,
     return ret
 
 
+_REVERSE_READ_BLOCK_BYTES = 1 << 16
+
+
+def _iter_lines(file_path: str, reverse: bool = False) -> Iterator[str]:
+    """Yields the lines of a file, last line first if `reverse`.
+
+    Both directions stream: reversed, the file is read in blocks from the
+    end, so memory stays bounded by the block and line sizes.
+    """
+    if not reverse:
+        with open(file_path, 'r') as f:
+            yield from f
+        return
+    with open(file_path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        partial = b''
+        while position > 0:
+            size = min(_REVERSE_READ_BLOCK_BYTES, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + partial).split(b'\n')
+            # The first line may continue in the previous block.
+            partial = lines.pop(0)
+            for line in reversed(lines):
+                yield line.decode()
+        yield partial.decode()
+
+
+def _trade_time(line: str) -> Optional[str]:
+    """Returns the time of a trade line, or None for other lines."""
+    tokens = [token.strip('"') for token in line.strip().split(',')]
+    if len(tokens) < 7 or tokens[0] == 'id':
+        return None
+    return tokens[1]
+
+
+def is_newest_first(file_path: str) -> bool:
+    """Whether the CSV file lists its newest trades first.
+
+    Only the first and last trades are compared, read from both ends.
+    """
+    first = next(filter(None, map(_trade_time, _iter_lines(file_path))),
+                 None)
+    last = next(filter(None, map(_trade_time,
+                                 _iter_lines(file_path, reverse=True))),
+                None)
+    if first is None or last is None:
+        return False
+    return (datetime.datetime.fromisoformat(first) >
+            datetime.datetime.fromisoformat(last))
+
+
+def _ordered_lines(file_path: str,
+                   newest_first: Optional[bool]) -> Iterator[str]:
+    if newest_first is None:
+        return _iter_lines(file_path)
+    return _iter_lines(file_path,
+                       reverse=is_newest_first(file_path) != newest_first)
+
+
+def iter_csv_trades(file_path: str,
+                    newest_first: Optional[bool] = None
+                    ) -> Iterator[Dict[str, str]]:
+    """Yields every trade of the CSV file.
+
+    Trades are shaped like the FTX `/fills` results ("id", "time", "market",
+    "side", "size" and "price"), with string values. They are in file order,
+    or newest or oldest first as `newest_first` says, whatever the order of
+    the file.
+    """
+    for line in _ordered_lines(file_path, newest_first):
+        tokens = [token.strip('"') for token in line.strip().split(',')]
+        if len(tokens) < 7 or tokens[0] == 'id':
+            continue
+        yield {'id': tokens[0], 'time': tokens[1], 'market': tokens[2],
+               'side': tokens[3], 'size': tokens[5], 'price': tokens[6]}
+
+
+def iter_csv_fills(
+        file_path: str,
+        asset_names: Optional[Iterable[str]] = None,
+        newest_first: Optional[bool] = None
+) -> Iterator[stats_model.Fill]:
+    """Yields the USD(T) SPOT fills of the CSV file.
+
+    Lines are parsed one at a time, so files of any size stream in constant
+    memory. Only fills of `asset_names` are yielded, if given. Fills are in
+    file order, or newest or oldest first as `newest_first` says.
+    """
+    asset_names = set(asset_names) if asset_names is not None else None
+    for line in _ordered_lines(file_path, newest_first):
+        tokens = line.strip().split(',')
+
+        # tokens[2] should be like "ETH/USD", "ETH/USDT", etc.
+        if len(tokens) < 3 or '/' not in tokens[2]:
+            continue
+        base, quote = tokens[2].strip('"').split('/', 1)
+        if quote not in ('USD', 'USDT') or (
+                asset_names is not None and base not in asset_names):
+            continue
+        side = tokens[3].strip('"')
+        if side not in ('buy', 'sell'):
+            raise ValueError(f'Did not recognize side value: {side}')
+        yield stats_model.Fill(
+            time=datetime.datetime.fromisoformat(
+                tokens[1].strip('"')).timestamp(),
+            asset_name=base,
+            side=side,
+            size=decimal.Decimal(tokens[5].strip('"')),
+            price=decimal.Decimal(tokens[6].strip('"')))
+
+
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('-a',
@@ -95,34 +199,66 @@ def main():
                         '--include_live_price',
                         help='To include current price from FTX.',
                         action='store_true')
+    metrics.add_metrics_arguments(parser)
+    profiling.add_profile_arguments(parser)
+    report.add_output_arguments(parser)
     args = parser.parse_args()
+    metrics.metrics_from_args(args)
+
+    with profiling.profile_from_args(args):
+        _run(args)
+
 
+def _run(args: argparse.Namespace):
     decimal.getcontext().prec = 8
 
-    asset_name_to_stats = get_multiple_spot_stats(args.file, args.assets)
+    with profiling.phase('load'):
+        asset_name_to_stats = get_multiple_spot_stats(args.file, args.assets)
 
     if args.include_live_price:
         ftx_client = ftx.FtxClient()
 
-    total_pnl = _DECIMAL_ZERO
-    for asset_name, stats in asset_name_to_stats.items():
-        print(f'===== {asset_name}: {stats.num_transactions} trades. ===== ')
-        print(f'Spent {stats.spent}U for {stats.bought} {asset_name}. '
-              f'({stats.get_average_buy_price()}U each.)')
-        print(f'Sold {stats.sold} {asset_name} for {stats.received}U. '
-              f'({stats.get_average_sell_price()}U each.)')
-        if args.include_live_price:
-            current_price = ftx_client.get_last_price(f'{asset_name}/USD')
-            print(f'Current price on FTX is: {current_price}')
-            # Calculate the PnL if applicable.
-            if stats.bought >= stats.sold:
-                amount_left = stats.bought - stats.sold
-                total_value = amount_left * current_price + stats.received
-                pnl = total_value - stats.spent
-                print(f'Total worth: {total_value}U ({_colored_pnl(pnl)})')
-                total_pnl += pnl
-        print()
-    print('Total PnL: ' + _colored_pnl(total_pnl))
+    with profiling.phase('render'), report.writer_from_args(args) as writer:
+        total_pnl = _DECIMAL_ZERO
+        for asset_name, stats in asset_name_to_stats.items():
+            writer.text(f'===== {asset_name}: {stats.num_transactions} '
+                        'trades. ===== ')
+            writer.text(f'Spent {stats.spent}U for {stats.bought} '
+                        f'{asset_name}. ({stats.get_average_buy_price()}U '
+                        'each.)')
+            writer.text(f'Sold {stats.sold} {asset_name} for '
+                        f'{stats.received}U. '
+                        f'({stats.get_average_sell_price()}U each.)')
+            record = {
+                'asset': asset_name,
+                'num_transactions': stats.num_transactions,
+                'bought': stats.bought,
+                'spent': stats.spent,
+                'average_buy_price': stats.get_average_buy_price(),
+                'sold': stats.sold,
+                'received': stats.received,
+                'average_sell_price': stats.get_average_sell_price(),
+            }
+            if args.include_live_price:
+                with profiling.phase('fetch'):
+                    current_price = ftx_client.get_last_price(
+                        f'{asset_name}/USD')
+                writer.text(f'Current price on FTX is: {current_price}')
+                record.update(current_price=current_price, total_worth=None,
+                              pnl=None)
+                # Calculate the PnL if applicable.
+                if stats.bought >= stats.sold:
+                    amount_left = stats.bought - stats.sold
+                    total_value = amount_left * current_price + stats.received
+                    pnl = total_value - stats.spent
+                    writer.text(f'Total worth: {total_value}U '
+                                f'({writer.colored_pnl(pnl)})')
+                    record.update(total_worth=total_value, pnl=pnl)
+                    total_pnl += pnl
+            writer.record('assets', record)
+            writer.text()
+        writer.record('totals', {'pnl': total_pnl},
+                      text='Total PnL: ' + writer.colored_pnl(total_pnl))
 
 
 if __name__ == '__main__':
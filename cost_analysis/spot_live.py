@@ -2,73 +2,77 @@
 import argparse
 from dataclasses import dataclass
 import decimal
-import enum
+import os
+import sys
 import time
+from typing import Any, Dict, Optional
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+
+from common import http_cassette
+from common import metrics
+from common import profiling
+from common import report
 import ftx
 import stats_model
 
 
 _DEFAULT_START_TIMESTAMP: int = 1577836800
-_DECIMAL_ZERO = decimal.Decimal('0')
-
-
-class AnsiColorSequence(enum.Enum):
-    """ANSI escpae code for colors."""
-    RED = '\033[31m'
-    GREEN = '\033[32m'
-    YELLOW = '\033[33m'
-    BLUE = '\033[34m'
-    CYAN = '\033[36m'
-    GRAY = '\033[90m'
-    BRIGHT_YELLOW = '\033[93m'
-    END = '\033[0m'
-
-
-def _colored_pnl(pnl_value: decimal.Decimal) -> str:
-    if pnl_value == _DECIMAL_ZERO:
-        return str(pnl_value)
-    if pnl_value > 0:
-        color = AnsiColorSequence.GREEN.value
-        pnl_str = f'+{pnl_value}'
-    else:
-        color = AnsiColorSequence.RED.value
-        pnl_str = str(pnl_value)
-    return f'{color}{pnl_str}{AnsiColorSequence.END.value}'
-
-
-def _colored_text(text: str, color: AnsiColorSequence) -> str:
-    return f'{color.value}{text}{AnsiColorSequence.END.value}'
 
 
 def get_spot_stats(asset_name: str,
                    ftx_client: ftx.FtxClient,
                    start_time: int,
                    end_time: int) -> stats_model.CostAndEarnStats:
-    usd_fills = ftx_client.get_user_trades(market_name=f'{asset_name}/USD',
-                                           start_time=start_time,
-                                           end_time=end_time)
-    usdt_fills = ftx_client.get_user_trades(market_name=f'{asset_name}/USDT',
-                                            start_time=start_time,
-                                            end_time=end_time)
-    all_fills = usd_fills + usdt_fills
-    ret = stats_model.CostAndEarnStats(
-        base_asset_name=asset_name,
-        quote_asset_name='USD',
-        num_transactions=len(all_fills))
-    for fill in all_fills:
-        side = fill['side']
-        size = decimal.Decimal(str(fill['size']))
-        price = decimal.Decimal(str(fill['price']))
-        if side == 'buy':
-            ret.bought += size
-            ret.spent += (size * price)
-        elif side == 'sell':
-            ret.sold += size
-            ret.received += (size * price)
+    with profiling.phase('fetch'):
+        usd_fills = ftx_client.get_user_trades(
+            market_name=f'{asset_name}/USD',
+            start_time=start_time,
+            end_time=end_time)
+        usdt_fills = ftx_client.get_user_trades(
+            market_name=f'{asset_name}/USDT',
+            start_time=start_time,
+            end_time=end_time)
+    with profiling.phase('aggregate'):
+        all_fills = usd_fills + usdt_fills
+        ret = stats_model.CostAndEarnStats(
+            base_asset_name=asset_name,
+            quote_asset_name='USD',
+            num_transactions=len(all_fills))
+        for fill in all_fills:
+            side = fill['side']
+            size = decimal.Decimal(str(fill['size']))
+            price = decimal.Decimal(str(fill['price']))
+            if side == 'buy':
+                ret.bought += size
+                ret.spent += (size * price)
+            elif side == 'sell':
+                ret.sold += size
+                ret.received += (size * price)
     return ret
 
 
+def _asset_record(asset_name: str,
+                  stats: stats_model.CostAndEarnStats,
+                  current_price: Optional[decimal.Decimal] = None,
+                  pnl: Optional[stats_model.Pnl] = None) -> Dict[str, Any]:
+    return {
+        'asset': asset_name,
+        'num_transactions': stats.num_transactions,
+        'bought': stats.bought,
+        'spent': stats.spent,
+        'average_buy_price': stats.get_average_buy_price(),
+        'sold': stats.sold,
+        'received': stats.received,
+        'average_sell_price': stats.get_average_sell_price(),
+        'current_price': current_price,
+        'pnl': pnl.total if pnl is not None else None,
+        'realized_pnl': pnl.realized if pnl is not None else None,
+        'unrealized_pnl': pnl.unrealized if pnl is not None else None,
+    }
+
+
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('-a',
@@ -98,8 +102,19 @@ def main():
                         help='FTX subaccount.',
                         required=False,
                         default=None)
+    http_cassette.add_cassette_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    profiling.add_profile_arguments(parser)
+    report.add_output_arguments(parser)
     args = parser.parse_args()
+    metrics.metrics_from_args(args)
+
+    with profiling.profile_from_args(args), \
+         http_cassette.cassette_from_args(args):
+        _run(args)
+
 
+def _run(args: argparse.Namespace):
     decimal.getcontext().prec = 8
 
     ftx_client = ftx.FtxClient(api_key=args.api_key,
@@ -115,35 +130,47 @@ def main():
                                    args.end_timestamp)
         for asset_name in asset_names}
 
-    total_pnl = stats_model.Pnl()
-    for asset_name, stats in asset_name_to_stats.items():
-        print()
-        print(_colored_text(
-            f'===== {asset_name}: {stats.num_transactions} trades. ===== ',
-            AnsiColorSequence.YELLOW))
-
-        if stats.num_transactions == 0:
-            continue
-
-        print(f'Spent {stats.spent}U for {stats.bought} {asset_name}. '
-              f'({stats.get_average_buy_price()}U each.)')
-        print(f'Sold {stats.sold} {asset_name} for {stats.received}U. '
-              f'({stats.get_average_sell_price()}U each.)')
-        current_price = ftx_client.get_last_price(f'{asset_name}/USD')
-        print(f'Current price on FTX is: {current_price}')
-
-        pnl = stats.get_pnl(current_price)
-        # Print format: "PnL: xyz (Realized: xyz, Unrealized: xyz)"
-        print(f'PnL: {_colored_pnl(pnl.total)} '
-              f'(Realized: {_colored_pnl(pnl.realized)}, '
-              f'Unrealized: {_colored_pnl(pnl.unrealized)})')
-        total_pnl.realized += pnl.realized
-        total_pnl.unrealized += pnl.unrealized
-        print()
-
-    print(f'Total PnL: {_colored_pnl(total_pnl.total)} '
-          f'(Realized: {_colored_pnl(total_pnl.realized)}, '
-          f'Unrealized: {_colored_pnl(total_pnl.unrealized)})')
+    with profiling.phase('render'), report.writer_from_args(args) as writer:
+        total_pnl = stats_model.Pnl()
+        for asset_name, stats in asset_name_to_stats.items():
+            writer.text()
+            writer.text(writer.colored(
+                f'===== {asset_name}: {stats.num_transactions} trades. ===== ',
+                report.AnsiColorSequence.YELLOW))
+
+            if stats.num_transactions == 0:
+                writer.record('assets', _asset_record(asset_name, stats))
+                continue
+
+            writer.text(f'Spent {stats.spent}U for {stats.bought} '
+                        f'{asset_name}. ({stats.get_average_buy_price()}U '
+                        'each.)')
+            writer.text(f'Sold {stats.sold} {asset_name} for '
+                        f'{stats.received}U. '
+                        f'({stats.get_average_sell_price()}U each.)')
+            with profiling.phase('fetch'):
+                current_price = ftx_client.get_last_price(
+                    f'{asset_name}/USD')
+            writer.text(f'Current price on FTX is: {current_price}')
+
+            pnl = stats.get_pnl(current_price)
+            # Print format: "PnL: xyz (Realized: xyz, Unrealized: xyz)"
+            writer.record(
+                'assets', _asset_record(asset_name, stats, current_price, pnl),
+                text=(f'PnL: {writer.colored_pnl(pnl.total)} '
+                      f'(Realized: {writer.colored_pnl(pnl.realized)}, '
+                      f'Unrealized: {writer.colored_pnl(pnl.unrealized)})'))
+            total_pnl.realized += pnl.realized
+            total_pnl.unrealized += pnl.unrealized
+            writer.text()
+
+        writer.record(
+            'totals',
+            {'pnl': total_pnl.total, 'realized_pnl': total_pnl.realized,
+             'unrealized_pnl': total_pnl.unrealized},
+            text=(f'Total PnL: {writer.colored_pnl(total_pnl.total)} '
+                  f'(Realized: {writer.colored_pnl(total_pnl.realized)}, '
+                  f'Unrealized: {writer.colored_pnl(total_pnl.unrealized)})'))
 
 
 if __name__ == '__main__':
@@ -6,6 +6,17 @@ from typing import Tuple
 _DECIMAL_ZERO = decimal.Decimal('0')
 
 
+@dataclasses.dataclass(frozen=True)
+class Fill:
+    """One trade of a base asset against USD(T)."""
+
+    time: float  # Unix seconds.
+    asset_name: str
+    side: str  # "buy" or "sell".
+    size: decimal.Decimal
+    price: decimal.Decimal
+
+
 @dataclasses.dataclass
 class Pnl:
     realized: decimal.Decimal = _DECIMAL_ZERO
@@ -1,13 +1,21 @@
 import argparse
 from collections import defaultdict
 import decimal
-from typing import List, Set
+import os
+import pickle
+import sys
+from typing import List, Optional, Sequence, Set, Tuple
 
 import yaml
 
+from common import http_cassette
+from common import metrics
+from common import profiling
+from common import report
 import converter
 from models import asset_model, portfolio_model
 from models import symbol_model
+import quote_providers
 
 
 def _load_portfolios_from_yaml(
@@ -18,6 +26,108 @@ def _load_portfolios_from_yaml(
         for portfolio_data in data['Portfolios']
     ]
 
+
+def _input_rate(cv: converter.Conversion) -> decimal.Decimal:
+    # Manual input.
+    rate = input(f'Convert {cv.from_symbol} to {cv.to_symbol} > ')
+    return decimal.Decimal(rate)
+
+
+def _portfolio_report(
+    portfolio: portfolio_model.Portfolio,
+    converted_assets: List[asset_model.Asset],
+    totals: List[asset_model.Asset]) -> report.Block:
+    block = report.Block()
+    block.text()
+    block.text(f'========== {portfolio.name} ==========')
+    block.text('[Totals]')
+    for asset in totals:
+        block.record('portfolio_totals',
+                     {'portfolio': portfolio.name,
+                      'symbol': asset.symbol,
+                      'quantity': asset.quantity},
+                     text=f'{asset.symbol}: {asset.quantity}')
+    block.text()
+    block.text('[Breakdowns]')
+    for original, converted in zip(portfolio.assets, converted_assets):
+        block.record('breakdowns',
+                     {'portfolio': portfolio.name,
+                      'symbol': original.symbol,
+                      'quantity': original.quantity,
+                      'converted_symbol': converted.symbol,
+                      'converted_quantity': converted.quantity},
+                     text=(f'\t{original.symbol}: {original.quantity} => '
+                           f'{converted.symbol}: {converted.quantity}'))
+    block.text()
+    return block
+
+
+# Set in each worker process of the sharded mode.
+_worker_rates: Optional[portfolio_model.RATES_TYPE_ALIAS] = None
+
+
+def _init_worker(rates_memory_name: str, rates_size: int,
+                 precision: int) -> None:
+    global _worker_rates
+    from multiprocessing import shared_memory
+
+    decimal.getcontext().prec = precision
+    # The rates snapshot is pickled once into shared memory by the parent,
+    # instead of being sent along with every shard.
+    memory = shared_memory.SharedMemory(name=rates_memory_name)
+    try:
+        _worker_rates = pickle.loads(memory.buf[:rates_size])
+    finally:
+        memory.close()
+
+
+def _convert_shard(
+    portfolios: Sequence[portfolio_model.Portfolio],
+) -> List[Tuple[report.Block, List[asset_model.Asset]]]:
+    """Returns the report and totals of each portfolio of the shard."""
+    results = []
+    for portfolio in portfolios:
+        converted_assets = portfolio.convert(_worker_rates)
+        totals = portfolio.calculate_totals(_worker_rates)
+        results.append((
+            _portfolio_report(portfolio, converted_assets, totals),
+            totals))
+    return results
+
+
+def _convert_sharded(
+    portfolios: List[portfolio_model.Portfolio],
+    rates: portfolio_model.RATES_TYPE_ALIAS,
+    workers: int) -> List[Tuple[report.Block, List[asset_model.Asset]]]:
+    """Converts the portfolios in a process pool, keeping their order."""
+    # Only imported in this mode, to keep the serial start-up short.
+    import concurrent.futures
+    from multiprocessing import shared_memory
+
+    # A few shards per worker balance uneven portfolios.
+    num_shards = min(len(portfolios), workers * 4) or 1
+    shard_size = -(-len(portfolios) // num_shards)
+    shards = [portfolios[i:i + shard_size]
+              for i in range(0, len(portfolios), shard_size)]
+
+    pickled_rates = pickle.dumps(rates, protocol=pickle.HIGHEST_PROTOCOL)
+    memory = shared_memory.SharedMemory(create=True,
+                                        size=max(1, len(pickled_rates)))
+    try:
+        memory.buf[:len(pickled_rates)] = pickled_rates
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(memory.name, len(pickled_rates),
+                          decimal.getcontext().prec)) as executor:
+            return [result
+                    for shard_results in executor.map(_convert_shard, shards)
+                    for result in shard_results]
+    finally:
+        memory.close()
+        memory.unlink()
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -26,49 +136,84 @@ def main():
         type=str,
         required=True,
         help='Path to YAML file that stores portfolio data.')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help=('Number of processes converting the portfolios; 0 for one per '
+              'CPU. The output is the same as with a single process.'))
+    quote_providers.add_quote_arguments(parser)
+    http_cassette.add_cassette_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    profiling.add_profile_arguments(parser)
+    report.add_output_arguments(parser)
     args = parser.parse_args()
+    metrics.metrics_from_args(args)
 
+    with profiling.profile_from_args(args), \
+         http_cassette.cassette_from_args(args):
+        _run(args)
+
+
+def _run(args: argparse.Namespace):
     decimal.getcontext().prec = 6
 
     # Load portfolios and get conversions.
-    portfolios = _load_portfolios_from_yaml(file_path=args.portfolio_yaml)
-    required_conversions: Set[converter.Conversion] = set()
-    for portfolio in portfolios:
-        required_conversions |= portfolio.get_required_conversions()
+    with profiling.phase('load'):
+        portfolios = _load_portfolios_from_yaml(file_path=args.portfolio_yaml)
+        required_conversions: Set[converter.Conversion] = set()
+        for portfolio in portfolios:
+            conversions = portfolio.get_required_conversions()
+            if metrics.is_enabled():
+                # How many conversions are shared with an earlier portfolio,
+                # and so fetched once for all of them.
+                for cv in conversions:
+                    metrics.record_dedup_lookup(
+                        'conversions', duplicate=cv in required_conversions)
+            required_conversions |= conversions
 
-    # Get rates.
-    rates: portfolio_model.RATES_TYPE_ALIAS = {}
-    for cv in required_conversions:
+    # Get rates. Stock and FIAT rates come from the quote providers, in one
+    # batch per asset class. Missing rates are only asked for when stdin is
+    # a terminal, so unattended runs fail instead of blocking.
+    with profiling.phase('fetch'):
         try:
-            rates[(cv.from_symbol, cv.to_symbol)] = cv.get_rate()
-        except:
-            # Manual input.
-            rate = input(f'Convert {cv.from_symbol} to {cv.to_symbol} > ')
-            rates[(cv.from_symbol, cv.to_symbol)] = decimal.Decimal(rate)
+            rates: portfolio_model.RATES_TYPE_ALIAS = converter.get_rates(
+                required_conversions,
+                fallback=_input_rate if sys.stdin.isatty() else None,
+                quote_providers=quote_providers.providers_from_args(args))
+        except LookupError as e:
+            sys.exit(f'Cannot get the rates: {e}')
+
+    # Convert every portfolio.
+    workers = args.workers or os.cpu_count()
+    with profiling.phase('aggregate'):
+        if workers > 1:
+            portfolio_results = _convert_sharded(portfolios, rates, workers)
+        else:
+            portfolio_results = []
+            for portfolio in portfolios:
+                converted_assets = portfolio.convert(rates)
+                totals = portfolio.calculate_totals(rates)
+                portfolio_results.append((
+                    _portfolio_report(portfolio, converted_assets, totals),
+                    totals))
 
     # Output each portfolio report.
-    all_portfolio_totals = defaultdict(decimal.Decimal)
-    for portfolio in portfolios:
+    with profiling.phase('render'), report.writer_from_args(args) as writer:
+        # Summed in portfolio order whatever the mode, since the Decimal
+        # context rounds every addition.
+        all_portfolio_totals = defaultdict(decimal.Decimal)
+        for block, totals in portfolio_results:
+            writer.write_block(block)
+            for asset in totals:
+                all_portfolio_totals[asset.symbol] += asset.quantity
 
-        converted_assets: List[asset_model.Asset] = portfolio.convert(rates)
-        totals: List[asset_model.Asset] = portfolio.calculate_totals(rates)
-
-        print(f'\n========== {portfolio.name} ==========')
-        print('[Totals]')
-        for asset in totals:
-            print(f'{asset.symbol}: {asset.quantity}')
-            all_portfolio_totals[asset.symbol] += asset.quantity
-        print()
-        print('[Breakdowns]')
-        for original, converted in zip(portfolio.assets, converted_assets):
-            print(f'\t{original.symbol}: {original.quantity} => '
-                  f'{converted.symbol}: {converted.quantity}')
-        print()
-
-    # Output the totals of all portfolio totals.
-    print('\n========== Totals of all portfolios ==========')
-    for symbol, quantity in all_portfolio_totals.items():
-        print(f'{symbol}: {quantity}')
+        # Output the totals of all portfolio totals.
+        writer.text()
+        writer.text('========== Totals of all portfolios ==========')
+        for symbol, quantity in all_portfolio_totals.items():
+            writer.record('totals', {'symbol': symbol, 'quantity': quantity},
+                          text=f'{symbol}: {quantity}')
 
 
 if __name__ == '__main__':
@@ -1,11 +1,16 @@
 from collections import defaultdict
 import decimal
-from typing import Any, Dict, List, Set, Tuple
+from typing import Any, Dict, List, Set, Tuple, TYPE_CHECKING
 
 import converter
 from models import asset_model
 from models import symbol_model
 
+if TYPE_CHECKING:
+    # Only `valuate_at` needs these, and NumPy is slow to import.
+    import numpy as np
+    import price_history
+
 
 RATES_TYPE_ALIAS = Dict[
     Tuple[symbol_model.Symbol, symbol_model.Symbol], decimal.Decimal]
@@ -62,3 +67,43 @@ class Portfolio:
             asset_model.Asset(symbol=symbol, quantity=quantity)
             for symbol, quantity in per_symbol_totals.items()
         ]
+
+    def valuate_at(
+        self,
+        timestamps: 'np.ndarray',
+        price_store: 'price_history.PriceHistoryStore',
+    ) -> Dict[symbol_model.Symbol, 'np.ndarray']:
+        """Values the portfolio at past times from stored prices.
+
+        Assets converting the same way are summed first, so each pair's
+        prices are looked up once for all timestamps. The values are floats
+        (not Decimals), and NaN where a price was not known yet.
+
+        Args:
+            timestamps: Unix seconds to value the portfolio at.
+            price_store: The historical prices.
+
+        Returns:
+            The totals per target symbol, aligned with `timestamps`.
+        """
+        import numpy as np
+
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        quantities = defaultdict(decimal.Decimal)
+        for asset in self.assets:
+            quantities[(asset.symbol, asset.target_symbol)] += (
+                decimal.Decimal(asset.quantity))
+
+        totals: Dict[symbol_model.Symbol, 'np.ndarray'] = {}
+        for (from_symbol, to_symbol), quantity in quantities.items():
+            if from_symbol == to_symbol:
+                values = np.full(timestamps.shape, float(quantity))
+            else:
+                prices = price_store.load(from_symbol, to_symbol).prices_at(
+                    timestamps)
+                values = float(quantity) * prices
+            if to_symbol in totals:
+                totals[to_symbol] += values
+            else:
+                totals[to_symbol] = values
+        return totals
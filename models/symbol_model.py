@@ -1,8 +1,6 @@
 from dataclasses import dataclass
 import enum
-from typing import Any
-
-import immutabledict
+from typing import Any, Iterable, List, Union
 
 
 class SymbolType(enum.Enum):
@@ -29,6 +27,10 @@ class Symbol:
         return self.__repr__()
 
     def __eq__(self, other: 'Symbol') -> bool:
+        # Registry symbols are interned, so most equal symbols are the same
+        # object.
+        if self is other:
+            return True
         return (isinstance(other, Symbol) and
                 self.symbol_type == other.symbol_type and
                 self.name == other.name)
@@ -37,79 +39,50 @@ class Symbol:
         return hash(self.full_name)
 
 
-_ALL_SYMBOLS = (
-    Symbol(symbol_type=SymbolType.CRYPTO, name='AAPL'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='ATLAS'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='BNB'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='BTC'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='COIN'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='CRO'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='DOGE'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='EDEN'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='ETH'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='FTT'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='FUN'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='GOOGL'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='GRT'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='KIN'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='LINK'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='MAPS'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='MER'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='MNGO'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='NEXO'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='NFLX'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='OMG'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='OXY'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='RAY'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='REEF'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='SBR'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='SHIB'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='SLND'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='SOL'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='SRM'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='SUSHI'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='SXP'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='TKO'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='TRX'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='TWT'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='UNI'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='USDC'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='USDT'),
-    Symbol(symbol_type=SymbolType.CRYPTO, name='ZRX'),
-
-    Symbol(symbol_type=SymbolType.FIAT, name='TWD'),
-    Symbol(symbol_type=SymbolType.FIAT, name='USD'),
-
-    Symbol(symbol_type=SymbolType.US_STOCK, name='AAPL'),
-    Symbol(symbol_type=SymbolType.US_STOCK, name='DIS'),
-    Symbol(symbol_type=SymbolType.US_STOCK, name='GOOG'),
-    Symbol(symbol_type=SymbolType.US_STOCK, name='NIO'),
-    Symbol(symbol_type=SymbolType.US_STOCK, name='SE'),
-    Symbol(symbol_type=SymbolType.US_STOCK, name='TSLA'),
-    Symbol(symbol_type=SymbolType.US_STOCK, name='TSM'),
-)
-
-_FULL_NAME_TO_SYMBOL = immutabledict.immutabledict({
-    symbol.full_name: symbol
-    for symbol in _ALL_SYMBOLS
-})
-
-_TYPE_AND_NAME_TO_SYMBOL = immutabledict.immutabledict({
-    (symbol.symbol_type, symbol.name): symbol
-    for symbol in _ALL_SYMBOLS
-})
-
-SYMBOL_TYPES_DEFAULT_QUOTE_SYMBOL = immutabledict.immutabledict({
-    SymbolType.CRYPTO: _TYPE_AND_NAME_TO_SYMBOL[(SymbolType.FIAT, 'USD')],
-    SymbolType.FIAT: _TYPE_AND_NAME_TO_SYMBOL[(SymbolType.FIAT, 'TWD')],
-    SymbolType.TW_STOCK: _TYPE_AND_NAME_TO_SYMBOL[(SymbolType.FIAT, 'TWD')],
-    SymbolType.US_STOCK: _TYPE_AND_NAME_TO_SYMBOL[(SymbolType.FIAT, 'USD')],
-})
+# The registry of known symbols (models/symbol_registry.py), loaded on
+# first use so importing this module stays cheap.
+_registry = None
+
+
+def _get_registry():
+    global _registry
+    if _registry is None:
+        from models import symbol_registry
+        _registry = symbol_registry.SymbolRegistry()
+    return _registry
+
+
+def __getattr__(name: str) -> Any:
+    # SYMBOL_TYPES_DEFAULT_QUOTE_SYMBOL is only defined once built.
+    if name == 'SYMBOL_TYPES_DEFAULT_QUOTE_SYMBOL':
+        import immutabledict
+
+        global SYMBOL_TYPES_DEFAULT_QUOTE_SYMBOL
+        usd = get_symbol_from_full_name('FIAT.USD')
+        twd = get_symbol_from_full_name('FIAT.TWD')
+        SYMBOL_TYPES_DEFAULT_QUOTE_SYMBOL = immutabledict.immutabledict({
+            SymbolType.CRYPTO: usd,
+            SymbolType.FIAT: twd,
+            SymbolType.TW_STOCK: twd,
+            SymbolType.US_STOCK: usd,
+        })
+        return SYMBOL_TYPES_DEFAULT_QUOTE_SYMBOL
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def get_symbol_from_type_and_name(symbol_type: SymbolType,
                                   name: str) -> Symbol:
-    return _TYPE_AND_NAME_TO_SYMBOL[(symbol_type, name)]
+    return _get_registry().get(f'{symbol_type.name}.{name}')
 
 def get_symbol_from_full_name(full_name: str) -> Symbol:
-    return _FULL_NAME_TO_SYMBOL[full_name]
+    return _get_registry().get(full_name)
+
+
+def all_symbols() -> List[Symbol]:
+    """Returns every known symbol, in full name order."""
+    return list(_get_registry())
+
+
+def register_symbols(symbols: Iterable[Union[Symbol, str]]) -> List[Symbol]:
+    """Makes symbols (or full names) known to this process, in bulk."""
+    return _get_registry().register(symbols)
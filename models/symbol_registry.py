@@ -0,0 +1,257 @@
+"""The registry of known symbols, loaded from a symbols file.
+
+The symbols file lists one full name per line, e.g. "CRYPTO.BTC"; blank lines
+and "#" comments are ignored. On first use it is compiled into an index file
+next to it (<symbols file>.idx), which is rebuilt whenever the symbols file
+changes:
+
+    header: magic, the symbols file mtime (ns) and size, the number of names
+    offsets: number of names + 1 little-endian uint32, into the names
+    names: the sorted UTF-8 full names, back to back
+
+The index is memory-mapped, so opening it costs the same for 50 symbols or
+50k, and finding a name is a binary search over the offsets. Each `Symbol` is
+created on its first lookup and interned: later lookups are one dict access
+and return the same object.
+
+Symbols can also be registered in bulk, for the current process with
+`SymbolRegistry.register`, or in the symbols file with `add_to_file`:
+    python models/symbol_registry.py add US_STOCK.MSFT US_STOCK.NVDA
+    python models/symbol_registry.py add --from_file listed.txt
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+if __name__ == '__main__':
+    # Run as a script: the repository root is not importable yet.
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 os.pardir))
+
+from models import symbol_model
+
+
+SYMBOLS_FILE = os.environ.get(
+    'SYMBOLS_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'symbols.txt'))
+
+_INDEX_SUFFIX = '.idx'
+_MAGIC = b'SYMIDX1\0'
+# magic, symbols file mtime (ns), symbols file size, number of names.
+_HEADER = struct.Struct('<8sqqI4x')
+_OFFSET = struct.Struct('<I')
+# An offset and the next one: where a name starts and ends.
+_OFFSET_PAIR = struct.Struct('<II')
+
+
+def _parse_full_name(full_name: str) -> symbol_model.Symbol:
+    type_name, _, name = full_name.partition('.')
+    if not name or type_name not in symbol_model.SymbolType.__members__:
+        raise ValueError(f'Invalid symbol full name: {full_name!r}')
+    return symbol_model.Symbol(symbol_type=symbol_model.SymbolType[type_name],
+                               name=sys.intern(name))
+
+
+def read_symbols_file(path: str) -> List[str]:
+    """Returns the full names of a symbols file, validated and sorted."""
+    full_names = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            full_name = line.split('#', 1)[0].strip()
+            if not full_name:
+                continue
+            try:
+                _parse_full_name(full_name)
+            except ValueError as e:
+                raise ValueError(f'{path}:{line_number}: {e}') from None
+            full_names.add(full_name)
+    return sorted(full_names, key=lambda full_name: full_name.encode())
+
+
+def compile_index(path: str) -> bytes:
+    """Returns the index of the symbols file at `path`."""
+    stat = os.stat(path)
+    encoded = [full_name.encode() for full_name in read_symbols_file(path)]
+    offsets = [0]
+    for name in encoded:
+        offsets.append(offsets[-1] + len(name))
+    return b''.join([
+        _HEADER.pack(_MAGIC, stat.st_mtime_ns, stat.st_size, len(encoded)),
+        struct.pack(f'<{len(offsets)}I', *offsets),
+        *encoded,
+    ])
+
+
+def _is_fresh(index_path: str, path: str) -> bool:
+    try:
+        with open(index_path, 'rb') as f:
+            header = f.read(_HEADER.size)
+    except OSError:
+        return False
+    if len(header) != _HEADER.size:
+        return False
+    magic, mtime_ns, size, _ = _HEADER.unpack(header)
+    stat = os.stat(path)
+    return (magic == _MAGIC and mtime_ns == stat.st_mtime_ns and
+            size == stat.st_size)
+
+
+def _write_atomically(path: str, data: bytes) -> None:
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                     prefix='.symbols_index_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class SymbolRegistry:
+    """The symbols of a symbols file, plus those registered at run time."""
+
+    def __init__(self, path: str = SYMBOLS_FILE):
+        self.path = path
+        self._interned: Dict[str, symbol_model.Symbol] = {}
+        self._registered: Dict[str, symbol_model.Symbol] = {}
+        self._lock = threading.Lock()
+        self._index: Optional[Union[mmap.mmap, bytes]] = None
+        self._count = 0
+        self._names_start = 0
+
+    def _open(self) -> None:
+        with self._lock:
+            if self._index is not None:
+                return
+            index_path = self.path + _INDEX_SUFFIX
+            index: Union[mmap.mmap, bytes, None] = None
+            if not _is_fresh(index_path, self.path):
+                data = compile_index(self.path)
+                try:
+                    _write_atomically(index_path, data)
+                except OSError:
+                    # E.g. a read-only checkout: use the index from memory.
+                    index = data
+            if index is None:
+                with open(index_path, 'rb') as f:
+                    index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _, _, _, self._count = _HEADER.unpack_from(index, 0)
+            self._names_start = (_HEADER.size +
+                                 _OFFSET.size * (self._count + 1))
+            self._index = index
+
+    def _name_at(self, position: int) -> bytes:
+        start, end = _OFFSET_PAIR.unpack_from(
+            self._index, _HEADER.size + _OFFSET.size * position)
+        return self._index[self._names_start + start:
+                           self._names_start + end]
+
+    def _in_index(self, full_name: str) -> bool:
+        if self._index is None:
+            self._open()
+        key = full_name.encode()
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            name = self._name_at(middle)
+            if name < key:
+                low = middle + 1
+            elif name > key:
+                high = middle
+            else:
+                return True
+        return False
+
+    def get(self, full_name: str) -> symbol_model.Symbol:
+        """Returns the interned symbol; raises KeyError if unknown."""
+        symbol = self._interned.get(full_name)
+        if symbol is None:
+            if not self._in_index(full_name):
+                raise KeyError(full_name)
+            symbol = self._interned.setdefault(full_name,
+                                               _parse_full_name(full_name))
+        return symbol
+
+    def __contains__(self, full_name: str) -> bool:
+        return full_name in self._interned or self._in_index(full_name)
+
+    def register(
+        self, symbols: Iterable[Union[symbol_model.Symbol, str]]
+    ) -> List[symbol_model.Symbol]:
+        """Makes symbols known to this process; returns them, interned."""
+        registered = []
+        for symbol in symbols:
+            if isinstance(symbol, str):
+                symbol = _parse_full_name(symbol)
+            symbol = self._interned.setdefault(symbol.full_name, symbol)
+            self._registered[symbol.full_name] = symbol
+            registered.append(symbol)
+        return registered
+
+    def __iter__(self) -> Iterator[symbol_model.Symbol]:
+        """Yields every symbol, in full name order."""
+        if self._index is None:
+            self._open()
+        full_names = {self._name_at(i).decode() for i in range(self._count)}
+        full_names.update(self._registered)
+        for full_name in sorted(full_names):
+            yield self.get(full_name)
+
+    def __len__(self) -> int:
+        if self._index is None:
+            self._open()
+        return self._count + sum(1 for full_name in self._registered
+                                 if not self._in_index(full_name))
+
+
+def add_to_file(path: str, full_names: Iterable[str]) -> int:
+    """Appends the new symbols to a symbols file; returns how many."""
+    known = set(read_symbols_file(path)) if os.path.exists(path) else set()
+    added = []
+    for full_name in full_names:
+        full_name = full_name.strip()
+        if full_name and full_name not in known:
+            _parse_full_name(full_name)
+            known.add(full_name)
+            added.append(full_name)
+    if added:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.writelines(f'{full_name}\n' for full_name in added)
+    return len(added)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--symbols_file', default=SYMBOLS_FILE,
+                        help='The symbols file, default $SYMBOLS_FILE or '
+                             'models/symbols.txt.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_parser = subparsers.add_parser(
+        'add', help='Add symbols to the symbols file.')
+    add_parser.add_argument('full_names', nargs='*',
+                            help='Full names, like US_STOCK.MSFT.')
+    add_parser.add_argument('--from_file', default=None,
+                            help='A file of full names, one per line.')
+    subparsers.add_parser('compile', help='Rebuild the index file.')
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        full_names = list(args.full_names)
+        if args.from_file is not None:
+            with open(args.from_file, 'r', encoding='utf-8') as f:
+                full_names.extend(line.split('#', 1)[0] for line in f)
+        print(f'Added {add_to_file(args.symbols_file, full_names)} symbols.')
+    _write_atomically(args.symbols_file + _INDEX_SUFFIX,
+                      compile_index(args.symbols_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Alerts on portfolio totals crossing levels, driven by price ticks.
+
+A tick is `(symbol, price)`, the price being in the symbol's default quote
+symbol (the target symbol of its assets). Each portfolio total per target
+symbol is kept up to date incrementally: a tick only adds
+`quantity * (new price - old price)` to the totals holding the symbol.
+
+Alert levels are kept sorted per (portfolio, target symbol) and direction,
+so a tick finds the crossed ones with two binary searches. An "above" alert
+fires each time the total rises from below its level to at or above it, a
+"below" alert each time the total falls from above its level to at or below
+it; totals stay on one side of a level without firing again.
+
+Alerts are read from YAML:
+
+    Alerts:
+      - portfolio: FTX Exchange
+        symbol: FIAT.USD
+        above: 100000
+      - portfolio: FTX Exchange
+        symbol: FIAT.USD
+        below: 50000
+
+Ticks are read as CSV lines "time,symbol,price", from a file or stdin:
+    python price_alerts.py -p portfolios.yaml --alerts alerts.yaml \\
+        --ticks ticks.csv
+"""
+import argparse
+import bisect
+import csv
+import dataclasses
+import decimal
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import yaml
+
+from common import http_cassette
+import converter
+from models import portfolio_model
+from models import symbol_model
+import quote_providers
+
+
+ABOVE = 'above'
+BELOW = 'below'
+
+# (portfolio name, target symbol)
+Position = Tuple[str, symbol_model.Symbol]
+
+
+@dataclasses.dataclass(frozen=True)
+class Alert:
+    portfolio: str
+    symbol: symbol_model.Symbol  # The target symbol of the total.
+    direction: str  # ABOVE or BELOW.
+    level: decimal.Decimal
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Alert':
+        directions = [d for d in (ABOVE, BELOW) if d in data]
+        if len(directions) != 1:
+            raise ValueError(f'An alert needs one of "{ABOVE}" or "{BELOW}": '
+                             f'{data}')
+        direction = directions[0]
+        return cls(portfolio=data['portfolio'],
+                   symbol=symbol_model.get_symbol_from_full_name(
+                       data['symbol']),
+                   direction=direction,
+                   level=decimal.Decimal(str(data[direction])))
+
+
+@dataclasses.dataclass
+class Trigger:
+    alert: Alert
+    total: decimal.Decimal
+    tick_symbol: symbol_model.Symbol
+
+
+class _TriggerBook:
+    """The alerts of one position and direction, sorted by level."""
+
+    def __init__(self):
+        self.levels: List[decimal.Decimal] = []
+        self.alerts: List[Alert] = []
+
+    def add(self, alert: Alert) -> None:
+        index = bisect.bisect_right(self.levels, alert.level)
+        self.levels.insert(index, alert.level)
+        self.alerts.insert(index, alert)
+
+    def remove(self, alert: Alert) -> None:
+        first = bisect.bisect_left(self.levels, alert.level)
+        last = bisect.bisect_right(self.levels, alert.level)
+        index = self.alerts.index(alert, first, last)
+        del self.levels[index]
+        del self.alerts[index]
+
+    def crossed_up(self, old: decimal.Decimal,
+                   new: decimal.Decimal) -> List[Alert]:
+        """The alerts with old < level <= new."""
+        return self.alerts[bisect.bisect_right(self.levels, old):
+                           bisect.bisect_right(self.levels, new)]
+
+    def crossed_down(self, old: decimal.Decimal,
+                     new: decimal.Decimal) -> List[Alert]:
+        """The alerts with new <= level < old."""
+        return self.alerts[bisect.bisect_left(self.levels, new):
+                           bisect.bisect_left(self.levels, old)]
+
+
+class _PositionState:
+
+    def __init__(self, unpriced: int):
+        self.total = decimal.Decimal(0)
+        # Symbols without a price yet; the total is partial until it is 0.
+        self.unpriced = unpriced
+        self.above = _TriggerBook()
+        self.below = _TriggerBook()
+
+
+class AlertEngine:
+    """Keeps portfolio totals up to date from ticks and fires alerts."""
+
+    def __init__(self, portfolios: Iterable[portfolio_model.Portfolio]):
+        # Per symbol, the positions holding it and their summed quantities.
+        self._exposures: Dict[
+            symbol_model.Symbol,
+            List[Tuple[_PositionState, decimal.Decimal]]] = {}
+        self._positions: Dict[Position, _PositionState] = {}
+        self._prices: Dict[symbol_model.Symbol, decimal.Decimal] = {}
+
+        quantities: Dict[Position, Dict[symbol_model.Symbol,
+                                        decimal.Decimal]] = {}
+        for portfolio in portfolios:
+            for asset in portfolio.assets:
+                per_symbol = quantities.setdefault(
+                    (portfolio.name, asset.target_symbol), {})
+                per_symbol[asset.symbol] = (
+                    per_symbol.get(asset.symbol, decimal.Decimal(0)) +
+                    decimal.Decimal(asset.quantity))
+        for (name, target), per_symbol in quantities.items():
+            state = _PositionState(
+                unpriced=sum(symbol != target for symbol in per_symbol))
+            self._positions[(name, target)] = state
+            for symbol, quantity in per_symbol.items():
+                if symbol == target:
+                    state.total += quantity
+                else:
+                    self._exposures.setdefault(symbol, []).append(
+                        (state, quantity))
+
+    def add_alert(self, alert: Alert) -> None:
+        state = self._positions.get((alert.portfolio, alert.symbol))
+        if state is None:
+            raise KeyError(f'No {alert.symbol} total in portfolio '
+                           f'{alert.portfolio!r}.')
+        book = state.above if alert.direction == ABOVE else state.below
+        book.add(alert)
+
+    def remove_alert(self, alert: Alert) -> None:
+        state = self._positions[(alert.portfolio, alert.symbol)]
+        book = state.above if alert.direction == ABOVE else state.below
+        book.remove(alert)
+
+    def total(self, portfolio: str,
+              symbol: symbol_model.Symbol) -> Optional[decimal.Decimal]:
+        """The current total, or None until all its symbols are priced."""
+        state = self._positions[(portfolio, symbol)]
+        return state.total if state.unpriced == 0 else None
+
+    def on_tick(self, symbol: symbol_model.Symbol,
+                price: decimal.Decimal) -> List[Trigger]:
+        """Applies a new price and returns the alerts it fired.
+
+        A total does not fire alerts on the tick that completes its prices.
+        """
+        exposures = self._exposures.get(symbol)
+        if exposures is None:
+            return []
+        old_price = self._prices.get(symbol)
+        self._prices[symbol] = price
+        triggers = []
+        if old_price is None:
+            for state, quantity in exposures:
+                state.total += quantity * price
+                state.unpriced -= 1
+            return triggers
+
+        change = price - old_price
+        if not change:
+            return triggers
+        for state, quantity in exposures:
+            old_total = state.total
+            state.total = new_total = old_total + quantity * change
+            if state.unpriced:
+                continue
+            if new_total > old_total:
+                crossed = state.above.crossed_up(old_total, new_total)
+            else:
+                crossed = state.below.crossed_down(old_total, new_total)
+            for alert in crossed:
+                triggers.append(Trigger(alert=alert, total=new_total,
+                                        tick_symbol=symbol))
+        return triggers
+
+    def prime(self, rates: portfolio_model.RATES_TYPE_ALIAS) -> None:
+        """Sets the prices of a rates dict, e.g. from `converter.get_rates`.
+
+        Only rates to the default quote symbols apply; no alert fires.
+        """
+        for (from_symbol, to_symbol), rate in rates.items():
+            if from_symbol == to_symbol or to_symbol != (
+                    symbol_model.SYMBOL_TYPES_DEFAULT_QUOTE_SYMBOL[
+                        from_symbol.symbol_type]):
+                continue
+            exposures = self._exposures.get(from_symbol, ())
+            old_price = self._prices.get(from_symbol)
+            self._prices[from_symbol] = rate
+            for state, quantity in exposures:
+                if old_price is None:
+                    state.unpriced -= 1
+                    state.total += quantity * rate
+                else:
+                    state.total += quantity * (rate - old_price)
+
+    def required_conversions(self) -> List[converter.Conversion]:
+        return [
+            converter.Conversion(
+                from_symbol=symbol,
+                to_symbol=symbol_model.SYMBOL_TYPES_DEFAULT_QUOTE_SYMBOL[
+                    symbol.symbol_type])
+            for symbol in self._exposures]
+
+
+def load_alerts(path: str) -> List[Alert]:
+    data = yaml.safe_load(open(path, 'r'))
+    return [Alert.from_dict(alert_data) for alert_data in data['Alerts']]
+
+
+def read_ticks(
+    lines: Iterable[str]
+) -> Iterator[Tuple[str, symbol_model.Symbol, decimal.Decimal]]:
+    """Parses "time,symbol,price" CSV lines; a header line is skipped."""
+    for row in csv.reader(lines):
+        if not row or row[0] == 'time':
+            continue
+        time_text, full_name, price = row
+        yield (time_text, symbol_model.get_symbol_from_full_name(full_name),
+               decimal.Decimal(price))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-p', '--portfolio_yaml', required=True,
+                        help='Path to YAML file that stores portfolio data.')
+    parser.add_argument('--alerts', required=True,
+                        help='Path to YAML file of the alerts.')
+    parser.add_argument('--ticks', default='-',
+                        help='CSV file of "time,symbol,price" ticks, or - for '
+                             'stdin (default).')
+    parser.add_argument('--fetch_rates', action='store_true',
+                        help='Start from the current rates instead of the '
+                             'first tick of each symbol.')
+    quote_providers.add_quote_arguments(parser)
+    http_cassette.add_cassette_arguments(parser)
+    args = parser.parse_args()
+
+    data = yaml.safe_load(open(args.portfolio_yaml, 'r'))
+    engine = AlertEngine(portfolio_model.Portfolio.from_dict(portfolio_data)
+                         for portfolio_data in data['Portfolios'])
+    for alert in load_alerts(args.alerts):
+        engine.add_alert(alert)
+    if args.fetch_rates:
+        with http_cassette.cassette_from_args(args):
+            engine.prime(converter.get_rates(
+                engine.required_conversions(),
+                quote_providers=quote_providers.providers_from_args(args)))
+
+    ticks_file = (sys.stdin if args.ticks == '-'
+                  else open(args.ticks, newline=''))
+    with ticks_file:
+        for time_text, symbol, price in read_ticks(ticks_file):
+            for trigger in engine.on_tick(symbol, price):
+                alert = trigger.alert
+                print(f'{time_text}\t{alert.portfolio}\t{alert.symbol} '
+                      f'{alert.direction} {alert.level}: {trigger.total} '
+                      f'(tick {symbol} {price})', flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Local store of historical prices, to value portfolios in the past.
+
+Each (from symbol, to symbol) pair has one file in the store directory:
+
+    <from full name>_<to full name>.prices
+
+holding a small header, then all close times (int64 unix seconds, sorted)
+and then all close prices (float64). Both columns are memory-mapped, so
+looking prices up at many timestamps is one binary search pass
+(`numpy.searchsorted`) over the time column.
+
+Fill the store from exchange candles, then value portfolios over time:
+    python price_history.py fill -p portfolios.yaml -s store \\
+        --since 2021-01-01 --resolution 3600
+    python price_history.py valuate -p portfolios.yaml -s store \\
+        --since 2021-01-01 --every 86400
+"""
+import argparse
+import datetime
+import os
+import struct
+import time
+from typing import Iterable
+
+import numpy as np
+import yaml
+
+import converter
+from models import symbol_model
+
+
+_MAGIC = b'PRH1'
+_HEADER = struct.Struct('<4s4xq')  # Magic, padding, number of prices.
+_DEFAULT_RESOLUTION_SECONDS = 3600
+
+
+class PriceSeries:
+    """The close prices of one pair, sorted by close time."""
+
+    def __init__(self, times: np.ndarray, prices: np.ndarray):
+        self.times = times
+        self.prices = prices
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def prices_at(self, timestamps: np.ndarray) -> np.ndarray:
+        """Returns the last known price at each timestamp.
+
+        Timestamps before the first stored price get NaN.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if not len(self.times):
+            return np.full(timestamps.shape, np.nan)
+        indexes = np.searchsorted(self.times, timestamps, side='right') - 1
+        prices = self.prices[np.maximum(indexes, 0)]
+        return np.where(indexes >= 0, prices, np.nan)
+
+
+_EMPTY_SERIES = PriceSeries(np.empty(0, dtype=np.int64),
+                            np.empty(0, dtype=np.float64))
+
+
+class PriceHistoryStore:
+    """The price files of a directory, created on first write."""
+
+    def __init__(self, root: str):
+        self._root = root
+
+    def _path(self, from_symbol: symbol_model.Symbol,
+              to_symbol: symbol_model.Symbol) -> str:
+        return os.path.join(
+            self._root, f'{from_symbol.full_name}_{to_symbol.full_name}.prices')
+
+    def load(self, from_symbol: symbol_model.Symbol,
+             to_symbol: symbol_model.Symbol) -> PriceSeries:
+        """Memory-maps the prices of the pair (empty if none are stored)."""
+        path = self._path(from_symbol, to_symbol)
+        if not os.path.exists(path):
+            return _EMPTY_SERIES
+        with open(path, 'rb') as f:
+            magic, count = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC:
+            raise ValueError(f'Not a price history file: {path}')
+        if count == 0:
+            return _EMPTY_SERIES
+        times = np.memmap(path, dtype='<i8', mode='r', offset=_HEADER.size,
+                          shape=(count,))
+        prices = np.memmap(path, dtype='<f8', mode='r',
+                           offset=_HEADER.size + 8 * count, shape=(count,))
+        return PriceSeries(times, prices)
+
+    def merge(self, from_symbol: symbol_model.Symbol,
+              to_symbol: symbol_model.Symbol,
+              candles: converter.CANDLES_TYPE_ALIAS) -> int:
+        """Adds prices to the pair; returns the number of stored prices.
+
+        A new price replaces the stored one with the same time.
+        """
+        if not candles:
+            return len(self.load(from_symbol, to_symbol))
+        old = self.load(from_symbol, to_symbol)
+        new_times = np.fromiter((t for t, _ in candles), dtype=np.int64,
+                                count=len(candles))
+        new_prices = np.fromiter((float(p) for _, p in candles),
+                                 dtype=np.float64, count=len(candles))
+        # New prices first, so that np.unique keeps them on equal times.
+        times = np.concatenate((new_times, old.times))
+        prices = np.concatenate((new_prices, old.prices))
+        times, first_indexes = np.unique(times, return_index=True)
+        prices = prices[first_indexes]
+
+        os.makedirs(self._root, exist_ok=True)
+        path = self._path(from_symbol, to_symbol)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(times)))
+            f.write(times.astype('<i8').tobytes())
+            f.write(prices.astype('<f8').tobytes())
+        os.replace(tmp_path, path)
+        return len(times)
+
+    def fill(self, conversion: converter.Conversion, start: int, end: int,
+             resolution: int = _DEFAULT_RESOLUTION_SECONDS) -> int:
+        """Fetches the candles of [start, end) not stored yet.
+
+        Returns the number of stored prices of the pair.
+        """
+        stored = self.load(conversion.from_symbol, conversion.to_symbol)
+        ranges = [(start, end)]
+        if len(stored):
+            # Prices are stamped with close times, candles by open times.
+            first_open = int(stored.times[0]) - resolution
+            last_open = int(stored.times[-1]) - resolution
+            ranges = [(start, min(end, first_open)),
+                      (max(start, last_open + resolution), end)]
+        candles: converter.CANDLES_TYPE_ALIAS = []
+        for range_start, range_end in ranges:
+            if range_start < range_end:
+                candles.extend(conversion.get_candles(
+                    start=range_start, end=range_end, resolution=resolution))
+        return self.merge(conversion.from_symbol, conversion.to_symbol,
+                          candles)
+
+
+def _parse_time(text: str) -> int:
+    try:
+        return int(float(text))
+    except ValueError:
+        parsed = datetime.datetime.fromisoformat(text)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+        return int(parsed.timestamp())
+
+
+def _format_time(timestamp: int) -> str:
+    return datetime.datetime.fromtimestamp(
+        timestamp, datetime.timezone.utc).isoformat()
+
+
+def _required_conversions(portfolios) -> Iterable[converter.Conversion]:
+    conversions = set()
+    for portfolio in portfolios:
+        conversions |= portfolio.get_required_conversions()
+    return sorted(conversions, key=repr)
+
+
+def main():
+    # Imported here, since portfolio_model imports this module.
+    from models import portfolio_model
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('fill', 'valuate'))
+    parser.add_argument('-p', '--portfolio_yaml', required=True,
+                        help='Path to YAML file that stores portfolio data.')
+    parser.add_argument('-s', '--store', required=True,
+                        help='The price history directory.')
+    parser.add_argument('--since', type=_parse_time, required=True,
+                        help='Start time (unix seconds or ISO 8601, UTC).')
+    parser.add_argument('--until', type=_parse_time, default=None,
+                        help='End time, excluded (default now).')
+    parser.add_argument('--resolution', type=int,
+                        default=_DEFAULT_RESOLUTION_SECONDS,
+                        help='Candle length in seconds, for fill.')
+    parser.add_argument('--every', type=int, default=86400,
+                        help='Seconds between two valuations, for valuate.')
+    args = parser.parse_args()
+    until = args.until if args.until is not None else int(time.time())
+
+    data = yaml.safe_load(open(args.portfolio_yaml, 'r'))
+    portfolios = [portfolio_model.Portfolio.from_dict(portfolio_data)
+                  for portfolio_data in data['Portfolios']]
+    store = PriceHistoryStore(args.store)
+
+    if args.command == 'fill':
+        for cv in _required_conversions(portfolios):
+            if cv.from_symbol == cv.to_symbol:
+                continue
+            try:
+                count = store.fill(cv, args.since, until, args.resolution)
+            except LookupError as e:
+                print(f'{cv}: skipped ({e})')
+                continue
+            except Exception as e:
+                print(f'{cv}: failed ({e!r})')
+                continue
+            print(f'{cv}: {count} prices')
+        return
+
+    timestamps = np.arange(args.since, until, args.every, dtype=np.int64)
+    for portfolio in portfolios:
+        print(f'\n========== {portfolio.name} ==========')
+        totals = portfolio.valuate_at(timestamps, store)
+        symbols = list(totals)
+        print('time\t' + '\t'.join(str(symbol) for symbol in symbols))
+        for index, timestamp in enumerate(timestamps):
+            print(_format_time(int(timestamp)) + '\t' + '\t'.join(
+                f'{totals[symbol][index]:.2f}' for symbol in symbols))
+
+
+if __name__ == '__main__':
+    main()
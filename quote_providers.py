@@ -0,0 +1,131 @@
+"""Batched quote providers for the non-crypto symbols, e.g. stocks and FIAT.
+
+A provider gets the rates of many conversions at once, and may return only
+some of them. `converter.get_rates` asks each provider in turn for what is
+still missing, with one call per asset class, so resolving every stock quote
+and FX rate of a run costs one request per asset class.
+
+Rates are keyed like the --rates_yaml files of scenario.py, as
+"<from full name>/<to full name>", e.g. "US_STOCK.AAPL/FIAT.USD":
+
+- HttpQuoteProvider sends GET <base URL>/quotes?pairs=<pair>,<pair>,... and
+  expects {"quotes": {<pair>: <rate>, ...}}, without the unknown pairs. The
+  base URL defaults to the QUOTES_API_BASE_URL environment variable, e.g. a
+  local fake exchange.
+- FileQuoteProvider reads a YAML (or JSON) file of {<pair>: <rate>, ...}.
+"""
+import abc
+import argparse
+import decimal
+import http
+import os
+from typing import Dict, List, Optional, Sequence
+
+import converter
+from models import portfolio_model
+from models import symbol_model
+
+
+_QUOTES_API_BASE_URL = os.environ.get('QUOTES_API_BASE_URL')
+_QUOTES_API_TIMEOUT_SECONDS = 3.0
+
+
+def pair_name(from_symbol: symbol_model.Symbol,
+              to_symbol: symbol_model.Symbol) -> str:
+    return f'{from_symbol.full_name}/{to_symbol.full_name}'
+
+
+class QuoteProvider(abc.ABC):
+    """Gets the rates of many conversions at once."""
+
+    name = 'quotes'
+
+    @abc.abstractmethod
+    def get_rates(
+        self, conversions: Sequence[converter.Conversion]
+    ) -> portfolio_model.RATES_TYPE_ALIAS:
+        """Returns the rates found, keyed by (from, to) symbols."""
+
+
+class HttpQuoteProvider(QuoteProvider):
+    """Gets the rates from a quotes endpoint, in one request."""
+
+    name = 'quotes.http'
+
+    def __init__(self, base_url: str,
+                 timeout: float = _QUOTES_API_TIMEOUT_SECONDS):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def get_rates(
+        self, conversions: Sequence[converter.Conversion]
+    ) -> portfolio_model.RATES_TYPE_ALIAS:
+        import requests
+
+        pairs = {pair_name(cv.from_symbol, cv.to_symbol): cv
+                 for cv in conversions}
+        try:
+            response = requests.get(f'{self.base_url}/quotes',
+                                    params={'pairs': ','.join(pairs)},
+                                    timeout=self.timeout)
+        except requests.exceptions.Timeout:
+            raise RuntimeError('Quotes API timed out.')
+        if response.status_code != http.HTTPStatus.OK:
+            raise RuntimeError(f'API failed, status = {response.status_code}')
+        rates = {}
+        for pair, rate in response.json()['quotes'].items():
+            cv = pairs.get(pair)
+            if cv is not None:
+                rates[(cv.from_symbol, cv.to_symbol)] = decimal.Decimal(
+                    str(rate))
+        return rates
+
+
+class FileQuoteProvider(QuoteProvider):
+    """Gets the rates from a local quotes file, read once."""
+
+    name = 'quotes.file'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._rates: Optional[Dict[str, decimal.Decimal]] = None
+
+    def get_rates(
+        self, conversions: Sequence[converter.Conversion]
+    ) -> portfolio_model.RATES_TYPE_ALIAS:
+        if self._rates is None:
+            import yaml
+
+            with open(self.path, 'r') as f:
+                data = yaml.safe_load(f) or {}
+            self._rates = {pair: decimal.Decimal(str(rate))
+                           for pair, rate in data.items()}
+        rates = {}
+        for cv in conversions:
+            rate = self._rates.get(pair_name(cv.from_symbol, cv.to_symbol))
+            if rate is not None:
+                rates[(cv.from_symbol, cv.to_symbol)] = rate
+        return rates
+
+
+def add_quote_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the command-line flags used by `providers_from_args`."""
+    parser.add_argument('--quotes_url',
+                        help=('Base URL of the quotes API for stocks and '
+                              'FIAT, default $QUOTES_API_BASE_URL.'),
+                        default=_QUOTES_API_BASE_URL)
+    parser.add_argument('--quotes_file',
+                        help=('YAML file of quotes, as {"US_STOCK.AAPL/'
+                              'FIAT.USD": 150, ...}, used for what the '
+                              'quotes API does not have.'),
+                        default=None)
+
+
+def providers_from_args(args: argparse.Namespace) -> List[QuoteProvider]:
+    """Returns the providers of the parsed flags, in the order to ask them."""
+    providers: List[QuoteProvider] = []
+    if args.quotes_url:
+        providers.append(HttpQuoteProvider(args.quotes_url))
+    if args.quotes_file is not None:
+        providers.append(FileQuoteProvider(args.quotes_file))
+    return providers
@@ -0,0 +1,295 @@
+"""Price-shock scenarios over all portfolios, vectorized with NumPy.
+
+A scenario moves symbol prices by relative shocks, e.g. BTC -30% and TWD
++5%. The rate of a conversion then becomes
+
+    rate * (1 + shock[from]) / (1 + shock[to])
+
+so the value of every (portfolio, target symbol) position, for every
+scenario, is one matrix product of the shocks with the positions x symbols
+exposure matrix, divided by the shock of the position's target symbol.
+
+Scenarios come from a CSV file (a "scenario" column, then one column of
+shocks per symbol full name), from --shock, or are drawn at random:
+    python scenario.py -p portfolios.yaml --shock CRYPTO.BTC=-0.3 \\
+        FIAT.TWD=0.05
+    python scenario.py -p portfolios.yaml --random 10000 --cross_check 50
+"""
+import argparse
+import csv
+import dataclasses
+import decimal
+import sys
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import yaml
+
+from common import http_cassette
+import converter
+from models import portfolio_model
+from models import symbol_model
+import quote_providers
+
+
+_DEFAULT_RANDOM_VOLATILITY = 0.2
+_DEFAULT_CROSS_CHECK_TOLERANCE = 1e-9
+# Decimal precision of the cross-check, higher than main.py's display one.
+_CROSS_CHECK_PRECISION = 28
+
+# (portfolio index, target symbol)
+Position = Tuple[int, symbol_model.Symbol]
+
+
+@dataclasses.dataclass
+class Exposure:
+    """What each position holds of each symbol, valued at current rates.
+
+    `values[i, j]` is the value, in the target symbol of position i, of the
+    assets of symbol j in that position. Columns include the target symbols,
+    whose shocks divide the position values.
+    """
+    positions: List[Position]
+    symbols: List[symbol_model.Symbol]
+    values: np.ndarray  # positions x symbols
+    target_indexes: np.ndarray  # The symbol column of each position target.
+
+    @classmethod
+    def from_portfolios(
+        cls,
+        portfolios: Sequence[portfolio_model.Portfolio],
+        rates: portfolio_model.RATES_TYPE_ALIAS,
+    ) -> 'Exposure':
+        position_indexes: Dict[Position, int] = {}
+        symbol_indexes: Dict[symbol_model.Symbol, int] = {}
+        entries: Dict[Tuple[int, int], decimal.Decimal] = {}
+        for portfolio_index, portfolio in enumerate(portfolios):
+            for asset in portfolio.assets:
+                position = (portfolio_index, asset.target_symbol)
+                row = position_indexes.setdefault(position,
+                                                  len(position_indexes))
+                symbol_indexes.setdefault(asset.target_symbol,
+                                          len(symbol_indexes))
+                column = symbol_indexes.setdefault(asset.symbol,
+                                                   len(symbol_indexes))
+                rate = rates[(asset.symbol, asset.target_symbol)]
+                entries[(row, column)] = (
+                    entries.get((row, column), decimal.Decimal(0)) +
+                    decimal.Decimal(asset.quantity) * rate)
+
+        values = np.zeros((len(position_indexes), len(symbol_indexes)))
+        for (row, column), value in entries.items():
+            values[row, column] = float(value)
+        positions = list(position_indexes)
+        return cls(
+            positions=positions,
+            symbols=list(symbol_indexes),
+            values=values,
+            target_indexes=np.array(
+                [symbol_indexes[target] for _, target in positions],
+                dtype=np.intp))
+
+    def shocks_matrix(
+        self,
+        scenarios: Sequence[Dict[symbol_model.Symbol, float]],
+    ) -> np.ndarray:
+        """Lays scenarios out as a scenarios x symbols matrix.
+
+        Symbols without a shock are unchanged; shocks of symbols held by no
+        portfolio are ignored.
+        """
+        column_of = {symbol: j for j, symbol in enumerate(self.symbols)}
+        shocks = np.zeros((len(scenarios), len(self.symbols)))
+        for i, scenario in enumerate(scenarios):
+            for symbol, shock in scenario.items():
+                j = column_of.get(symbol)
+                if j is not None:
+                    shocks[i, j] = shock
+        return shocks
+
+
+@dataclasses.dataclass
+class ScenarioResults:
+    position_values: np.ndarray  # scenarios x positions
+    target_symbols: List[symbol_model.Symbol]
+    totals: np.ndarray  # scenarios x target symbols, over all portfolios
+
+
+def run_scenarios(exposure: Exposure, shocks: np.ndarray) -> ScenarioResults:
+    """Values every position and the overall totals under every scenario."""
+    if np.any(shocks <= -1):
+        raise ValueError('Shocks must be greater than -1 (-100%).')
+    multipliers = 1.0 + shocks
+    position_values = multipliers @ exposure.values.T
+    position_values /= multipliers[:, exposure.target_indexes]
+
+    target_symbols = sorted({target for _, target in exposure.positions},
+                            key=lambda symbol: symbol.full_name)
+    target_column = {symbol: k for k, symbol in enumerate(target_symbols)}
+    # Positions x targets one-hot matrix, summing positions per target.
+    grouping = np.zeros((len(exposure.positions), len(target_symbols)))
+    for i, (_, target) in enumerate(exposure.positions):
+        grouping[i, target_column[target]] = 1.0
+    return ScenarioResults(position_values=position_values,
+                           target_symbols=target_symbols,
+                           totals=position_values @ grouping)
+
+
+def cross_check(portfolios: Sequence[portfolio_model.Portfolio],
+                rates: portfolio_model.RATES_TYPE_ALIAS,
+                exposure: Exposure,
+                shocks: np.ndarray,
+                results: ScenarioResults,
+                scenario_indexes: Sequence[int]) -> float:
+    """Recomputes scenarios with Decimals and `Portfolio.calculate_totals`.
+
+    Returns the largest relative difference with the vectorized results.
+    """
+    row_of = {position: i for i, position in enumerate(exposure.positions)}
+    max_error = 0.0
+    with decimal.localcontext() as context:
+        context.prec = _CROSS_CHECK_PRECISION
+        for scenario_index in scenario_indexes:
+            multiplier = {
+                symbol: 1 + decimal.Decimal(repr(float(shock)))
+                for symbol, shock in zip(exposure.symbols,
+                                         shocks[scenario_index])}
+            shocked_rates = {
+                (from_symbol, to_symbol):
+                    rate * multiplier.get(from_symbol, 1) /
+                    multiplier.get(to_symbol, 1)
+                for (from_symbol, to_symbol), rate in rates.items()}
+            for portfolio_index, portfolio in enumerate(portfolios):
+                for asset in portfolio.calculate_totals(shocked_rates):
+                    expected = float(asset.quantity)
+                    actual = results.position_values[
+                        scenario_index,
+                        row_of[(portfolio_index, asset.symbol)]]
+                    error = abs(actual - expected) / max(abs(expected), 1e-12)
+                    max_error = max(max_error, error)
+    return max_error
+
+
+def _parse_shock(text: str) -> Tuple[symbol_model.Symbol, float]:
+    full_name, _, shock = text.partition('=')
+    return symbol_model.get_symbol_from_full_name(full_name), float(shock)
+
+
+def _load_scenarios_csv(
+    path: str) -> Tuple[List[str], List[Dict[symbol_model.Symbol, float]]]:
+    names = []
+    scenarios = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            names.append(row.pop('scenario', None) or f'#{len(names)}')
+            scenarios.append({
+                symbol_model.get_symbol_from_full_name(full_name):
+                    float(shock)
+                for full_name, shock in row.items() if shock})
+    return names, scenarios
+
+
+def _load_rates_yaml(path: str) -> portfolio_model.RATES_TYPE_ALIAS:
+    """Loads {"CRYPTO.BTC/FIAT.USD": "45000", ...}."""
+    data = yaml.safe_load(open(path, 'r'))
+    rates = {}
+    for pair, rate in data.items():
+        from_name, _, to_name = pair.partition('/')
+        rates[(symbol_model.get_symbol_from_full_name(from_name),
+               symbol_model.get_symbol_from_full_name(to_name))] = (
+            decimal.Decimal(str(rate)))
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-p', '--portfolio_yaml', required=True,
+                        help='Path to YAML file that stores portfolio data.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--scenarios_csv',
+                        help='CSV of scenarios: a "scenario" name column and '
+                             'one column of shocks per symbol full name.')
+    source.add_argument('--shock', nargs='+', type=_parse_shock,
+                        help='One scenario, e.g. CRYPTO.BTC=-0.3.')
+    source.add_argument('--random', type=int,
+                        help='Number of random scenarios (normal shocks).')
+    parser.add_argument('--volatility', type=float,
+                        default=_DEFAULT_RANDOM_VOLATILITY,
+                        help='Standard deviation of random shocks.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of random scenarios.')
+    parser.add_argument('--rates_yaml', default=None,
+                        help='Rates to use instead of fetching them, as '
+                             '{"CRYPTO.BTC/FIAT.USD": 45000, ...}.')
+    parser.add_argument('--per_portfolio', action='store_true',
+                        help='Also output the totals of each portfolio.')
+    parser.add_argument('--cross_check', type=int, default=0,
+                        help='Recompute this many scenarios with Decimals '
+                             '(-1 for all) and report the largest error.')
+    parser.add_argument('--tolerance', type=float,
+                        default=_DEFAULT_CROSS_CHECK_TOLERANCE,
+                        help='Largest relative error of the cross-check.')
+    quote_providers.add_quote_arguments(parser)
+    http_cassette.add_cassette_arguments(parser)
+    args = parser.parse_args()
+
+    with http_cassette.cassette_from_args(args):
+        _run(args)
+
+
+def _run(args: argparse.Namespace):
+    data = yaml.safe_load(open(args.portfolio_yaml, 'r'))
+    portfolios = [portfolio_model.Portfolio.from_dict(portfolio_data)
+                  for portfolio_data in data['Portfolios']]
+    if args.rates_yaml is not None:
+        rates = _load_rates_yaml(args.rates_yaml)
+    else:
+        required_conversions = set()
+        for portfolio in portfolios:
+            required_conversions |= portfolio.get_required_conversions()
+        rates = converter.get_rates(
+            required_conversions,
+            quote_providers=quote_providers.providers_from_args(args))
+
+    exposure = Exposure.from_portfolios(portfolios, rates)
+    if args.scenarios_csv is not None:
+        names, scenarios = _load_scenarios_csv(args.scenarios_csv)
+        shocks = exposure.shocks_matrix(scenarios)
+    elif args.shock is not None:
+        names = ['shock']
+        shocks = exposure.shocks_matrix([dict(args.shock)])
+    else:
+        names = [f'#{i}' for i in range(args.random)]
+        rng = np.random.default_rng(args.seed)
+        shocks = np.clip(
+            rng.normal(0, args.volatility,
+                       (args.random, len(exposure.symbols))),
+            -0.99, None)
+    results = run_scenarios(exposure, shocks)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(('scenario', 'portfolio', 'symbol', 'value'))
+    for i, name in enumerate(names):
+        if args.per_portfolio:
+            for j, (portfolio_index, target) in enumerate(exposure.positions):
+                writer.writerow((
+                    name, portfolios[portfolio_index].name, target,
+                    f'{results.position_values[i, j]:.6f}'))
+        for k, target in enumerate(results.target_symbols):
+            writer.writerow((name, '', target, f'{results.totals[i, k]:.6f}'))
+
+    if args.cross_check:
+        count = (len(names) if args.cross_check < 0
+                 else min(args.cross_check, len(names)))
+        max_error = cross_check(portfolios, rates, exposure, shocks, results,
+                                range(count))
+        print(f'Cross-check of {count} scenarios: largest relative error '
+              f'{max_error:.3g}', file=sys.stderr)
+        if max_error > args.tolerance:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
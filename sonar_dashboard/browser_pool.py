@@ -0,0 +1,224 @@
+"""A pool of warm headless Chrome drivers for scraping many addresses.
+
+Starting Chrome dominates the run time of a single scrape, so the pool starts
+its drivers once and reuses them. Each driver is health-checked before it is
+handed out and recycled (quit and restarted) after a number of pages or after
+any error. Memory per browser is bounded by capping the V8 heap, keeping a
+single renderer process and going back to about:blank after every page.
+"""
+import concurrent.futures
+import contextlib
+import logging
+import os
+import queue
+import threading
+from typing import (Callable, Dict, Iterator, List, Optional, Sequence, Set,
+                    TYPE_CHECKING, Union)
+
+import sonar_dashboard
+
+if TYPE_CHECKING:
+    from selenium import webdriver
+
+
+_DEFAULT_MAX_PAGES_PER_DRIVER = 20
+_DEFAULT_JS_HEAP_MB = 512
+
+logger = logging.getLogger(__name__)
+
+
+def new_chrome_driver(
+    headless: bool = True,
+    js_heap_mb: int = _DEFAULT_JS_HEAP_MB,
+) -> 'webdriver.chrome.webdriver.WebDriver':
+    """Starts a Chrome driver with bounded memory usage."""
+    from selenium import webdriver
+
+    options = webdriver.ChromeOptions()
+    options.headless = headless
+    options.add_argument(f'--js-flags=--max-old-space-size={js_heap_mb}')
+    options.add_argument('--renderer-process-limit=1')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--disable-extensions')
+    options.add_argument('--disable-gpu')
+    return webdriver.Chrome(options=options)
+
+
+class _PooledDriver:
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.num_pages = 0
+
+
+class BrowserPool:
+    """A fixed-size pool of reusable web drivers.
+
+    Usage:
+        with BrowserPool(size=4) as pool:
+            with pool.acquire() as driver:
+                ...
+    """
+
+    def __init__(self,
+                 size: int,
+                 headless: bool = True,
+                 max_pages_per_driver: int = _DEFAULT_MAX_PAGES_PER_DRIVER,
+                 js_heap_mb: int = _DEFAULT_JS_HEAP_MB,
+                 driver_factory: Optional[Callable[[], object]] = None):
+        if size < 1:
+            raise ValueError('The pool needs at least one driver.')
+        self.size = size
+        self._max_pages_per_driver = max_pages_per_driver
+        self._driver_factory = driver_factory or (
+            lambda: new_chrome_driver(headless=headless,
+                                      js_heap_mb=js_heap_mb))
+        self._idle: 'queue.Queue[_PooledDriver]' = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._lent: Set[_PooledDriver] = set()
+        # Start all drivers concurrently, startup is the slow part.
+        with concurrent.futures.ThreadPoolExecutor(size) as executor:
+            futures = [executor.submit(self._driver_factory)
+                       for _ in range(size)]
+        drivers = []
+        errors = []
+        for future in futures:
+            try:
+                drivers.append(future.result())
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            # No pool to close them later: quit the ones that started.
+            for driver in drivers:
+                _quit_quietly(driver)
+            raise errors[0]
+        for driver in drivers:
+            self._idle.put(_PooledDriver(driver))
+
+    def __enter__(self) -> 'BrowserPool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @contextlib.contextmanager
+    def acquire(self) -> Iterator[object]:
+        """Lends a healthy driver; blocks until one is available.
+
+        The driver is recycled if the block raises, since its state is then
+        unknown. If the pool was closed meanwhile, it is quit when returned.
+        """
+        if self._closed:
+            raise RuntimeError('The browser pool is closed.')
+        pooled = self._idle.get()
+        with self._lock:
+            self._lent.add(pooled)
+        try:
+            if not self._is_healthy(pooled.driver):
+                logger.warning('Recycling an unresponsive web driver.')
+                pooled = self._replace(pooled)
+            yield pooled.driver
+        except BaseException:
+            pooled = self._replace(pooled)
+            raise
+        else:
+            pooled.num_pages += 1
+            if pooled.num_pages >= self._max_pages_per_driver:
+                pooled = self._replace(pooled)
+            else:
+                self._release_page(pooled)
+        finally:
+            with self._lock:
+                self._lent.discard(pooled)
+                if not self._closed:
+                    self._idle.put(pooled)
+                    pooled = None
+            if pooled is not None:
+                _quit_quietly(pooled.driver)
+
+    def close(self) -> None:
+        """Quits every idle driver; lent ones are quit when returned."""
+        with self._lock:
+            self._closed = True
+            if self._lent:
+                logger.info('%d web drivers still lent out; quitting them '
+                            'when returned.', len(self._lent))
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            _quit_quietly(pooled.driver)
+
+    @staticmethod
+    def _is_healthy(driver) -> bool:
+        try:
+            return driver.execute_script('return 1;') == 1
+        except Exception:
+            return False
+
+    def _release_page(self, pooled: _PooledDriver) -> None:
+        # Drop the page (and its JS heap) right away instead of on next use.
+        try:
+            pooled.driver.get('about:blank')
+        except Exception:
+            pass
+
+    def _replace(self, pooled: _PooledDriver) -> _PooledDriver:
+        _quit_quietly(pooled.driver)
+        if self._closed:
+            return pooled
+        return _PooledDriver(self._driver_factory())
+
+
+def _quit_quietly(driver) -> None:
+    try:
+        driver.quit()
+    except Exception:
+        logger.debug('Failed to quit a web driver.', exc_info=True)
+
+
+def scrape_addresses(
+    pool: BrowserPool,
+    solana_addresses: Sequence[str],
+    wait_for_loading: float,
+    section_titles: Optional[Sequence[str]] = None,
+    load_times_path: Optional[str] = None,
+    page_source_dir: Optional[str] = None,
+) -> Dict[str, Union[List[sonar_dashboard.SonarDashboardSection],
+                     Exception]]:
+    """Scrapes the addresses concurrently, one page per pooled driver.
+
+    If `page_source_dir` is given, each rendered page is saved there as
+    "<address>.html".
+
+    Returns a dict in the order of `solana_addresses`, mapping each address
+    to its sections, or to the exception raised while scraping it.
+    """
+
+    def scrape(address: str):
+        page_source_path = (
+            os.path.join(page_source_dir, f'{address}.html')
+            if page_source_dir is not None else None)
+        with pool.acquire() as driver:
+            return sonar_dashboard.get_sonar_dashboard_sections(
+                selenium_driver=driver,
+                solana_address=address,
+                wait_for_loading=wait_for_loading,
+                section_titles=section_titles,
+                load_times_path=load_times_path,
+                page_source_path=page_source_path)
+
+    with concurrent.futures.ThreadPoolExecutor(pool.size) as executor:
+        futures = {address: executor.submit(scrape, address)
+                   for address in solana_addresses}
+    ret = {}
+    for address, future in futures.items():
+        try:
+            ret[address] = future.result()
+        except Exception as e:
+            logger.exception('Scraping Sonar dashboard of %s failed.',
+                             address)
+            ret[address] = e
+    return ret
@@ -4,60 +4,178 @@ This script uses selenium and Chrome drivers, please make sure you have
 ChromeDriver installed in your PATH.
 (See https://selenium-python.readthedocs.io/installation.html#drivers)
 
-The script waits for the Sonar dashboard to load. We can override the default
-wait duration using command-line argument.
+The script waits until the Sonar dashboard is loaded. We can override the
+maximum wait duration using command-line argument.
+
+Several addresses can be given; they are scraped concurrently by a pool of
+browsers, and the output is then a JSON object keyed by address.
+
+With `--html`, saved page sources (see `--save_html`) are parsed offline
+instead, without selenium or a browser; `--workers` spreads a bulk re-parse
+over several processes.
 """
 import argparse
 import json
 import logging
+import os
 import sys
 from typing import Any, Dict, List
 
-from selenium import webdriver
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
 
+import browser_pool
 import sonar_dashboard
+import yield_farming_store
+from common import profiling
 
 
-_WAIT_FOR_SONAR_LOADING_SECONDS = 15
+_WAIT_FOR_SONAR_LOADING_SECONDS = 60.0
+_DEFAULT_NUM_BROWSERS = 4
 
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument('-a', '--address', help='The target Solana address.',
-                        required=True)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-a', '--address',
+                        help='The target Solana address(es).',
+                        nargs='+')
+    source.add_argument('--html',
+                        help='Saved Sonar dashboard page source(s) to parse '
+                             'offline instead of scraping.',
+                        nargs='+')
+    parser.add_argument('--browsers',
+                        help='The maximum number of concurrent browsers.',
+                        type=int,
+                        default=_DEFAULT_NUM_BROWSERS)
+    parser.add_argument('--workers',
+                        help='Number of processes parsing the --html files; '
+                             '0 for one per CPU.',
+                        type=int,
+                        default=1)
     parser.add_argument('--wait',
-                        help='The duration in seconds for Sonar to load.',
+                        help='The maximum duration in seconds for Sonar to '
+                             'load.',
                         type=float,
                         default=_WAIT_FOR_SONAR_LOADING_SECONDS)
     parser.add_argument('--debug',
                         help='Enable debug mode.',
                         action='store_true')
+    parser.add_argument('--load_times_log',
+                        help='File to append Sonar load times to (JSON lines).',
+                        default=None)
+    parser.add_argument('--store',
+                        help='Directory of the yield farming time-series '
+                             'store to append the scraped rows to.',
+                        default=None)
+    parser.add_argument('--save_html',
+                        help='Directory to save the rendered page sources '
+                             'to, as <address>.html.',
+                        default=None)
+    profiling.add_profile_arguments(parser)
     args = parser.parse_args()
 
+    with profiling.profile_from_args(args):
+        _run(args)
+
+
+def _run(args: argparse.Namespace):
     # Set up logging.
     logger = logging.getLogger(name=__name__)
     logging_level = logging.DEBUG if args.debug else logging.WARNING
     logger.setLevel(logging_level)
 
-    # Init web driver.
-    try:
-        options = webdriver.ChromeOptions()
-        options.headless = False if args.debug else True
-        driver = webdriver.Chrome(options=options)
-    except:
-        logger.exception('Cannot initialize selenium web driver.')
-        sys.exit(1)
+    if args.html is not None:
+        _run_offline(args)
+        return
+
+    # Init web drivers.
+    with profiling.phase('load'):
+        try:
+            pool = browser_pool.BrowserPool(
+                size=min(args.browsers, len(args.address)),
+                headless=not args.debug)
+        except:
+            logger.exception('Cannot initialize selenium web driver.')
+            sys.exit(1)
 
     # Find Sonar dashboard sections. (History, Wallet tokens, ...)
     # Our target is the "Yield farming" section.
-    sections = sonar_dashboard.get_sonar_dashboard_sections(
-        selenium_driver=driver,
-        solana_address=args.address,
-        wait_for_loading=args.wait)
-
-    for section in sections:
-        if section.title == 'Yield farming':
-            print(json.dumps(section.data_table.data_rows, indent=2))
+    with pool, profiling.phase('fetch'):
+        address_to_sections = browser_pool.scrape_addresses(
+            pool,
+            args.address,
+            wait_for_loading=args.wait,
+            section_titles=('Yield farming',),
+            load_times_path=args.load_times_log,
+            page_source_dir=args.save_html)
+
+    if args.store is not None:
+        with profiling.phase('aggregate'):
+            store = yield_farming_store.YieldFarmingStore(args.store)
+            for address, sections in address_to_sections.items():
+                if isinstance(sections, Exception):
+                    continue
+                for section in sections:
+                    if section.title == 'Yield farming':
+                        store.append_rows(address,
+                                          section.data_table.data_rows)
+
+    with profiling.phase('render'):
+        _print_yield_farming_rows(address_to_sections)
+
+    if any(isinstance(sections, Exception)
+           for sections in address_to_sections.values()):
+        sys.exit(1)
+
+
+def _parse_html_file(
+        path: str) -> List[sonar_dashboard.SonarDashboardSection]:
+    with open(path, encoding='utf-8') as f:
+        page_source = f.read()
+    return sonar_dashboard.get_sonar_dashboard_sections_from_html(
+        page_source, section_titles=('Yield farming',))
+
+
+def _run_offline(args: argparse.Namespace):
+    workers = min(args.workers or os.cpu_count(), len(args.html))
+    path_to_sections: Dict[str, Any]
+    with profiling.phase('aggregate'):
+        if workers > 1:
+            # Only imported in this mode, to keep the serial start-up short.
+            import concurrent.futures
+
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers) as executor:
+                # Chunks amortize the inter-process round trips.
+                chunksize = max(1, len(args.html) // (workers * 4))
+                path_to_sections = dict(zip(
+                    args.html, executor.map(_parse_html_file, args.html,
+                                            chunksize=chunksize)))
+        else:
+            path_to_sections = {path: _parse_html_file(path)
+                                for path in args.html}
+
+    with profiling.phase('render'):
+        _print_yield_farming_rows(path_to_sections)
+
+
+def _print_yield_farming_rows(key_to_sections: Dict[str, Any]):
+    """Prints the rows alone for one key, or a JSON object keyed by key."""
+    key_to_rows: Dict[str, Any] = {}
+    for key, sections in key_to_sections.items():
+        key_to_rows[key] = None
+        if isinstance(sections, Exception):
+            continue
+        for section in sections:
+            if section.title == 'Yield farming':
+                key_to_rows[key] = section.data_table.data_rows
+    if len(key_to_rows) == 1:
+        rows = next(iter(key_to_rows.values()))
+        if rows is not None:
+            print(json.dumps(rows, indent=2))
+    else:
+        print(json.dumps(key_to_rows, indent=2))
 
 
 if __name__ == '__main__':
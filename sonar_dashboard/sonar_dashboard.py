@@ -1,13 +1,32 @@
 """Module for Sonar Dashboard parsing.
 
 This module provides the "get_sonar_dashboard_sections" function that will
-return all sections of the Sonar Dashboard.
+return all sections of the Sonar Dashboard, and its browserless counterpart
+"get_sonar_dashboard_sections_from_html" that parses saved page source.
+
+Instead of sleeping for a fixed duration, we poll the page until the wanted
+sections are rendered and their row counts stop changing, and record how long
+that took.
 """
 import dataclasses
+import json
+import logging
 import time
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+import sonar_html
+
+if TYPE_CHECKING:
+    # Selenium is only needed for live scraping, not for parsing saved HTML.
+    from selenium import webdriver
+
 
-from selenium import webdriver
+_DEFAULT_POLL_INTERVAL_SECONDS = 0.5
+# The number of consecutive polls with identical row counts before we consider
+# the dashboard loaded.
+_DEFAULT_STABLE_POLLS = 3
+
+logger = logging.getLogger(__name__)
 
 
 @dataclasses.dataclass
@@ -15,6 +34,9 @@ class DataTable:
     """Generic type for a table."""
     headers: Tuple[str]
     data_rows: Tuple[Dict[str, Any]]
+    # Sonar rendered the table as empty ("no data"), as opposed to a table
+    # whose rows are not known.
+    empty: bool = False
 
 
 @dataclasses.dataclass
@@ -23,63 +45,212 @@ class SonarDashboardSection:
     data_table: Optional[DataTable] = None  # A section might not have a table.
 
 
+# Extracts every section in a single WebDriver round trip. Takes an optional
+# list of section titles to parse (all sections if null) and returns
+# [{title, table: {headers, rows, empty} | null}], rows being lists of cell
+# texts and empty telling Vuetify's "no data" wrapper.
+_EXTRACT_SECTIONS_SCRIPT = """
+const wantedTitles = arguments[0];
+const textOf = (element) =>
+    element ? (element.innerText || element.textContent || '').trim() : '';
+const ret = [];
+for (const section of document.getElementsByClassName('mt-6')) {
+  const title = textOf(section.querySelector('.text-h6'));
+  if (wantedTitles && !wantedTitles.includes(title)) {
+    continue;
+  }
+  // Note: We will take the first table only if there are multiple.
+  const table = section.querySelector('table');
+  let parsedTable = null;
+  if (table) {
+    const headers = Array.from(
+        table.querySelectorAll('th'), (th) => textOf(th.querySelector('span')));
+    // Some sections have a <table> without a <tbody>.
+    const tbody = table.querySelector('tbody');
+    const empty = Boolean(
+        tbody && tbody.querySelector('.v-data-table__empty-wrapper'));
+    let rows = [];
+    if (tbody && !empty) {
+      rows = Array.from(
+          tbody.querySelectorAll('tr'),
+          (tr) => Array.from(tr.querySelectorAll('td'), textOf));
+    }
+    parsedTable = {headers: headers, rows: rows, empty: empty};
+  }
+  ret.push({title: title, table: parsedTable});
+}
+return ret;
+"""
+
+
+class _SectionsReady:
+    """WebDriverWait condition: the wanted sections are present and stable.
+
+    A section is present once its table has at least one row, or is rendered
+    as empty by Sonar; a table with neither is still loading. Returns the extracted raw sections once the same
+    titles and row counts have been seen for `stable_polls` consecutive
+    polls, False before that.
+    """
+
+    def __init__(self,
+                 section_titles: Optional[Sequence[str]],
+                 stable_polls: int):
+        self._section_titles = (list(section_titles)
+                                if section_titles is not None else None)
+        self._stable_polls = stable_polls
+        self._last_signature = None
+        self._num_stable = 0
+        self.num_polls = 0
+
+    def __call__(self, driver) -> Any:
+        self.num_polls += 1
+        raw_sections = driver.execute_script(_EXTRACT_SECTIONS_SCRIPT,
+                                             self._section_titles)
+        if not self._is_complete(raw_sections):
+            self._last_signature = None
+            self._num_stable = 0
+            return False
+        signature = tuple(
+            (raw['title'],
+             None if raw['table'] is None else len(raw['table']['rows']))
+            for raw in raw_sections)
+        if signature == self._last_signature:
+            self._num_stable += 1
+        else:
+            self._last_signature = signature
+            self._num_stable = 1
+        return raw_sections if self._num_stable >= self._stable_polls else False
+
+    def _is_complete(self, raw_sections: List[Dict[str, Any]]) -> bool:
+        # Vuetify renders a table before its rows, so a table counts once it
+        # has rows or Sonar's "no data" wrapper.
+        loaded = {raw['title'] for raw in raw_sections
+                  if raw['table'] is not None and
+                  (raw['table']['rows'] or raw['table'].get('empty'))}
+        if self._section_titles is None:
+            # Every rendered table must be loaded, and at least one present.
+            return bool(loaded) and all(
+                raw['title'] in loaded for raw in raw_sections
+                if raw['table'] is not None)
+        return all(title in loaded for title in self._section_titles)
+
+
 def get_sonar_dashboard_sections(
-    selenium_driver: webdriver.chrome.webdriver.WebDriver,
+    selenium_driver: 'webdriver.chrome.webdriver.WebDriver',
     solana_address: str,
-    wait_for_loading: float) -> List[SonarDashboardSection]:
+    wait_for_loading: float,
+    section_titles: Optional[Sequence[str]] = None,
+    poll_interval: float = _DEFAULT_POLL_INTERVAL_SECONDS,
+    stable_polls: int = _DEFAULT_STABLE_POLLS,
+    load_times_path: Optional[str] = None,
+    page_source_path: Optional[str] = None,
+) -> List[SonarDashboardSection]:
     """Returns all Sonar dashboard sections.
 
     Args:
         selenium_driver: The selenium web driver.
         solana_address: The Solana address.
-        wait_for_loading: Duration in seconds to wait for Sonar dashboard.
+        wait_for_loading: Maximum duration in seconds to wait for Sonar
+            dashboard. We return as soon as the data is loaded.
+        section_titles: If given, only the sections with these titles are
+            parsed and returned, e.g. ("Yield farming",). We also wait for
+            these sections specifically, until their tables have rows or
+            are rendered empty.
+        poll_interval: Duration in seconds between two readiness checks.
+        stable_polls: Number of consecutive checks with the same row counts
+            before the data is considered loaded.
+        load_times_path: If given, a JSON line with the load time is appended
+            to this file, to help tune the timeouts.
+        page_source_path: If given, the rendered page source is saved to this
+            file once loaded, for get_sonar_dashboard_sections_from_html.
+
+    Raises:
+        TimeoutError: If the dashboard did not load within wait_for_loading.
     """
+    from selenium.common import exceptions as selenium_exceptions
+    from selenium.webdriver.support import ui as selenium_ui
+
     sonar_dashboard_url = f'https://sonar.watch/dashboard/{solana_address}'
+    start = time.perf_counter()
     selenium_driver.get(sonar_dashboard_url)
-    sections = selenium_driver.find_elements_by_class_name('mt-6')
-    ret = []
-    time.sleep(wait_for_loading)
-    for section in sections:
-        # Find the title and the data table
-        title = section.find_element_by_class_name('text-h6').text
-        try:
-            # Note: We will take the first table only if there are multiple.
-            table_element = section.find_element_by_tag_name('table')
-        except:
-            table_element = None
-        if table_element is not None:
-            data_table = _parse_data_table(table=table_element)
-        else:
-            data_table = None
-        ret.append(SonarDashboardSection(title=title, data_table=data_table))
-    return ret
+    condition = _SectionsReady(section_titles, stable_polls)
+    wait = selenium_ui.WebDriverWait(
+        selenium_driver,
+        timeout=wait_for_loading,
+        poll_frequency=poll_interval,
+        ignored_exceptions=(selenium_exceptions.JavascriptException,
+                            selenium_exceptions.StaleElementReferenceException))
+    try:
+        raw_sections = wait.until(condition)
+    except selenium_exceptions.TimeoutException:
+        _record_load_time(load_times_path, solana_address, section_titles,
+                          time.perf_counter() - start, condition.num_polls,
+                          timed_out=True)
+        wanted = (', '.join(section_titles) if section_titles is not None
+                  else 'any section')
+        raise TimeoutError(
+            f'Sonar dashboard of {solana_address} did not load within '
+            f'{wait_for_loading}s (waiting for: {wanted}).') from None
+    _record_load_time(load_times_path, solana_address, section_titles,
+                      time.perf_counter() - start, condition.num_polls,
+                      timed_out=False)
+    if page_source_path is not None:
+        with open(page_source_path, 'w', encoding='utf-8') as f:
+            f.write(selenium_driver.page_source)
+    return [_build_section(raw_section) for raw_section in raw_sections]
 
 
-def _parse_data_table(table: webdriver.remote.webelement.WebElement) -> DataTable:
-    header_row = tuple(
-        th.find_element_by_tag_name('span').text
-        for th in table.find_elements_by_tag_name('th'))
+def get_sonar_dashboard_sections_from_html(
+    page_source: str,
+    section_titles: Optional[Sequence[str]] = None,
+) -> List[SonarDashboardSection]:
+    """Returns the Sonar dashboard sections parsed from rendered HTML.
 
-    data_rows = []
-    try:
-        tbody = table.find_element_by_tag_name('tbody')
-    except:
-        # Note that we need this because some Sonar dashboard section
-        # has <table> but without a <tbody>.
-        tbody = None
-    if tbody is None or tbody.find_elements_by_class_name('v-data-table__empty-wrapper'):
-        data_rows = []  # There is no data in this table.
-    else:
-        for tr in tbody.find_elements_by_tag_name('tr'):
-            tds = tr.find_elements_by_tag_name('td')
-            td_values = [_get_td_raw_string_value(td) for td in tds]
-            data_rows.append(td_values)
+    This needs no browser, e.g. to re-parse archived page sources.
 
-    # Transform data rows to dicts.
-    data_rows = tuple(dict(zip(header_row, data_row)) for data_row in data_rows)
-    return DataTable(headers=header_row, data_rows=data_rows)
+    Args:
+        page_source: The rendered page HTML, e.g. `driver.page_source`.
+        section_titles: If given, only the sections with these titles are
+            returned, e.g. ("Yield farming",).
+    """
+    return [_build_section(raw_section)
+            for raw_section in sonar_html.extract_raw_sections(
+                page_source, section_titles)]
 
 
-def _get_td_raw_string_value(td_element):
-    all_elements = [td_element, *td_element.find_elements()]
-    return ' '.join(e.text for e in all_elements)
+def _record_load_time(path: Optional[str],
+                      solana_address: str,
+                      section_titles: Optional[Sequence[str]],
+                      seconds: float,
+                      num_polls: int,
+                      timed_out: bool) -> None:
+    logger.info('Sonar dashboard of %s %s after %.2fs (%d polls).',
+                solana_address, 'timed out' if timed_out else 'loaded',
+                seconds, num_polls)
+    if path is None:
+        return
+    record = {
+        'timestamp': time.time(),
+        'address': solana_address,
+        'sections': (list(section_titles)
+                     if section_titles is not None else None),
+        'seconds': round(seconds, 3),
+        'polls': num_polls,
+        'timed_out': timed_out,
+    }
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def _build_section(raw_section: Dict[str, Any]) -> SonarDashboardSection:
+    raw_table = raw_section['table']
+    if raw_table is None:
+        return SonarDashboardSection(title=raw_section['title'])
+    header_row = tuple(raw_table['headers'])
+    # Transform data rows to dicts.
+    data_rows = tuple(dict(zip(header_row, data_row))
+                      for data_row in raw_table['rows'])
+    return SonarDashboardSection(
+        title=raw_section['title'],
+        data_table=DataTable(headers=header_row, data_rows=data_rows,
+                             empty=bool(raw_table.get('empty'))))
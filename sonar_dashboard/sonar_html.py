@@ -0,0 +1,324 @@
+"""Browserless parsing of rendered Sonar dashboard HTML.
+
+`extract_raw_sections` walks saved page source (e.g. `driver.page_source`) in
+a single streaming pass with the standard library HTML parser and returns the
+same raw structure as the in-browser extraction script of `sonar_dashboard`:
+
+    [{'title': str,
+      'table': {'headers': [str], 'rows': [[str]], 'empty': bool} or None}]
+
+Element texts approximate the browser's `innerText`: block elements start new
+lines, whitespace is collapsed and <script>/<style> contents are skipped.
+"""
+import bisect
+import html
+import html.parser
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+
+_SECTION_CLASS = 'mt-6'
+_TITLE_CLASS = 'text-h6'
+_EMPTY_TABLE_CLASS = 'v-data-table__empty-wrapper'
+
+_VOID_ELEMENTS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr'))
+_BLOCK_ELEMENTS = frozenset((
+    'address', 'article', 'aside', 'blockquote', 'dd', 'div', 'dl', 'dt',
+    'fieldset', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'header', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table',
+    'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'ul'))
+_SKIPPED_TEXT_ELEMENTS = frozenset(('script', 'style', 'template'))
+
+# Everything before the first section is irrelevant (and usually large, with
+# inline scripts and styles), so we start parsing at the first section tag.
+_SECTION_START_RE = re.compile(
+    r'<[a-zA-Z][^<>]*\bclass\s*=\s*["\'][^"\']*\b' + re.escape(_SECTION_CLASS)
+    + r'(?![\w-])')
+_TABLE_END = '</table>'
+_SPACES_RE = re.compile(r'[ \t\r\f\v\xa0]+')
+
+
+def _normalize_text(raw: str) -> str:
+    lines = (_SPACES_RE.sub(' ', line).strip() for line in raw.split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+class _TextCapture:
+
+    __slots__ = ('parts',)
+
+    def __init__(self):
+        self.parts: List[str] = []
+
+    def text(self) -> str:
+        return _normalize_text(''.join(self.parts))
+
+
+class _SectionBuilder:
+    """Collects the title and first table of one section element."""
+
+    def __init__(self):
+        self.title: Optional[str] = None
+        self.title_started = False
+        self.table_started = False
+        self.table_done = False
+        self.headers: List[str] = []
+        self.rows: List[List[str]] = []
+        self.tbody_started = False
+        self.tbody_done = False
+        self.tbody_empty = False
+        self.current_th_index = 0
+        self.current_th_span_taken = False
+        self.current_row: Optional[List[str]] = None
+
+    def to_raw(self) -> Dict[str, Any]:
+        table = None
+        if self.table_started:
+            table = {'headers': self.headers,
+                     'rows': [] if self.tbody_empty else self.rows,
+                     'empty': self.tbody_empty}
+        return {'title': self.title or '', 'table': table}
+
+
+class _StackEntry:
+
+    __slots__ = ('tag', 'closers', 'block')
+
+    def __init__(self, tag: str, block: bool):
+        self.tag = tag
+        self.closers = []
+        self.block = block
+
+
+class _SonarHtmlParser(html.parser.HTMLParser):
+
+    def __init__(self, section_titles: Optional[Sequence[str]]):
+        super().__init__(convert_charrefs=True)
+        self._section_titles = (frozenset(section_titles)
+                                if section_titles is not None else None)
+        self._stack: List[_StackEntry] = []
+        self._captures: List[_TextCapture] = []
+        self._skip_depth = 0
+        self._open_sections: List[_SectionBuilder] = []
+        # In document order of the section start tags.
+        self._sections: List[_SectionBuilder] = []
+
+    def raw_sections(self) -> List[Dict[str, Any]]:
+        ret = [section.to_raw() for section in self._sections]
+        if self._section_titles is not None:
+            ret = [raw for raw in ret if raw['title'] in self._section_titles]
+        return ret
+
+    # HTMLParser callbacks.
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_ELEMENTS:
+            if tag == 'br':
+                self._add_text('\n')
+            return
+        entry = _StackEntry(tag, tag in _BLOCK_ELEMENTS)
+        self._stack.append(entry)
+        if entry.block:
+            self._add_text('\n')
+        if tag in _SKIPPED_TEXT_ELEMENTS:
+            self._skip_depth += 1
+            entry.closers.append(self._end_skip)
+            return
+
+        classes = ()
+        for name, value in attrs:
+            if name == 'class' and value:
+                classes = value.split()
+                break
+
+        for section in self._open_sections:
+            self._on_section_descendant(section, entry, tag, classes)
+        if _SECTION_CLASS in classes:
+            section = _SectionBuilder()
+            self._sections.append(section)
+            self._open_sections.append(section)
+            entry.closers.append(
+                lambda section=section: self._open_sections.remove(section))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_ELEMENTS:
+            return
+        # Browsers close unclosed children implicitly; so do we.
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index].tag == tag:
+                break
+        else:
+            return  # A stray end tag.
+        while len(self._stack) > index:
+            entry = self._stack.pop()
+            if entry.block:
+                self._add_text('\n')
+            for closer in reversed(entry.closers):
+                closer()
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._add_text(data)
+
+    # Helpers.
+
+    def _add_text(self, text: str) -> None:
+        for capture in self._captures:
+            capture.parts.append(text)
+
+    def _end_skip(self) -> None:
+        self._skip_depth -= 1
+
+    def _capture(self, entry: _StackEntry, on_done) -> None:
+        capture = _TextCapture()
+        self._captures.append(capture)
+
+        def close():
+            self._captures.remove(capture)
+            on_done(capture.text())
+        entry.closers.append(close)
+
+    def _on_section_descendant(self, section: _SectionBuilder,
+                               entry: _StackEntry, tag: str,
+                               classes: Sequence[str]) -> None:
+        if not section.title_started and _TITLE_CLASS in classes:
+            section.title_started = True
+            self._capture(entry,
+                          lambda text: setattr(section, 'title', text))
+
+        if tag == 'table':
+            if not section.table_started:
+                section.table_started = True
+                entry.closers.append(
+                    lambda: setattr(section, 'table_done', True))
+            return
+        if not section.table_started or section.table_done:
+            return
+
+        # Inside the first table of the section.
+        if tag == 'th':
+            # Only the first <span> of each header cell holds its text.
+            section.current_th_index = len(section.headers)
+            section.current_th_span_taken = False
+            section.headers.append('')
+        elif (tag == 'span' and not section.current_th_span_taken and
+              self._inside('th')):
+            section.current_th_span_taken = True
+            index = section.current_th_index
+
+            def set_header(text, index=index):
+                section.headers[index] = text
+            self._capture(entry, set_header)
+        elif tag == 'tbody':
+            if not section.tbody_started:
+                section.tbody_started = True
+                entry.closers.append(
+                    lambda: setattr(section, 'tbody_done', True))
+        elif not section.tbody_started or section.tbody_done:
+            return
+        else:
+            if _EMPTY_TABLE_CLASS in classes:
+                section.tbody_empty = True
+            if tag == 'tr':
+                row: List[str] = []
+                section.rows.append(row)
+                section.current_row = row
+            elif tag == 'td' and section.current_row is not None:
+                row = section.current_row
+                row.append('')
+                index = len(row) - 1
+
+                def set_cell(text, row=row, index=index):
+                    row[index] = text
+                self._capture(entry, set_cell)
+
+    def _inside(self, tag: str) -> bool:
+        return any(entry.tag == tag for entry in self._stack[:-1])
+
+
+def _section_start_before(page_source: str, position: int) -> int:
+    """Returns where the last section tag before `position` starts, or -1."""
+    while True:
+        position = page_source.rfind(_SECTION_CLASS, 0, position)
+        if position < 0:
+            return -1
+        tag_start = page_source.rfind('<', 0, position)
+        if tag_start < 0:
+            return -1
+        match = _SECTION_START_RE.match(page_source, tag_start)
+        if match is not None and match.end() == position + len(
+                _SECTION_CLASS):
+            return tag_start
+
+
+def _wanted_spans(page_source: str,
+                  section_titles: Sequence[str]) -> Optional[List[List[int]]]:
+    """Returns the [start, end) spans holding the wanted sections.
+
+    A span starts at the section tag before an occurrence of a title, and
+    ends at the first section tag after the next table end: enough for the
+    title and first table the parser takes from a section. Returns None if a
+    title does not occur verbatim (e.g. written with other entities), to
+    parse everything instead.
+    """
+    spans = []
+    for title in section_titles:
+        needle = html.escape(title, quote=False)
+        position = page_source.find(needle)
+        if position < 0:
+            return None
+        while position >= 0:
+            start = _section_start_before(page_source, position)
+            if start >= 0:
+                table_end = page_source.find(_TABLE_END, position)
+                match = (_SECTION_START_RE.search(page_source, table_end)
+                         if table_end >= 0 else None)
+                spans.append([start, match.start() if match is not None
+                              else len(page_source)])
+            position = page_source.find(needle, position + len(needle))
+    spans.sort()
+    merged: List[List[int]] = []
+    for span in spans:
+        if merged and span[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], span[1])
+        else:
+            merged.append(span)
+    return merged
+
+
+def extract_raw_sections(
+    page_source: str,
+    section_titles: Optional[Sequence[str]] = None,
+) -> List[Dict[str, Any]]:
+    """Extracts the raw Sonar dashboard sections from rendered HTML.
+
+    With `section_titles`, only the spans of the page around the wanted
+    titles are parsed, found with plain string searches, so the cost does
+    not grow with the size of the other sections.
+
+    Args:
+        page_source: The rendered page HTML.
+        section_titles: If given, only return sections with these titles.
+    """
+    spans = None
+    if section_titles is not None:
+        spans = _wanted_spans(page_source, section_titles)
+    if spans is None:
+        match = _SECTION_START_RE.search(page_source)
+        if match is None:
+            return []
+        spans = [[match.start(), len(page_source)]]
+    raw_sections = []
+    for start, end in spans:
+        parser = _SonarHtmlParser(section_titles)
+        parser.feed(page_source[start:end])
+        parser.close()
+        raw_sections.extend(parser.raw_sections())
+    return raw_sections
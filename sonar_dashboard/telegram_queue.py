@@ -0,0 +1,292 @@
+"""Batched, rate-limited Telegram message delivery.
+
+Messages are queued per chat, and several parts (e.g. formatted farm rows)
+are coalesced into as few messages as fit Telegram's size limit. `flush()`
+sends the queue with one worker per chat, within a per-chat and a global
+rate limit, retrying network errors with exponential backoff and honoring
+Telegram's "retry after" replies. A send that timed out while connecting
+never reached Telegram and is retried too. One that timed out waiting for
+the reply is not: Telegram has often delivered it anyway, and a retry would
+send it twice, so it is logged as an error instead.
+
+With a persistence file, undelivered messages are saved after each change
+and sent by the next run.
+"""
+import concurrent.futures
+import dataclasses
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+
+MAX_MESSAGE_LENGTH = 4096
+
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+_DEFAULT_GLOBAL_MESSAGES_PER_SECOND = 30.0
+_DEFAULT_CHAT_MESSAGES_PER_SECOND = 1.0
+_DEFAULT_MAX_ATTEMPTS = 5
+_DEFAULT_BASE_BACKOFF_SECONDS = 1.0
+_MAX_BACKOFF_SECONDS = 60.0
+# Read timeout of a send, longer than the library's 5s so that slow replies
+# are not taken for timeouts.
+_SEND_TIMEOUT_SECONDS = 20.0
+_PART_SEPARATOR = '\n\n'
+
+logger = logging.getLogger(__name__)
+
+
+def coalesce(parts: Sequence[str],
+             header: str = '',
+             limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Joins the parts into as few messages of at most `limit` chars.
+
+    Each message starts with `header`. Parts are kept whole unless a single
+    part does not fit in a message, in which case it is split.
+    """
+    room = limit - len(header)
+    if room <= len(_PART_SEPARATOR):
+        raise ValueError('The header does not fit in a message.')
+    messages = []
+    current = ''
+    for part in parts:
+        while len(part) > room:
+            if current:
+                messages.append(header + current)
+                current = ''
+            messages.append(header + part[:room])
+            part = part[room:]
+        if not part:
+            continue
+        if not current:
+            current = part
+        elif len(current) + len(_PART_SEPARATOR) + len(part) <= room:
+            current += _PART_SEPARATOR + part
+        else:
+            messages.append(header + current)
+            current = part
+    if current:
+        messages.append(header + current)
+    return messages
+
+
+class _TokenBucket:
+    """Blocks callers to at most `rate` acquisitions per second."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self._burst,
+                    self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+
+@dataclasses.dataclass
+class _Message:
+    chat_id: str
+    text: str
+    attempts: int = 0
+
+
+class DeliveryQueue:
+    """A queue of Telegram messages, delivered by `flush()`.
+
+    Usage:
+        queue = DeliveryQueue(bot, persist_path='undelivered.json')
+        queue.enqueue(chat_id, [format_data_row(row) for row in rows],
+                      header='Yield Farmer\\n\\n')
+        queue.flush()
+    """
+
+    def __init__(
+        self,
+        bot,
+        persist_path: Optional[str] = None,
+        global_rate: float = _DEFAULT_GLOBAL_MESSAGES_PER_SECOND,
+        chat_rate: float = _DEFAULT_CHAT_MESSAGES_PER_SECOND,
+        max_attempts: int = _DEFAULT_MAX_ATTEMPTS,
+        base_backoff: float = _DEFAULT_BASE_BACKOFF_SECONDS,
+        max_workers: int = 8,
+        **send_kwargs,
+    ):
+        """Initializer.
+
+        Args:
+            bot: The `telegram.Bot` (anything with `send_message`).
+            persist_path: If given, a JSON file keeping undelivered messages
+                across runs. Messages found there are queued again.
+            global_rate: Messages per second over all chats.
+            chat_rate: Messages per second to a single chat.
+            max_attempts: Attempts per message and flush before it is left
+                in the queue for a later flush.
+            base_backoff: First retry delay in seconds, doubled per attempt.
+            max_workers: Number of chats sent to concurrently.
+            send_kwargs: Extra `send_message` arguments, e.g.
+                disable_web_page_preview=True. The timeout defaults to
+                `_SEND_TIMEOUT_SECONDS`.
+        """
+        self._bot = bot
+        self._persist_path = persist_path
+        self._global_bucket = _TokenBucket(global_rate)
+        self._chat_rate = chat_rate
+        self._chat_buckets: Dict[str, _TokenBucket] = {}
+        self._max_attempts = max_attempts
+        self._base_backoff = base_backoff
+        self._max_workers = max_workers
+        self._send_kwargs = {'timeout': _SEND_TIMEOUT_SECONDS, **send_kwargs}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: List[_Message] = []
+        # The unsent messages of the chats being flushed.
+        self._in_flight: Dict[str, List[_Message]] = {}
+        if persist_path is not None and os.path.exists(persist_path):
+            with open(persist_path) as f:
+                self._pending = [_Message(**message)
+                                 for message in json.load(f)]
+            if self._pending:
+                logger.info('Loaded %d undelivered messages.',
+                            len(self._pending))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def enqueue(self, chat_id: str, parts: Sequence[str],
+                header: str = '') -> int:
+        """Queues the parts for the chat; returns the number of messages."""
+        messages = [_Message(chat_id=str(chat_id), text=text)
+                    for text in coalesce(parts, header)]
+        with self._lock:
+            self._pending.extend(messages)
+            self._persist()
+        return len(messages)
+
+    def flush(self) -> int:
+        """Sends the queued messages; returns how many are left undelivered.
+
+        Messages to one chat are sent in order. Messages queued while
+        flushing are sent by the next flush.
+        """
+        with self._flush_lock:
+            by_chat: Dict[str, List[_Message]] = {}
+            with self._lock:
+                for message in self._pending:
+                    by_chat.setdefault(message.chat_id, []).append(message)
+                self._pending = []
+                self._in_flight = dict(by_chat)
+            if by_chat:
+                with concurrent.futures.ThreadPoolExecutor(
+                        min(self._max_workers, len(by_chat))) as executor:
+                    undelivered_per_chat = list(
+                        executor.map(self._send_chat, by_chat.values()))
+            else:
+                undelivered_per_chat = []
+            with self._lock:
+                undelivered = [message
+                               for messages in undelivered_per_chat
+                               for message in messages]
+                # Keep them ahead of the ones queued meanwhile.
+                self._pending = undelivered + self._pending
+                self._in_flight = {}
+                self._persist()
+                return len(undelivered)
+
+    def _chat_bucket(self, chat_id: str) -> _TokenBucket:
+        with self._lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = _TokenBucket(
+                    self._chat_rate)
+            return bucket
+
+    def _send_chat(self, messages: List[_Message]) -> List[_Message]:
+        """Sends the messages of one chat in order; returns the unsent."""
+        chat_id = messages[0].chat_id
+        for index, message in enumerate(messages):
+            if not self._send_with_retries(message):
+                return messages[index:]
+            with self._lock:
+                # Persist progress so a crash does not resend everything.
+                self._in_flight[chat_id] = messages[index + 1:]
+                self._persist()
+        return []
+
+    def _send_with_retries(self, message: _Message) -> bool:
+        """Returns False if the message must stay queued."""
+        from telegram import error as telegram_error
+        from telegram.vendor.ptb_urllib3.urllib3 import (
+            exceptions as urllib3_exceptions)
+
+        chat_bucket = self._chat_bucket(message.chat_id)
+        for attempt in range(self._max_attempts):
+            chat_bucket.acquire()
+            self._global_bucket.acquire()
+            message.attempts += 1
+            try:
+                self._bot.send_message(chat_id=message.chat_id,
+                                       text=message.text,
+                                       **self._send_kwargs)
+                return True
+            except telegram_error.RetryAfter as e:
+                delay = float(e.retry_after)
+            except (telegram_error.BadRequest,
+                    telegram_error.Unauthorized) as e:
+                # Retrying would fail the same way.
+                logger.error('Dropping a message to chat %s: %s',
+                             message.chat_id, e)
+                return True
+            except telegram_error.TimedOut as e:
+                if not isinstance(e.__cause__,
+                                  urllib3_exceptions.ConnectTimeoutError):
+                    # Likely delivered already: better lost than sent twice.
+                    logger.error('Sending to chat %s timed out waiting for '
+                                 'the reply; not retrying, in case it was '
+                                 'delivered: %r', message.chat_id,
+                                 message.text)
+                    return True
+                # The request never reached Telegram.
+                delay = self._backoff_delay(attempt)
+            except telegram_error.TelegramError:
+                delay = self._backoff_delay(attempt)
+            if attempt + 1 < self._max_attempts:
+                logger.warning('Sending to chat %s failed (attempt %d), '
+                               'retrying in %.1fs.', message.chat_id,
+                               message.attempts, delay)
+                time.sleep(delay)
+        logger.error('Giving up on a message to chat %s for now.',
+                     message.chat_id)
+        return False
+
+    def _backoff_delay(self, attempt: int) -> float:
+        delay = min(_MAX_BACKOFF_SECONDS, self._base_backoff * 2**attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _persist(self) -> None:
+        """Saves the unsent messages. Must be called with the lock held."""
+        if self._persist_path is None:
+            return
+        messages = [message
+                    for chat_messages in self._in_flight.values()
+                    for message in chat_messages] + self._pending
+        tmp_path = f'{self._persist_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump([dataclasses.asdict(message) for message in messages],
+                      f)
+        os.replace(tmp_path, self._persist_path)
@@ -0,0 +1,175 @@
+"""Helpers shared by the yield farming scripts.
+
+Sonar displays numbers as strings ("$1,234.56", "12.3%", "1.2K"). This
+module parses them, formats rows for messages, and diffs two snapshots of
+the "Yield farming" table so that only meaningful changes are notified.
+"""
+import dataclasses
+import re
+import textwrap
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+YIELD_FARMING_TITLE = 'Yield farming'
+MESSAGE_HEADER = '🧑‍🌾 🧑‍🌾 🧑‍🌾 Yield Farmer 🧑‍🌾 🧑‍🌾 🧑‍🌾\n\n'
+
+RowKey = Tuple[str, str]  # (Asset, Platform)
+
+_NUMBER_RE = re.compile(
+    r'(?P<sign>-)?\s*(?P<dollar>\$)?\s*(?P<number>\d[\d,]*(?:\.\d+)?|\.\d+)'
+    r'\s*(?P<suffix>[KMB](?![A-Za-z]))?')
+_SUFFIX_MULTIPLIERS = {'K': 1e3, 'M': 1e6, 'B': 1e9}
+
+
+def parse_display_value(text: Optional[str]) -> Optional[float]:
+    """Parses a number displayed by Sonar, None if there is none.
+
+    Amounts in dollars take precedence over other numbers, so that
+    "12.5 RAY\\n$45.10" gives 45.1. Percent signs are dropped ("12.3%" gives
+    12.3) and K/M/B suffixes are applied.
+    """
+    if not text:
+        return None
+    matches = list(_NUMBER_RE.finditer(text))
+    if not matches:
+        return None
+    match = next((m for m in matches if m.group('dollar')), matches[0])
+    value = float(match.group('number').replace(',', ''))
+    if match.group('suffix'):
+        value *= _SUFFIX_MULTIPLIERS[match.group('suffix')]
+    return -value if match.group('sign') else value
+
+
+def row_key(data_row: Dict[str, Any]) -> RowKey:
+    return (data_row.get('Asset', ''), data_row.get('Platform', ''))
+
+
+def dashboard_url(address: str) -> str:
+    return f'https://sonar.watch/dashboard/{address}'
+
+
+def format_data_row(data_row: Dict[str, Any]) -> str:
+    return textwrap.dedent(f"""\
+        {data_row['Asset']} ({data_row['Platform']})
+        - APR: {data_row['APR']}
+        - Pending: {data_row['Pending']}
+        - Value: {data_row['Value']}""")
+
+
+@dataclasses.dataclass(frozen=True)
+class Thresholds:
+    """When a change of a farm is worth a notification.
+
+    Attributes:
+        apr_change: Absolute APR change, in percentage points.
+        pending_above: Pending rewards value crossing this level upwards
+            (e.g. time to harvest). None to ignore pending rewards.
+        value_change: Relative change of the position value, e.g. 0.1 for
+            10%.
+    """
+    apr_change: float = 5.0
+    pending_above: Optional[float] = None
+    value_change: float = 0.1
+
+
+@dataclasses.dataclass(frozen=True)
+class RowChange:
+    """A notified change of one farm (one Asset/Platform row)."""
+    key: RowKey
+    old_row: Optional[Dict[str, Any]]  # None if the farm is new.
+    new_row: Optional[Dict[str, Any]]  # None if the farm is gone.
+    reasons: Tuple[str, ...] = ()
+
+
+def _changed_reasons(old_row: Dict[str, Any], new_row: Dict[str, Any],
+                     thresholds: Thresholds) -> List[str]:
+    reasons = []
+    old_apr = parse_display_value(old_row.get('APR'))
+    new_apr = parse_display_value(new_row.get('APR'))
+    if (old_apr is not None and new_apr is not None and
+            abs(new_apr - old_apr) >= thresholds.apr_change):
+        reasons.append(f'APR {old_row["APR"]} -> {new_row["APR"]}')
+
+    if thresholds.pending_above is not None:
+        old_pending = parse_display_value(old_row.get('Pending'))
+        new_pending = parse_display_value(new_row.get('Pending'))
+        if (new_pending is not None and
+                new_pending >= thresholds.pending_above and
+                (old_pending is None or
+                 old_pending < thresholds.pending_above)):
+            reasons.append(f'Pending {new_row["Pending"]}')
+
+    old_value = parse_display_value(old_row.get('Value'))
+    new_value = parse_display_value(new_row.get('Value'))
+    if old_value is not None and new_value is not None:
+        if old_value == 0:
+            crossed = new_value != 0
+        else:
+            crossed = (abs(new_value - old_value) / abs(old_value) >=
+                       thresholds.value_change)
+        if crossed:
+            reasons.append(f'Value {old_row["Value"]} -> {new_row["Value"]}')
+    return reasons
+
+
+def diff_rows(old_rows: Sequence[Dict[str, Any]],
+              new_rows: Sequence[Dict[str, Any]],
+              thresholds: Thresholds) -> List[RowChange]:
+    """Returns the farm changes between two snapshots that cross thresholds.
+
+    Rows are matched by (Asset, Platform). New and removed farms are always
+    reported. The result follows the order of `new_rows`, then removed farms
+    in the order of `old_rows`.
+    """
+    old_by_key = {row_key(row): row for row in old_rows}
+    new_keys = set()
+    changes = []
+    for new_row in new_rows:
+        key = row_key(new_row)
+        new_keys.add(key)
+        old_row = old_by_key.get(key)
+        if old_row is None:
+            changes.append(RowChange(key=key, old_row=None, new_row=new_row,
+                                     reasons=('New farm',)))
+            continue
+        reasons = _changed_reasons(old_row, new_row, thresholds)
+        if reasons:
+            changes.append(RowChange(key=key, old_row=old_row,
+                                     new_row=new_row,
+                                     reasons=tuple(reasons)))
+    for key, old_row in old_by_key.items():
+        if key not in new_keys:
+            changes.append(RowChange(key=key, old_row=old_row, new_row=None,
+                                     reasons=('Farm gone',)))
+    return changes
+
+
+def advance_baseline(old_rows: Sequence[Dict[str, Any]],
+                     new_rows: Sequence[Dict[str, Any]],
+                     changes: Sequence[RowChange]) -> List[Dict[str, Any]]:
+    """Returns the rows to diff the next snapshot against.
+
+    Notified farms take their new row, so that changes are measured from
+    what was last notified and a slow drift still crosses the thresholds.
+    Other farms keep their old row, except for Pending, which is a level
+    crossing and follows the latest value. Gone farms are dropped.
+    """
+    notified = {change.key for change in changes}
+    old_by_key = {row_key(row): row for row in old_rows}
+    rows = []
+    for new_row in new_rows:
+        key = row_key(new_row)
+        old_row = old_by_key.get(key)
+        if key in notified or old_row is None:
+            rows.append(new_row)
+        else:
+            rows.append(dict(old_row, Pending=new_row.get('Pending')))
+    return rows
+
+
+def format_row_change(change: RowChange) -> str:
+    if change.new_row is None:
+        asset, platform = change.key
+        return f'{asset} ({platform})\n- Farm gone'
+    reasons = '\n'.join(f'* {reason}' for reason in change.reasons)
+    return f'{format_data_row(change.new_row)}\n{reasons}'
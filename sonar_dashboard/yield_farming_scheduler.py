@@ -0,0 +1,248 @@
+"""Long-running service notifying yield farming changes to Telegram.
+
+Each address is polled on its own interval; the first polls are staggered
+over the interval so scrapes are spread out instead of starting together.
+The last notified "Yield farming" rows of each address are kept, and a
+message is queued only for farms whose APR, pending rewards or value crossed
+the thresholds since, or which appeared or disappeared. A scrape where the
+"Yield farming" table is missing or not loaded is taken as failed and
+changes nothing; a table Sonar rendered empty means every farm is gone.
+
+With `--state`, snapshots survive restarts, so a restart does not notify
+changes twice nor miss the ones that happened while the service was down.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+
+import browser_pool
+import telegram_queue
+import yield_farming
+import yield_farming_store
+
+
+_WAIT_FOR_SONAR_LOADING_SECONDS = 60.0
+_DEFAULT_NUM_BROWSERS = 2
+_DEFAULT_INTERVAL_SECONDS = 300.0
+_DEFAULT_FLUSH_INTERVAL_SECONDS = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+class _Snapshots:
+    """The last notified yield farming rows per address, optionally saved."""
+
+    def __init__(self, path: Optional[str]):
+        self._path = path
+        self._lock = threading.Lock()
+        self._rows: Dict[str, List[Dict[str, Any]]] = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._rows = json.load(f)
+
+    def get(self, address: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            return self._rows.get(address)
+
+    def put(self, address: str, rows: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._rows[address] = rows
+            if self._path is not None:
+                tmp_path = f'{self._path}.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(self._rows, f)
+                os.replace(tmp_path, self._path)
+
+
+def _poll_address(address: str,
+                  pool: browser_pool.BrowserPool,
+                  snapshots: _Snapshots,
+                  thresholds: yield_farming.Thresholds,
+                  delivery_queue: telegram_queue.DeliveryQueue,
+                  store: Optional[yield_farming_store.YieldFarmingStore],
+                  args: argparse.Namespace) -> None:
+    sections = browser_pool.scrape_addresses(
+        pool, [address],
+        wait_for_loading=args.wait,
+        section_titles=(yield_farming.YIELD_FARMING_TITLE,),
+        load_times_path=args.load_times_log)[address]
+    if isinstance(sections, Exception):
+        return  # Already logged; keep the previous snapshot.
+
+    data_table = None
+    for section in sections:
+        if (section.title == yield_farming.YIELD_FARMING_TITLE and
+                section.data_table is not None):
+            data_table = section.data_table
+    if data_table is None or not (data_table.data_rows or data_table.empty):
+        # Sonar not loaded or the section missing: a failed scrape rather
+        # than every farm gone.
+        logger.warning('%s: no yield farming table; keeping the previous '
+                       'snapshot.', address)
+        return
+    # No rows if Sonar rendered the table empty: every farm is then gone.
+    new_rows = list(data_table.data_rows)
+    if store is not None:
+        store.append_rows(address, new_rows)
+    old_rows = snapshots.get(address)
+    if old_rows is None:
+        snapshots.put(address, new_rows)
+        logger.info('First snapshot of %s: %d farms.', address, len(new_rows))
+        return
+
+    # Diffed against the last notified rows, not the last polled ones.
+    changes = yield_farming.diff_rows(old_rows, new_rows, thresholds)
+    snapshots.put(address, yield_farming.advance_baseline(old_rows, new_rows,
+                                                          changes))
+    logger.info('%s: %d farms, %d notified changes.', address,
+                len(new_rows), len(changes))
+    if not changes:
+        return
+    parts = [yield_farming.format_row_change(change) for change in changes]
+    parts.append(yield_farming.dashboard_url(address))
+    for chat_id in args.telegram_chat_id:
+        delivery_queue.enqueue(chat_id, parts,
+                               header=yield_farming.MESSAGE_HEADER)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-a',
+                        '--address',
+                        nargs='+',
+                        required=True,
+                        help='The Solana address(es).')
+    parser.add_argument('-c',
+                        '--telegram_chat_id',
+                        nargs='+',
+                        required=True,
+                        help='The telegram chat(s) to send messages to.')
+    parser.add_argument('-t',
+                        '--telegram_bot_token',
+                        required=True,
+                        help='The telegram bot token to send notification.')
+    parser.add_argument('--interval',
+                        help='Seconds between two polls of an address.',
+                        type=float,
+                        default=_DEFAULT_INTERVAL_SECONDS)
+    parser.add_argument('--apr_change',
+                        help='Notify APR changes of at least this many '
+                             'percentage points.',
+                        type=float,
+                        default=yield_farming.Thresholds.apr_change)
+    parser.add_argument('--pending_above',
+                        help='Notify when pending rewards reach this value.',
+                        type=float,
+                        default=yield_farming.Thresholds.pending_above)
+    parser.add_argument('--value_change',
+                        help='Notify relative value changes of at least this '
+                             'ratio, e.g. 0.1 for 10%%.',
+                        type=float,
+                        default=yield_farming.Thresholds.value_change)
+    parser.add_argument('--state',
+                        help='JSON file keeping the last snapshots across '
+                             'restarts.',
+                        default=None)
+    parser.add_argument('--store',
+                        help='Directory of the yield farming time-series '
+                             'store to append every snapshot to.',
+                        default=None)
+    parser.add_argument('--undelivered',
+                        help='JSON file keeping undelivered messages across '
+                             'restarts.',
+                        default=None)
+    parser.add_argument('--flush_interval',
+                        help='Seconds between two deliveries of the queued '
+                             'messages.',
+                        type=float,
+                        default=_DEFAULT_FLUSH_INTERVAL_SECONDS)
+    parser.add_argument('--browsers',
+                        help='The maximum number of concurrent browsers.',
+                        type=int,
+                        default=_DEFAULT_NUM_BROWSERS)
+    parser.add_argument('--wait',
+                        help='The maximum duration in seconds for Sonar to '
+                             'load.',
+                        type=float,
+                        default=_WAIT_FOR_SONAR_LOADING_SECONDS)
+    parser.add_argument('--debug',
+                        action='store_true',
+                        help='To enable debug mode.')
+    parser.add_argument('--load_times_log',
+                        help='File to append Sonar load times to (JSON lines).',
+                        default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    thresholds = yield_farming.Thresholds(apr_change=args.apr_change,
+                                          pending_above=args.pending_above,
+                                          value_change=args.value_change)
+    snapshots = _Snapshots(args.state)
+    store = (yield_farming_store.YieldFarmingStore(args.store)
+             if args.store is not None else None)
+    import telegram
+
+    delivery_queue = telegram_queue.DeliveryQueue(
+        telegram.Bot(token=args.telegram_bot_token),
+        persist_path=args.undelivered,
+        disable_web_page_preview=True)
+    num_browsers = min(args.browsers, len(args.address))
+    try:
+        pool = browser_pool.BrowserPool(size=num_browsers,
+                                        headless=not args.debug)
+    except:
+        logger.exception('Cannot initialize selenium web driver.')
+        sys.exit(1)
+
+    # Only imported to run, to keep --help and start-up errors quick.
+    from apscheduler.executors.pool import ThreadPoolExecutor
+    from apscheduler.schedulers.blocking import BlockingScheduler
+    from apscheduler.triggers.interval import IntervalTrigger
+
+    scheduler = BlockingScheduler(
+        executors={'default': ThreadPoolExecutor(num_browsers),
+                   # Deliveries never wait for a scrape to finish.
+                   'delivery': ThreadPoolExecutor(1)},
+        job_defaults={'coalesce': True, 'max_instances': 1})
+    now = datetime.datetime.now(datetime.timezone.utc)
+    stagger = args.interval / len(args.address)
+    for index, address in enumerate(args.address):
+        scheduler.add_job(
+            _poll_address,
+            IntervalTrigger(
+                seconds=args.interval,
+                start_date=now + datetime.timedelta(seconds=index * stagger)),
+            args=(address, pool, snapshots, thresholds, delivery_queue,
+                  store, args),
+            id=address,
+            name=f'poll {address}',
+            # Also run right away instead of one interval after start_date.
+            next_run_time=now + datetime.timedelta(seconds=index * stagger),
+            misfire_grace_time=int(args.interval))
+
+    scheduler.add_job(delivery_queue.flush,
+                      IntervalTrigger(seconds=args.flush_interval),
+                      id='delivery',
+                      name='deliver queued messages',
+                      executor='delivery')
+
+    with pool:
+        try:
+            scheduler.start()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""Append-only columnar store of scraped yield farming rows.
+
+Each series, keyed by (address, platform, asset), is a directory holding one
+flat binary file per column:
+
+    <root>/<address>/<platform>/<asset>/time.i64     (unix seconds)
+                                       /apr.f64       (percent)
+                                       /pending.f64   (dollars)
+                                       /value.f64     (dollars)
+
+Values are parsed from Sonar's display strings; unparsable ones are NaN.
+Appends only add a few bytes at the end of each file. Times increase within
+a series, so range queries binary-search the memory-mapped time column and
+only read the matching slice of the other columns, however long the series.
+
+Example:
+    python yield_farming_store.py DIR -a ADDRESS --since 2021-10-01 \\
+        --bucket 86400
+"""
+import argparse
+import array
+import bisect
+import dataclasses
+import datetime
+import json
+import math
+import mmap
+import os
+import threading
+import time
+import urllib.parse
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import yield_farming
+
+
+_TIME_COLUMN = 'time.i64'
+_VALUE_COLUMNS = {'apr': 'apr.f64', 'pending': 'pending.f64',
+                  'value': 'value.f64'}
+_DISPLAY_NAMES = {'apr': 'APR', 'pending': 'Pending', 'value': 'Value'}
+_ITEM_SIZE = 8
+
+
+@dataclasses.dataclass(frozen=True)
+class SeriesKey:
+    address: str
+    platform: str
+    asset: str
+
+
+@dataclasses.dataclass
+class Series:
+    """A slice of a series; columns are aligned arrays."""
+    key: SeriesKey
+    times: 'array.array[int]'
+    apr: 'array.array[float]'
+    pending: 'array.array[float]'
+    value: 'array.array[float]'
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+
+@dataclasses.dataclass
+class Bucket:
+    """Averages of one downsampling bucket, NaN values excluded."""
+    start: int
+    count: int
+    apr: Optional[float]
+    pending: Optional[float]
+    value: Optional[float]
+
+
+def _quote(name: str) -> str:
+    # Keeps names like "RAY-USDC" readable, and makes any name a safe path.
+    return urllib.parse.quote(name, safe='') or '%00'
+
+
+def _unquote(name: str) -> str:
+    return '' if name == '%00' else urllib.parse.unquote(name)
+
+
+class _MappedColumn:
+    """A read-only view of a column file, empty if the file is empty."""
+
+    def __init__(self, path: str, typecode: str, length: int):
+        self._file = None
+        self._mmap = None
+        self.view: Sequence = ()
+        if length == 0:
+            return
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), length * _ITEM_SIZE,
+                               access=mmap.ACCESS_READ)
+        self.view = memoryview(self._mmap).cast(typecode)
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self.view.release()
+            self._mmap.close()
+            self._file.close()
+
+
+class YieldFarmingStore:
+    """The store rooted at a directory, created on first append."""
+
+    def __init__(self, root: str):
+        self._root = root
+        self._lock = threading.Lock()
+        # Last appended time per series, to keep times increasing.
+        self._last_times: Dict[SeriesKey, int] = {}
+
+    def _series_dir(self, key: SeriesKey) -> str:
+        return os.path.join(self._root, _quote(key.address),
+                            _quote(key.platform), _quote(key.asset))
+
+    def _length(self, series_dir: str) -> int:
+        # A crash between column appends leaves columns of unequal length;
+        # the shortest one tells how many rows are complete.
+        lengths = []
+        for column in (_TIME_COLUMN, *_VALUE_COLUMNS.values()):
+            try:
+                lengths.append(
+                    os.path.getsize(os.path.join(series_dir, column)) //
+                    _ITEM_SIZE)
+            except FileNotFoundError:
+                return 0
+        return min(lengths)
+
+    def _last_time(self, key: SeriesKey, series_dir: str) -> Optional[int]:
+        if key in self._last_times:
+            return self._last_times[key]
+        length = self._length(series_dir)
+        if length == 0:
+            return None
+        with open(os.path.join(series_dir, _TIME_COLUMN), 'rb') as f:
+            f.seek((length - 1) * _ITEM_SIZE)
+            last = array.array('q', f.read(_ITEM_SIZE))[0]
+        self._last_times[key] = last
+        return last
+
+    def append_rows(self,
+                    address: str,
+                    data_rows: Sequence[Dict[str, Any]],
+                    timestamp: Optional[float] = None) -> int:
+        """Appends one snapshot of the address' rows; returns rows written.
+
+        Rows of a series whose last time is not before `timestamp` (seconds,
+        default now) are skipped, so that times keep increasing.
+        """
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        written = 0
+        with self._lock:
+            for data_row in data_rows:
+                platform, asset = (data_row.get('Platform', ''),
+                                   data_row.get('Asset', ''))
+                key = SeriesKey(address, platform, asset)
+                series_dir = self._series_dir(key)
+                last_time = self._last_time(key, series_dir)
+                if last_time is not None and last_time >= timestamp:
+                    continue
+                os.makedirs(series_dir, exist_ok=True)
+                length = self._length(series_dir)
+                self._append(series_dir, _TIME_COLUMN,
+                             array.array('q', [timestamp]), length)
+                for name, column in _VALUE_COLUMNS.items():
+                    value = yield_farming.parse_display_value(
+                        data_row.get(_DISPLAY_NAMES[name]))
+                    self._append(series_dir, column,
+                                 array.array('d', [math.nan if value is None
+                                                   else value]), length)
+                self._last_times[key] = timestamp
+                written += 1
+        return written
+
+    @staticmethod
+    def _append(series_dir: str, column: str, values: array.array,
+                length: int) -> None:
+        with open(os.path.join(series_dir, column), 'ab') as f:
+            # Drop a partial row left by an interrupted append.
+            if f.tell() != length * _ITEM_SIZE:
+                f.truncate(length * _ITEM_SIZE)
+            values.tofile(f)
+
+    def series_keys(self, address: Optional[str] = None) -> List[SeriesKey]:
+        """Lists the series, of one address or of all of them."""
+        if not os.path.isdir(self._root):
+            return []
+        addresses = ([_quote(address)] if address is not None
+                     else sorted(os.listdir(self._root)))
+        keys = []
+        for quoted_address in addresses:
+            address_dir = os.path.join(self._root, quoted_address)
+            if not os.path.isdir(address_dir):
+                continue
+            for quoted_platform in sorted(os.listdir(address_dir)):
+                platform_dir = os.path.join(address_dir, quoted_platform)
+                for quoted_asset in sorted(os.listdir(platform_dir)):
+                    keys.append(SeriesKey(_unquote(quoted_address),
+                                          _unquote(quoted_platform),
+                                          _unquote(quoted_asset)))
+        return keys
+
+    def _mapped_range(self, key: SeriesKey, start: Optional[float],
+                      end: Optional[float]):
+        """Returns (mapped columns by name, first index, end index)."""
+        series_dir = self._series_dir(key)
+        length = self._length(series_dir)
+        columns = {'time': _MappedColumn(
+            os.path.join(series_dir, _TIME_COLUMN), 'q', length)}
+        for name, column in _VALUE_COLUMNS.items():
+            columns[name] = _MappedColumn(os.path.join(series_dir, column),
+                                          'd', length)
+        times = columns['time'].view
+        first = 0 if start is None else bisect.bisect_left(times, start)
+        last = length if end is None else bisect.bisect_left(times, end)
+        return columns, first, last
+
+    def query(self,
+              key: SeriesKey,
+              start: Optional[float] = None,
+              end: Optional[float] = None) -> Series:
+        """Returns the rows of the series with start <= time < end."""
+        columns, first, last = self._mapped_range(key, start, end)
+        try:
+            return Series(
+                key=key,
+                times=_copy(columns['time'], 'q', first, last),
+                **{name: _copy(columns[name], 'd', first, last)
+                   for name in _VALUE_COLUMNS})
+        finally:
+            for column in columns.values():
+                column.close()
+
+    def downsample(self,
+                   key: SeriesKey,
+                   bucket_seconds: int,
+                   start: Optional[float] = None,
+                   end: Optional[float] = None) -> List[Bucket]:
+        """Averages the series per bucket, e.g. 3600 for hourly averages.
+
+        Buckets are aligned on multiples of `bucket_seconds` since the epoch;
+        empty buckets are omitted. Only one bucket is held in memory at a
+        time, besides the result.
+        """
+        columns, first, last = self._mapped_range(key, start, end)
+        try:
+            return list(_buckets(columns, first, last, bucket_seconds))
+        finally:
+            for column in columns.values():
+                column.close()
+
+
+def _copy(column: _MappedColumn, typecode: str, first: int,
+          last: int) -> array.array:
+    values = array.array(typecode)
+    if last > first:
+        values.frombytes(column.view[first:last].cast('B'))
+    return values
+
+
+def _buckets(columns: Dict[str, _MappedColumn], first: int, last: int,
+             bucket_seconds: int) -> Iterator[Bucket]:
+    times = columns['time'].view
+    index = first
+    while index < last:
+        bucket_start = times[index] - times[index] % bucket_seconds
+        bucket_end = min(last, bisect.bisect_left(
+            times, bucket_start + bucket_seconds, index, last))
+        means = {}
+        for name in _VALUE_COLUMNS:
+            values = [v for v in columns[name].view[index:bucket_end]
+                      if not math.isnan(v)]
+            means[name] = sum(values) / len(values) if values else None
+        yield Bucket(start=bucket_start, count=bucket_end - index, **means)
+        index = bucket_end
+
+
+def _parse_time(text: str) -> float:
+    try:
+        return float(text)
+    except ValueError:
+        parsed = datetime.datetime.fromisoformat(text)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+        return parsed.timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('store', help='The store directory.')
+    parser.add_argument('-a', '--address', default=None,
+                        help='Only series of this Solana address.')
+    parser.add_argument('--platform', default=None,
+                        help='Only series of this platform.')
+    parser.add_argument('--asset', default=None,
+                        help='Only series of this asset.')
+    parser.add_argument('--since', type=_parse_time, default=None,
+                        help='Start time (unix seconds or ISO 8601, UTC).')
+    parser.add_argument('--until', type=_parse_time, default=None,
+                        help='End time, excluded.')
+    parser.add_argument('--bucket', type=int, default=None,
+                        help='Average per bucket of this many seconds, e.g. '
+                             '3600 for hourly.')
+    args = parser.parse_args()
+
+    store = YieldFarmingStore(args.store)
+    result = []
+    for key in store.series_keys(args.address):
+        if ((args.platform is not None and key.platform != args.platform) or
+                (args.asset is not None and key.asset != args.asset)):
+            continue
+        if args.bucket is not None:
+            points = [dataclasses.asdict(bucket) for bucket in
+                      store.downsample(key, args.bucket, args.since,
+                                       args.until)]
+        else:
+            series = store.query(key, args.since, args.until)
+            points = [{'time': t,
+                       **{name: None if math.isnan(value) else value
+                          for name, value in zip(
+                              _VALUE_COLUMNS, (apr, pending, value))}}
+                      for t, apr, pending, value in zip(
+                          series.times, series.apr, series.pending,
+                          series.value)]
+        result.append({**dataclasses.asdict(key), 'points': points})
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
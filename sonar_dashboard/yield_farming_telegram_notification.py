@@ -2,81 +2,115 @@
 
 import argparse
 import logging
+import os
 import sys
-import textwrap
-from typing import Any, Dict
 
-from selenium import webdriver
-import telegram
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
 
-import sonar_dashboard
+import browser_pool
+import telegram_queue
+import yield_farming
+from common import profiling
 
 
-_WAIT_FOR_SONAR_LOADING_SECONDS = 20.0
-
-
-def _format_data_row(data_row: Dict[str, Any]) -> str:
-    return textwrap.dedent(f"""\
-        {data_row['Asset']} ({data_row['Platform']})
-        - APR: {data_row['APR']}
-        - Pending: {data_row['Pending']}
-        - Value: {data_row['Value']}""")
+_WAIT_FOR_SONAR_LOADING_SECONDS = 60.0
+_DEFAULT_NUM_BROWSERS = 4
 
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('-a',
                         '--address',
+                        nargs='+',
                         required=True,
-                        help='The Solana address.')
+                        help='The Solana address(es).')
     parser.add_argument('-c',
                         '--telegram_chat_id',
+                        nargs='+',
                         required=True,
-                        help='The telegram chat to send message to.')
+                        help='The telegram chat(s) to send messages to.')
     parser.add_argument('-t',
                         '--telegram_bot_token',
                         required=True,
                         help='The telegram bot token to send notification.')
+    parser.add_argument('--undelivered',
+                        help='JSON file keeping undelivered messages, which '
+                             'are sent again by the next run.',
+                        default=None)
+    parser.add_argument('--browsers',
+                        help='The maximum number of concurrent browsers.',
+                        type=int,
+                        default=_DEFAULT_NUM_BROWSERS)
     parser.add_argument('--wait',
-                        help='The duration in seconds for Sonar to load.',
+                        help='The maximum duration in seconds for Sonar to '
+                             'load.',
                         type=float,
                         default=_WAIT_FOR_SONAR_LOADING_SECONDS)
     parser.add_argument('--debug',
                         action='store_true',
                         help='To enable debug mode.')
+    parser.add_argument('--load_times_log',
+                        help='File to append Sonar load times to (JSON lines).',
+                        default=None)
+    profiling.add_profile_arguments(parser)
     args = parser.parse_args()
 
+    with profiling.profile_from_args(args):
+        _run(args)
+
+
+def _run(args: argparse.Namespace):
     # Set up logging.
     logger = logging.getLogger(name=__name__)
     logging_level = logging.DEBUG if args.debug else logging.WARNING
     logger.setLevel(logging_level)
 
-    # Init web driver.
-    try:
-        options = webdriver.ChromeOptions()
-        options.headless = False if args.debug else True
-        driver = webdriver.Chrome(options=options)
-    except:
-        logger.exception('Cannot initialize selenium web driver.')
-        sys.exit(1)
+    # Init web drivers.
+    with profiling.phase('load'):
+        try:
+            pool = browser_pool.BrowserPool(
+                size=min(args.browsers, len(args.address)),
+                headless=not args.debug)
+        except:
+            logger.exception('Cannot initialize selenium web driver.')
+            sys.exit(1)
 
     # Find Sonar dashboard sections. (History, Wallet tokens, ...)
     # Our target is the "Yield farming" section.
-    sections = sonar_dashboard.get_sonar_dashboard_sections(
-        selenium_driver=driver,
-        solana_address=args.address,
-        wait_for_loading=args.wait)
-
-    for section in sections:
-        if section.title == 'Yield farming':
-            telegram_message = '🧑‍🌾 🧑‍🌾 🧑‍🌾 Yield Farmer 🧑‍🌾 🧑‍🌾 🧑‍🌾\n\n'
-            telegram_message += '\n\n'.join(
-                _format_data_row(row) for row in section.data_table.data_rows)
-            telegram_message += f'\n\nhttps://sonar.watch/dashboard/{args.address}'
-            bot = telegram.Bot(token=args.telegram_bot_token)
-            bot.send_message(text=telegram_message,
-                             chat_id=args.telegram_chat_id,
-                             disable_web_page_preview=True)
+    with pool, profiling.phase('fetch'):
+        address_to_sections = browser_pool.scrape_addresses(
+            pool,
+            args.address,
+            wait_for_loading=args.wait,
+            section_titles=(yield_farming.YIELD_FARMING_TITLE,),
+            load_times_path=args.load_times_log)
+
+    with profiling.phase('render'):
+        # Rows of all addresses, coalesced into as few messages as fit.
+        parts = []
+        for address, sections in address_to_sections.items():
+            if isinstance(sections, Exception):
+                continue
+            for section in sections:
+                if section.title == yield_farming.YIELD_FARMING_TITLE:
+                    parts.extend(yield_farming.format_data_row(row)
+                                 for row in section.data_table.data_rows)
+                    parts.append(yield_farming.dashboard_url(address))
+        import telegram
+
+        delivery_queue = telegram_queue.DeliveryQueue(
+            telegram.Bot(token=args.telegram_bot_token),
+            persist_path=args.undelivered,
+            disable_web_page_preview=True)
+        for chat_id in args.telegram_chat_id:
+            delivery_queue.enqueue(chat_id, parts,
+                                   header=yield_farming.MESSAGE_HEADER)
+        undelivered = delivery_queue.flush()
+
+    if undelivered or any(isinstance(sections, Exception)
+                          for sections in address_to_sections.values()):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,344 @@
+"""Local valuation server keeping portfolios and rates warm in memory.
+
+Serves JSON over HTTP, on localhost or on a Unix socket:
+
+    GET /portfolios         Names of the portfolios.
+    GET /portfolios/<name>  Totals and breakdowns of one portfolio.
+    GET /totals             Totals of all portfolios.
+    GET /status             Load and rate refresh times.
+
+Every response body is prepared when the portfolios or rates change, so a
+query only looks a dict up and writes bytes. The YAML file is reloaded when
+its modification time changes, and rates are refreshed in the background;
+a rate that cannot be refreshed keeps its previous value.
+
+Example:
+    python valuation_server.py -p portfolios.yaml --unix_socket /tmp/val.sock
+    curl --unix-socket /tmp/val.sock http://localhost/totals
+"""
+import argparse
+from collections import defaultdict
+import decimal
+import http
+import http.server
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import urllib.parse
+
+import yaml
+
+from common import metrics
+import converter
+from models import portfolio_model
+import quote_providers
+
+
+_DEFAULT_PORT = 8780
+_DEFAULT_PRECISION = 6  # The same as main.py.
+_DEFAULT_RELOAD_INTERVAL_SECONDS = 1.0
+_DEFAULT_REFRESH_INTERVAL_SECONDS = 60.0
+
+_REQUEST_SECONDS = metrics.Histogram(
+    'asset_tracker_valuation_request_seconds',
+    'Latency of valuation server requests, by route and status.',
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.1))
+
+logger = logging.getLogger(__name__)
+
+
+class _Snapshot:
+    """Prepared response bodies for one version of portfolios and rates."""
+
+    def __init__(self,
+                 portfolios: List[portfolio_model.Portfolio],
+                 rates: portfolio_model.RATES_TYPE_ALIAS,
+                 precision: int,
+                 loaded_at: float,
+                 rates_updated_at: float):
+        self.responses: Dict[str, Tuple[int, bytes]] = {}
+        all_portfolio_totals = defaultdict(decimal.Decimal)
+        incomplete = []
+        with decimal.localcontext() as context:
+            context.prec = precision
+            for portfolio in portfolios:
+                path = '/portfolios/' + portfolio.name
+                try:
+                    converted_assets = portfolio.convert(rates)
+                    totals = portfolio.calculate_totals(rates)
+                except KeyError as e:
+                    incomplete.append(portfolio.name)
+                    self.responses[path] = _json_response(
+                        http.HTTPStatus.SERVICE_UNAVAILABLE,
+                        {'name': portfolio.name,
+                         'error': f'Missing rate: {e.args[0]}'})
+                    continue
+                for asset in totals:
+                    all_portfolio_totals[asset.symbol] += asset.quantity
+                self.responses[path] = _json_response(http.HTTPStatus.OK, {
+                    'name': portfolio.name,
+                    'totals': _totals_dict(
+                        (asset.symbol, asset.quantity) for asset in totals),
+                    'breakdowns': [
+                        {'symbol': str(original.symbol),
+                         'quantity': str(original.quantity),
+                         'converted_symbol': str(converted.symbol),
+                         'converted_quantity': str(converted.quantity)}
+                        for original, converted in zip(portfolio.assets,
+                                                       converted_assets)],
+                })
+        self.responses['/portfolios'] = _json_response(
+            http.HTTPStatus.OK, [portfolio.name for portfolio in portfolios])
+        self.responses['/totals'] = _json_response(http.HTTPStatus.OK, {
+            'totals': _totals_dict(all_portfolio_totals.items()),
+            'incomplete_portfolios': incomplete,
+        })
+        self.responses['/status'] = _json_response(http.HTTPStatus.OK, {
+            'portfolios': len(portfolios),
+            'rates': len(rates),
+            'loaded_at': loaded_at,
+            'rates_updated_at': rates_updated_at,
+        })
+
+
+def _totals_dict(items) -> Dict[str, str]:
+    # Decimals as strings, to keep them exact.
+    return {str(symbol): str(quantity) for symbol, quantity in items}
+
+
+def _json_response(status: int, body: Any) -> Tuple[int, bytes]:
+    return status, json.dumps(body).encode()
+
+
+_NOT_FOUND = _json_response(http.HTTPStatus.NOT_FOUND, {'error': 'Not found'})
+
+
+class ValuationService:
+    """Keeps the portfolios and rates up to date, and the current snapshot.
+
+    Readers only take a reference to the current snapshot, which is replaced
+    as a whole, so they never wait for a reload or a refresh.
+    """
+
+    def __init__(self,
+                 portfolio_yaml: str,
+                 precision: int = _DEFAULT_PRECISION,
+                 reload_interval: float = _DEFAULT_RELOAD_INTERVAL_SECONDS,
+                 refresh_interval: float = _DEFAULT_REFRESH_INTERVAL_SECONDS,
+                 providers: Sequence[quote_providers.QuoteProvider] = ()):
+        self._portfolio_yaml = portfolio_yaml
+        self._precision = precision
+        self._reload_interval = reload_interval
+        self._refresh_interval = refresh_interval
+        self._providers = providers
+        self._lock = threading.Lock()  # Guards the state; not held to fetch.
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._portfolios: List[portfolio_model.Portfolio] = []
+        self._mtime: Optional[float] = None
+        self._loaded_at = 0.0
+        self._rates: portfolio_model.RATES_TYPE_ALIAS = {}
+        self._rates_updated_at = 0.0
+        self.snapshot: Optional[_Snapshot] = None
+
+    def start(self) -> 'ValuationService':
+        self.reload()
+        for target, name in ((self._reload_loop, 'valuation-reload'),
+                             (self._refresh_loop, 'valuation-refresh')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def reload(self) -> bool:
+        """Reloads the YAML file if it changed; returns whether it did."""
+        with self._lock:
+            previous_mtime = self._mtime
+            mtime = os.stat(self._portfolio_yaml).st_mtime
+            if mtime == previous_mtime:
+                return False
+            data = yaml.safe_load(open(self._portfolio_yaml, 'r'))
+            portfolios = [
+                portfolio_model.Portfolio.from_dict(portfolio_data)
+                for portfolio_data in data['Portfolios']]
+            # Only fetch the rates of new conversions; the others are kept
+            # up to date by the refresh loop.
+            missing = {cv for cv in self._required_conversions(portfolios)
+                       if (cv.from_symbol, cv.to_symbol) not in self._rates}
+        # Fetched without the lock, so that refreshes are not delayed.
+        rates = self._fetch_rates(missing)
+        with self._lock:
+            if self._mtime != previous_mtime:
+                return False  # Another reload got there first.
+            self._portfolios = portfolios
+            self._mtime = mtime
+            self._loaded_at = time.time()
+            if rates:
+                self._rates.update(rates)
+                self._rates_updated_at = self._loaded_at
+            self._rebuild()
+        logger.info('Loaded %d portfolios.', len(portfolios))
+        return True
+
+    def refresh_rates(self) -> None:
+        """Refetches all rates, keeping the previous ones on failure."""
+        with self._lock:
+            conversions = self._required_conversions(self._portfolios)
+        # Fetched without the lock, so that reloads are not delayed.
+        rates = self._fetch_rates(conversions)
+        with self._lock:
+            self._rates.update(rates)
+            self._rates_updated_at = time.time()
+            self._rebuild()
+
+    @staticmethod
+    def _required_conversions(portfolios):
+        conversions = set()
+        for portfolio in portfolios:
+            conversions |= portfolio.get_required_conversions()
+        return conversions
+
+    def _fetch_rates(self, conversions) -> portfolio_model.RATES_TYPE_ALIAS:
+        # One call for all, so that the quote providers get whole batches.
+        def unavailable(cv):
+            logger.warning('Cannot get the rate of %s.', cv)
+            return None
+
+        rates = converter.get_rates(conversions, fallback=unavailable,
+                                    quote_providers=self._providers)
+        return {key: rate for key, rate in rates.items() if rate is not None}
+
+    def _rebuild(self) -> None:
+        self.snapshot = _Snapshot(self._portfolios, dict(self._rates),
+                                  self._precision, self._loaded_at,
+                                  self._rates_updated_at)
+
+    def _reload_loop(self) -> None:
+        while not self._stop.wait(self._reload_interval):
+            try:
+                self.reload()
+            except Exception:
+                logger.exception('Reloading %s failed.', self._portfolio_yaml)
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.wait(self._refresh_interval):
+            try:
+                self.refresh_rates()
+            except Exception:
+                logger.exception('Refreshing rates failed.')
+
+
+def _make_handler(service: ValuationService):
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'  # Keep-alive for repeated queries.
+        # Buffered, so headers and body leave in one write after do_GET
+        # instead of waiting on a delayed ACK between them.
+        wbufsize = -1
+
+        def do_GET(self):
+            path = urllib.parse.unquote(
+                urllib.parse.urlsplit(self.path).path).rstrip('/')
+            route = '/portfolios/*' if path.startswith('/portfolios/') else path
+            with _REQUEST_SECONDS.time(route=route,
+                                       status='error') as labels:
+                status, body = service.snapshot.responses.get(path,
+                                                              _NOT_FOUND)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                labels['status'] = int(status)
+
+        def address_string(self):
+            # Unix socket clients have no address.
+            return self.client_address[0] if self.client_address else 'unix'
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return Handler
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                               socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def server_bind(self):
+        # Mirror HTTPServer.server_bind for the handler's needs.
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-p', '--portfolio_yaml', required=True,
+                        help='Path to YAML file that stores portfolio data.')
+    address = parser.add_mutually_exclusive_group()
+    address.add_argument('--port', type=int, default=_DEFAULT_PORT,
+                         help='The localhost HTTP port.')
+    address.add_argument('--unix_socket', default=None,
+                         help='Serve on this Unix socket instead.')
+    parser.add_argument('--precision', type=int, default=_DEFAULT_PRECISION,
+                        help='Decimal precision of the valuations.')
+    parser.add_argument('--reload_interval', type=float,
+                        default=_DEFAULT_RELOAD_INTERVAL_SECONDS,
+                        help='Seconds between checks of the YAML file.')
+    parser.add_argument('--refresh_interval', type=float,
+                        default=_DEFAULT_REFRESH_INTERVAL_SECONDS,
+                        help='Seconds between rate refreshes.')
+    parser.add_argument('--debug', action='store_true',
+                        help='Enable debug logging.')
+    quote_providers.add_quote_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+    metrics.metrics_from_args(args)
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    service = ValuationService(args.portfolio_yaml,
+                               precision=args.precision,
+                               reload_interval=args.reload_interval,
+                               refresh_interval=args.refresh_interval,
+                               providers=quote_providers.providers_from_args(
+                                   args)).start()
+    handler = _make_handler(service)
+    if args.unix_socket is not None:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        server = _ThreadingUnixHTTPServer(args.unix_socket, handler)
+        logger.info('Serving on %s', args.unix_socket)
+    else:
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', args.port),
+                                                 handler)
+        logger.info('Serving on http://127.0.0.1:%d', args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        if args.unix_socket is not None:
+            os.remove(args.unix_socket)
+
+
+if __name__ == '__main__':
+    main()